@@ -8,9 +8,20 @@ import itertools
 import sys
 import time
 import argparse
-import requests
+import gzip
+import concurrent.futures
+import collections
 from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 from datetime import datetime
+from pe_version import read_version_info, PEFormatError
+from dll_cache import DllInventoryCache
+from delta_upload import LastUploadState, normalize_snapshot, snapshot_content_hash
+from ps_runner import PowerShellRunner, build_registry_script, build_services_script, run_batch
 
 # --- Spinner utilities ---
 spinner_running = False
@@ -24,6 +35,19 @@ def spinner_task():
         time.sleep(0.1)
     sys.stdout.write('\r')
 
+# --- Subprocess accounting ---
+# Processes started per section, reported in collection_stats
+subprocess_counts = collections.Counter()
+subprocess_counts_lock = threading.Lock()
+
+def count_subprocess(section, count=1):
+    with subprocess_counts_lock:
+        subprocess_counts[section] += count
+
+def check_output_counted(section, args, **kwargs):
+    count_subprocess(section)
+    return subprocess.check_output(args, **kwargs)
+
 # --- Helper Functions ---
 def get_os_info():
     return {
@@ -35,7 +59,7 @@ def get_os_info():
 
 def get_dotnet_versions():
     try:
-        output = subprocess.check_output([
+        output = check_output_counted("dotnet_frameworks_installed", [
             "powershell", "-Command",
             "Get-ChildItem 'HKLM:\\SOFTWARE\\Microsoft\\NET Framework Setup\\NDP' -Recurse | "
             "Get-ItemProperty -Name Version -ErrorAction SilentlyContinue | "
@@ -47,44 +71,63 @@ def get_dotnet_versions():
     except Exception as e:
         return [f"Error retrieving .NET versions: {e}"]
 
-def list_dll_versions(app_folder_path):
-    dll_versions = {}
+def probe_dll_with_powershell(file_path):
+    try:
+        file_version_output = check_output_counted("app_folder_dlls", [
+            "powershell", "-Command",
+            f"(Get-Item '{file_path}').VersionInfo.FileVersion"
+        ], text=True, timeout=10)
+        file_version = file_version_output.strip()
+
+        try:
+            assembly_version_output = check_output_counted("app_folder_dlls", [
+                "powershell", "-Command",
+                f"([Reflection.AssemblyName]::GetAssemblyName('{file_path}')).Version.ToString()"
+            ], text=True, timeout=10)
+            assembly_version = assembly_version_output.strip()
+        except:
+            assembly_version = "Not .NET Assembly"
+
+        return {
+            "file_version": file_version,
+            "assembly_version": assembly_version
+        }
+    except subprocess.TimeoutExpired:
+        return {"file_version": "Timeout", "assembly_version": "Timeout"}
+    except Exception as e:
+        return {
+            "file_version": "Unknown",
+            "assembly_version": "Unknown",
+            "error": str(e)
+        }
+
+def probe_dll(file_path):
+    # Native PE parsing first; PowerShell only for files the parser rejects
+    try:
+        return read_version_info(file_path)
+    except (PEFormatError, OSError):
+        return probe_dll_with_powershell(file_path)
+
+def list_dll_versions(app_folder_path, cache=None, workers=1):
     if not os.path.exists(app_folder_path):
         return {"error": "App folder not found."}
 
+    dll_paths = []
     for root, dirs, files in os.walk(app_folder_path):
         for file in files:
             if file.endswith(".dll"):
-                file_path = os.path.join(root, file)
-                try:
-                    file_version_output = subprocess.check_output([
-                        "powershell", "-Command",
-                        f"(Get-Item '{file_path}').VersionInfo.FileVersion"
-                    ], text=True, timeout=10)
-                    file_version = file_version_output.strip()
-
-                    try:
-                        assembly_version_output = subprocess.check_output([
-                            "powershell", "-Command",
-                            f"([Reflection.AssemblyName]::GetAssemblyName('{file_path}')).Version.ToString()"
-                        ], text=True, timeout=10)
-                        assembly_version = assembly_version_output.strip()
-                    except:
-                        assembly_version = "Not .NET Assembly"
-
-                    dll_versions[file_path] = {
-                        "file_version": file_version,
-                        "assembly_version": assembly_version
-                    }
-                except subprocess.TimeoutExpired:
-                    dll_versions[file_path] = {"file_version": "Timeout", "assembly_version": "Timeout"}
-                except Exception as e:
-                    dll_versions[file_path] = {
-                        "file_version": "Unknown",
-                        "assembly_version": "Unknown",
-                        "error": str(e)
-                    }
-    return dll_versions
+                dll_paths.append(os.path.join(root, file))
+
+    if cache is not None:
+        probe = lambda file_path: cache.get_or_probe(file_path, probe_dll)
+    else:
+        probe = probe_dll
+
+    if workers <= 1:
+        return {file_path: probe(file_path) for file_path in dll_paths}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(dll_paths, executor.map(probe, dll_paths)))
 
 def find_config_file(app_folder, app_type):
     if app_type.lower() == "desktop":
@@ -126,42 +169,23 @@ def read_app_config(config_path):
 
     return config_data
 
-def read_registry_keys(keys_to_read):
-    registry_data = {}
-    for reg_path in keys_to_read:
-        try:
-            output = subprocess.check_output([
-                "powershell", "-Command",
-                f"Get-ItemProperty -Path '{reg_path}' | Select-Object *"
-            ], text=True)
-
-            props = {}
-            for line in output.splitlines():
-                if ':' in line:
-                    parts = line.split(':', 1)
-                    key = parts[0].strip()
-                    value = parts[1].strip()
-                    props[key] = value
-
-            registry_data[reg_path] = props
-
-        except Exception as e:
-            registry_data[reg_path] = {"error": str(e)}
-    return registry_data
-
-def check_services(service_names):
-    service_status = {}
-    for service in service_names:
-        try:
-            output = subprocess.check_output([
-                "powershell", "-Command",
-                f"(Get-Service -Name '{service}').Status"
-            ], text=True)
-            status = output.strip()
-            service_status[service] = status
-        except Exception as e:
-            service_status[service] = "Service not found or error"
-    return service_status
+def read_registry_keys(keys_to_read, runner=None):
+    if not keys_to_read:
+        return {}
+    runner = runner or PowerShellRunner()
+    return run_batch(
+        runner, build_registry_script(keys_to_read), keys_to_read,
+        lambda message: {"error": message}
+    )
+
+def check_services(service_names, runner=None):
+    if not service_names:
+        return {}
+    runner = runner or PowerShellRunner()
+    return run_batch(
+        runner, build_services_script(service_names), service_names,
+        lambda message: "Service not found or error"
+    )
 
 def read_environment_variables(variable_names):
     env_vars = {}
@@ -170,6 +194,55 @@ def read_environment_variables(variable_names):
         env_vars[var] = value
     return env_vars
 
+# --- Upload helpers ---
+def encode_snapshot_payload(snapshot, compression="gzip"):
+    """
+    Serializes the snapshot compactly and compresses it for upload.
+
+    Returns:
+        tuple: (payload bytes, upload filename, content type)
+    """
+    raw = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+    if compression == "zstd" and zstandard is None:
+        print("\n\u26A0 zstandard is not installed, falling back to gzip")
+        compression = "gzip"
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(raw), "context_snapshot.json.zst", "application/zstd"
+    if compression == "gzip":
+        return gzip.compress(raw, compresslevel=6), "context_snapshot.json.gz", "application/gzip"
+    return raw, "context_snapshot.json", "application/json"
+
+# --- Section runner ---
+def timed_call(func):
+    start = time.perf_counter()
+    try:
+        result = func()
+    except Exception as e:
+        result = {"error": str(e)}
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+def collect_sections(sections, workers=1):
+    """
+    Runs each collection section and records its wall time.
+
+    Args:
+        sections (dict): Section name -> zero-argument callable.
+        workers (int): Max sections running at once; 1 runs them in order.
+
+    Returns:
+        tuple: (results dict in the order of `sections`, timings dict in ms)
+    """
+    if workers <= 1:
+        outcomes = {name: timed_call(func) for name, func in sections.items()}
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(timed_call, func) for name, func in sections.items()}
+            outcomes = {name: future.result() for name, future in futures.items()}
+
+    results = {name: outcome[0] for name, outcome in outcomes.items()}
+    timings = {name: outcome[1] for name, outcome in outcomes.items()}
+    return results, timings
+
 # --- Main ---
 def main():
     global spinner_running
@@ -179,6 +252,11 @@ def main():
     parser.add_argument("--app-folder", help="Path to the application folder")
     parser.add_argument("--app-type", help="Type of application: desktop or web")
     parser.add_argument("--upload-url", help="Optional: Upload URL to send snapshot")
+    parser.add_argument("--compression", choices=["gzip", "zstd", "none"], default="gzip", help="Encoding of the uploaded snapshot")
+    parser.add_argument("--workers", type=int, default=4, help="Max concurrent collection sections and DLL probes (1 = sequential)")
+    parser.add_argument("--no-dll-cache", action="store_true", help="Probe every DLL instead of reusing the local inventory cache")
+    parser.add_argument("--dll-cache-hash", action="store_true", help="Also compare SHA-256 of each DLL before reusing a cached result")
+    parser.add_argument("--full-upload", action="store_true", help="Always upload the full snapshot instead of a delta against the last upload")
     args = parser.parse_args()
 
     if not args.app_folder or not args.app_type:
@@ -198,21 +276,43 @@ def main():
     services_to_check = ["MSSQL$SQLEXPRESS", "W3SVC"]
     environment_variables_to_read = ["APP_ENV", "ENVIRONMENT"]
 
+    dll_cache = None if args.no_dll_cache else DllInventoryCache(use_hash=args.dll_cache_hash).load()
+    registry_runner = PowerShellRunner()
+    services_runner = PowerShellRunner()
+
+    workers = max(1, args.workers)
+    collection_start = time.perf_counter()
+
+    environment_context, section_timings = collect_sections({
+        "os_info": get_os_info,
+        "dotnet_frameworks_installed": get_dotnet_versions,
+        "app_folder_dlls": lambda: list_dll_versions(app_folder, dll_cache, workers),
+        "app_config_settings": lambda: read_app_config(config_file_path) if config_file_path else {},
+        "critical_registry_keys": lambda: read_registry_keys(registry_keys_to_read, registry_runner),
+        "required_services_status": lambda: check_services(services_to_check, services_runner),
+        "critical_environment_variables": lambda: read_environment_variables(environment_variables_to_read)
+    }, workers)
+
     mcp_context = {
         "application_name": Path(app_folder).name,
         "application_type": app_type,
-        "environment_context": {
-            "os_info": get_os_info(),
-            "dotnet_frameworks_installed": get_dotnet_versions(),
-            "app_folder_dlls": list_dll_versions(app_folder),
-            "app_config_settings": read_app_config(config_file_path) if config_file_path else {},
-            "critical_registry_keys": read_registry_keys(registry_keys_to_read),
-            "required_services_status": check_services(services_to_check),
-            "critical_environment_variables": read_environment_variables(environment_variables_to_read)
-        },
+        "environment_context": environment_context,
         "timestamp": datetime.now().astimezone().isoformat()
     }
 
+    count_subprocess("critical_registry_keys", registry_runner.process_count)
+    count_subprocess("required_services_status", services_runner.process_count)
+    collection_stats = {
+        "workers": workers,
+        "total_ms": round((time.perf_counter() - collection_start) * 1000, 1),
+        "section_timings_ms": section_timings,
+        "subprocess_counts": {name: subprocess_counts[name] for name in section_timings}
+    }
+    if dll_cache is not None:
+        dll_cache.save()
+        collection_stats["dll_cache"] = dll_cache.stats()
+    mcp_context["collection_stats"] = collection_stats
+
     output_file = "context_snapshot.json"
     with open(output_file, "w") as f:
         json.dump(mcp_context, f, indent=4)
@@ -225,20 +325,50 @@ def main():
     # --- Try uploading if upload-url provided ---
     if args.upload_url:
         try:
-            with open(output_file, "rb") as f:
-                files = {"snapshot": (output_file, f, "application/json")}
-                data = {
-                        "hostname": platform.node(),
-                        "app_path": args.app_folder
-                    }
-
-
-                print(f"Uploading to {args.upload_url} with hostname {platform.node()}...")
-
+            # Hash and diff the snapshot exactly as the backend will parse it
+            snapshot = normalize_snapshot(mcp_context)
+            snapshot_hash = snapshot_content_hash(snapshot)
+            upload_state = LastUploadState(args.upload_url, app_folder).load()
+            payload, upload_name, content_type = encode_snapshot_payload(snapshot, args.compression)
+            data = {
+                    "hostname": platform.node(),
+                    "app_path": args.app_folder
+                }
+
+            # Only loaded for uploads: importing requests is a large part of the agent's startup
+            import requests
+
+            response = None
+            delta = None if args.full_upload else upload_state.delta(snapshot)
+            if delta is not None:
+                operations, base_hash = delta
+                patch_payload, patch_name, patch_type = encode_snapshot_payload(operations, args.compression)
+                # A snapshot that changed almost entirely is cheaper to send whole
+                if len(patch_payload) < len(payload):
+                    print(f"Uploading delta to {args.upload_url} with hostname {platform.node()} "
+                          f"({len(operations)} changes, {len(patch_payload)} bytes instead of {len(payload)})...")
+                    response = requests.post(
+                        args.upload_url, files={"snapshot": (patch_name, patch_payload, patch_type)},
+                        data=dict(data, base_hash=base_hash, target_hash=snapshot_hash), timeout=120
+                    )
+                    if response.status_code != 200:
+                        # Unknown base, a backend without delta support, or a rejected patch
+                        print(f" Delta upload not accepted (Status: {response.status_code} Response: {response.text}), "
+                              f"uploading the full snapshot")
+                        response = None
+
+            if response is None:
+                files = {"snapshot": (upload_name, payload, content_type)}
+                print(f"Uploading to {args.upload_url} with hostname {platform.node()} ({len(payload)} bytes, {args.compression})...")
                 response = requests.post(args.upload_url, files=files, data=data, timeout=120)
 
             if response.status_code == 200:
                 print(" Successfully uploaded snapshot to backend!")
+                # Backends without delta support return no hash; keep no base for them
+                if response.json().get("snapshot_hash") == snapshot_hash:
+                    upload_state.save(snapshot, snapshot_hash)
+                else:
+                    upload_state.clear()
             else:
                 print(f" Failed to upload snapshot. Status: {response.status_code} Response: {response.text}")
         except Exception as e:
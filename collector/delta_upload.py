@@ -0,0 +1,126 @@
+"""
+Delta uploads for the collector.
+
+Keeps the last snapshot uploaded for an (upload URL, app folder) pair with
+the content hash the backend returned for it. The next upload can then send
+just a JSON Patch against that snapshot; if the backend no longer knows the
+base, the agent uploads the full snapshot instead.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+STATE_FORMAT_VERSION = 1
+
+ENVIRONMENT_CONTEXT = "environment_context"
+
+
+# --- Content hash; must match enveye-backend/snapshot_store.py ---
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def section_hash(value):
+    return hashlib.sha256(canonical_json(value)).hexdigest()
+
+
+def snapshot_content_hash(snapshot):
+    env = snapshot.get(ENVIRONMENT_CONTEXT)
+    sections = {name: section_hash(value) for name, value in env.items()} if isinstance(env, dict) else {}
+    top_level = {k: v for k, v in snapshot.items() if k != ENVIRONMENT_CONTEXT}
+    return hashlib.sha256(canonical_json({"top_level": top_level, "sections": sections})).hexdigest()
+
+
+# --- JSON Patch (RFC 6902), applied by enveye-backend/snapshot_delta.py ---
+def escape_pointer_token(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def make_patch(old, new, path=""):
+    """
+    The operations that turn `old` into `new`. Dicts are compared key by key;
+    lists and scalars that differ are replaced as a whole.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{escape_pointer_token(key)}"})
+        for key, value in new.items():
+            child = f"{path}/{escape_pointer_token(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            elif old[key] != value:
+                ops.extend(make_patch(old[key], value, child))
+        return ops
+    if old == new and type(old) is type(new):
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+# --- Last uploaded snapshot ---
+def default_state_dir():
+    # Next to collector_agent.exe when frozen, next to the script otherwise
+    if getattr(sys, "frozen", False):
+        return Path(sys.executable).resolve().parent
+    return Path(__file__).resolve().parent
+
+
+def normalize_snapshot(snapshot):
+    """The snapshot as the backend will parse it (tuples become lists, keys become strings)."""
+    return json.loads(json.dumps(snapshot))
+
+
+class LastUploadState:
+    """The snapshot last accepted by one backend for one app folder, and its hash."""
+
+    def __init__(self, upload_url, app_folder, state_dir=None):
+        key = hashlib.sha1(f"{upload_url}\n{os.path.abspath(app_folder)}".encode("utf-8")).hexdigest()[:12]
+        self.path = Path(state_dir or default_state_dir()) / f"last_upload_{key}.json.gz"
+        self.snapshot = None
+        self.snapshot_hash = None
+
+    def load(self):
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == STATE_FORMAT_VERSION:
+                self.snapshot = data.get("snapshot")
+                self.snapshot_hash = data.get("snapshot_hash")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"\n⚠️ Ignoring unreadable upload state {self.path}: {e}")
+        return self
+
+    def save(self, snapshot, snapshot_hash):
+        self.snapshot, self.snapshot_hash = snapshot, snapshot_hash
+        data = {"version": STATE_FORMAT_VERSION, "snapshot_hash": snapshot_hash, "snapshot": snapshot}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"\n⚠️ Could not save upload state {self.path}: {e}")
+
+    def clear(self):
+        self.snapshot = self.snapshot_hash = None
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def delta(self, snapshot):
+        """
+        Returns:
+            tuple: (patch operations, base hash) against the last upload, or None
+                when there is no usable last upload.
+        """
+        if self.snapshot is None or not self.snapshot_hash:
+            return None
+        return make_patch(self.snapshot, snapshot), self.snapshot_hash
@@ -0,0 +1,113 @@
+"""
+Persistent DLL inventory cache for the collector.
+
+Stores the probe result of every DLL keyed by path, size and mtime (and
+optionally a SHA-256 of the content) so nightly collections only re-probe
+files that were added or changed since the previous run.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+CACHE_FORMAT_VERSION = 1
+CACHE_FILENAME = "dll_inventory_cache.json"
+
+# Results that should be retried on the next run instead of cached
+UNCACHEABLE_VERSIONS = {"Timeout", "Unknown"}
+
+
+def default_cache_path():
+    # Next to collector_agent.exe when frozen, next to the script otherwise
+    if getattr(sys, "frozen", False):
+        base = Path(sys.executable).resolve().parent
+    else:
+        base = Path(__file__).resolve().parent
+    return base / CACHE_FILENAME
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DllInventoryCache:
+    def __init__(self, path=None, use_hash=False):
+        self.path = Path(path) if path else default_cache_path()
+        self.use_hash = use_hash
+        self.entries = {}
+        self.seen = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_FORMAT_VERSION:
+                self.entries = data.get("entries", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"\n⚠️ Ignoring unreadable DLL cache {self.path}: {e}")
+        return self
+
+    def save(self):
+        # Only keep files seen in this run so deleted DLLs drop out of the cache
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_FORMAT_VERSION, "entries": self.seen}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"\n⚠️ Could not save DLL cache to {self.path}: {e}")
+
+    def _signature(self, file_path):
+        st = os.stat(file_path)
+        signature = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if self.use_hash:
+            signature["sha256"] = file_sha256(file_path)
+        return signature
+
+    def get_or_probe(self, file_path, probe):
+        """
+        Returns the cached probe result for `file_path` if its signature is
+        unchanged, otherwise calls `probe(file_path)` and records the result.
+        Safe to call from several probe threads at once.
+        """
+        try:
+            signature = self._signature(file_path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return probe(file_path)
+
+        entry = self.entries.get(file_path)
+        if entry and all(entry.get(k) == v for k, v in signature.items()):
+            with self.lock:
+                self.hits += 1
+                self.seen[file_path] = entry
+            return entry["result"]
+
+        with self.lock:
+            self.misses += 1
+        result = probe(file_path)
+        if not UNCACHEABLE_VERSIONS & {result.get("file_version"), result.get("assembly_version")}:
+            with self.lock:
+                self.seen[file_path] = dict(signature, result=result)
+        return result
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "content_hash": self.use_hash,
+            "cache_file": str(self.path),
+        }
@@ -0,0 +1,384 @@
+"""
+Pure-Python reader for the version information of Windows PE files.
+
+Reads the VS_VERSIONINFO resource (the string the Explorer "Details" tab
+shows as "File version") and, for .NET assemblies, the version stored in the
+CLR metadata Assembly table. Only the structures needed for those two values
+are parsed, so this works on any OS and needs no PowerShell process per DLL.
+"""
+
+import mmap
+import struct
+
+NOT_DOTNET = "Not .NET Assembly"
+
+RT_VERSION = 16
+DIR_RESOURCE = 2
+DIR_CLR_RUNTIME = 14
+VS_FIXEDFILEINFO_SIGNATURE = 0xFEEF04BD
+
+# Fallback order used by FileVersionInfo when no translation entry matches
+DEFAULT_STRING_TABLES = ["040904b0", "040904e4", "04090000"]
+
+
+class PEFormatError(ValueError):
+    """Raised when a file is not a PE image this reader can handle."""
+
+
+# --- Byte helpers ---
+def _u16(buf, offset):
+    try:
+        return struct.unpack_from("<H", buf, offset)[0]
+    except struct.error:
+        raise PEFormatError(f"Truncated read at offset {offset}")
+
+def _u32(buf, offset):
+    try:
+        return struct.unpack_from("<I", buf, offset)[0]
+    except struct.error:
+        raise PEFormatError(f"Truncated read at offset {offset}")
+
+def _align4(value):
+    return (value + 3) & ~3
+
+def _read_utf16z(buf, offset, end):
+    pos = offset
+    while pos + 1 < end:
+        if buf[pos] == 0 and buf[pos + 1] == 0:
+            return bytes(buf[offset:pos]).decode("utf-16-le", errors="replace"), pos + 2
+        pos += 2
+    return bytes(buf[offset:end]).decode("utf-16-le", errors="replace"), end
+
+
+# --- PE headers ---
+class PEImage:
+    """Minimal view over a PE file: sections and data directories."""
+
+    def __init__(self, buf):
+        self.buf = buf
+        if len(buf) < 0x40 or bytes(buf[:2]) != b"MZ":
+            raise PEFormatError("Missing MZ header")
+
+        pe_offset = _u32(buf, 0x3C)
+        if bytes(buf[pe_offset:pe_offset + 4]) != b"PE\0\0":
+            raise PEFormatError("Missing PE signature")
+
+        coff = pe_offset + 4
+        number_of_sections = _u16(buf, coff + 2)
+        optional_size = _u16(buf, coff + 16)
+        optional = coff + 20
+
+        magic = _u16(buf, optional)
+        if magic == 0x10B:
+            rva_count_offset, directories = optional + 92, optional + 96
+        elif magic == 0x20B:
+            rva_count_offset, directories = optional + 108, optional + 112
+        else:
+            raise PEFormatError(f"Unknown optional header magic 0x{magic:x}")
+
+        self.size_of_headers = _u32(buf, optional + 60)
+        rva_count = min(_u32(buf, rva_count_offset), 16)
+        self.directories = [
+            (_u32(buf, directories + i * 8), _u32(buf, directories + i * 8 + 4))
+            for i in range(rva_count)
+        ]
+
+        self.sections = []
+        section_table = optional + optional_size
+        for i in range(number_of_sections):
+            entry = section_table + i * 40
+            virtual_size = _u32(buf, entry + 8)
+            virtual_address = _u32(buf, entry + 12)
+            raw_size = _u32(buf, entry + 16)
+            raw_pointer = _u32(buf, entry + 20)
+            self.sections.append((virtual_address, max(virtual_size, raw_size), raw_pointer))
+
+    def directory(self, index):
+        if index >= len(self.directories):
+            return 0, 0
+        return self.directories[index]
+
+    def rva_to_offset(self, rva):
+        for virtual_address, size, raw_pointer in self.sections:
+            if virtual_address <= rva < virtual_address + size:
+                return rva - virtual_address + raw_pointer
+        if rva < self.size_of_headers:
+            return rva
+        raise PEFormatError(f"RVA 0x{rva:x} is outside every section")
+
+
+# --- VS_VERSIONINFO ---
+def _find_version_resource(image):
+    rva, size = image.directory(DIR_RESOURCE)
+    if not rva or not size:
+        return None
+    base = image.rva_to_offset(rva)
+    buf = image.buf
+
+    def entries(directory_offset):
+        named = _u16(buf, directory_offset + 12)
+        ids = _u16(buf, directory_offset + 14)
+        for i in range(named + ids):
+            entry = directory_offset + 16 + i * 8
+            yield _u32(buf, entry), _u32(buf, entry + 4)
+
+    # Type -> Name -> Language; take the first name and language under RT_VERSION
+    for name, target in entries(base):
+        if name == RT_VERSION and target & 0x80000000:
+            break
+    else:
+        return None
+
+    name_entry = next(entries(base + (target & 0x7FFFFFFF)), None)
+    if name_entry is None or not name_entry[1] & 0x80000000:
+        return None
+    language_entry = next(entries(base + (name_entry[1] & 0x7FFFFFFF)), None)
+    if language_entry is None or language_entry[1] & 0x80000000:
+        return None
+
+    data_entry = base + language_entry[1]
+    data_rva, data_size = _u32(buf, data_entry), _u32(buf, data_entry + 4)
+    start = image.rva_to_offset(data_rva)
+    return bytes(buf[start:start + data_size])
+
+
+def _parse_block(buf, offset, limit):
+    """Returns (key, value_type, value_start, value_end, children_start, block_end)."""
+    length, value_length, value_type = struct.unpack_from("<HHH", buf, offset)
+    if length < 6:
+        raise PEFormatError("Invalid version block length")
+    block_end = min(offset + length, limit)
+    key, pos = _read_utf16z(buf, offset + 6, block_end)
+    value_start = _align4(pos)
+    value_bytes = value_length * 2 if value_type == 1 else value_length
+    value_end = min(value_start + value_bytes, block_end)
+    return key, value_type, value_start, value_end, _align4(value_end), block_end
+
+
+def _children(buf, start, end):
+    pos = start
+    while pos + 6 <= end:
+        block = _parse_block(buf, pos, end)
+        yield block
+        next_pos = _align4(block[5])
+        if next_pos <= pos:
+            break
+        pos = next_pos
+
+
+def parse_version_resource(buf):
+    """
+    Parses a raw VS_VERSIONINFO resource.
+
+    Returns:
+        dict: {"fixed_file_version": "a.b.c.d" or None, "strings": {table: {key: value}},
+               "translations": ["040904b0", ...]}
+    """
+    key, _, value_start, value_end, children_start, block_end = _parse_block(buf, 0, len(buf))
+    if key != "VS_VERSION_INFO":
+        raise PEFormatError("Missing VS_VERSION_INFO block")
+
+    fixed_version = None
+    if value_end - value_start >= 52 and _u32(buf, value_start) == VS_FIXEDFILEINFO_SIGNATURE:
+        ms, ls = _u32(buf, value_start + 8), _u32(buf, value_start + 12)
+        fixed_version = f"{ms >> 16}.{ms & 0xFFFF}.{ls >> 16}.{ls & 0xFFFF}"
+
+    strings = {}
+    translations = []
+    for child_key, _, _, _, child_children, child_end in _children(buf, children_start, block_end):
+        if child_key == "StringFileInfo":
+            for table_key, _, _, _, table_children, table_end in _children(buf, child_children, child_end):
+                table = strings.setdefault(table_key.lower(), {})
+                for name, _, s_start, _, _, s_end in _children(buf, table_children, table_end):
+                    text = bytes(buf[s_start:s_end]).decode("utf-16-le", errors="replace")
+                    table[name] = text.split("\0", 1)[0]
+        elif child_key == "VarFileInfo":
+            for var_key, _, v_start, v_end, _, _ in _children(buf, child_children, child_end):
+                if var_key == "Translation":
+                    for pos in range(v_start, v_end - 3, 4):
+                        language, codepage = _u16(buf, pos), _u16(buf, pos + 2)
+                        translations.append(f"{language:04x}{codepage:04x}")
+
+    return {"fixed_file_version": fixed_version, "strings": strings, "translations": translations}
+
+
+def _string_file_version(info):
+    strings = info["strings"]
+    for table in info["translations"] + DEFAULT_STRING_TABLES:
+        if "FileVersion" in strings.get(table, {}):
+            return strings[table]["FileVersion"]
+    for table in strings.values():
+        if "FileVersion" in table:
+            return table["FileVersion"]
+    return ""
+
+
+# --- CLR metadata ---
+# Column layouts of metadata tables 0x00-0x1F (ECMA-335 II.22). Entries are a byte
+# width, "s"/"g"/"b" for #Strings/#GUID/#Blob heap indexes, ("t", table) for a
+# simple table index, or a coded index name from CODED_INDEXES.
+TABLE_SCHEMAS = [
+    [2, "s", "g", "g", "g"],                                  # 0x00 Module
+    ["ResolutionScope", "s", "s"],                            # 0x01 TypeRef
+    [4, "s", "s", "TypeDefOrRef", ("t", 0x04), ("t", 0x06)],  # 0x02 TypeDef
+    [("t", 0x04)],                                            # 0x03 FieldPtr
+    [2, "s", "b"],                                            # 0x04 Field
+    [("t", 0x06)],                                            # 0x05 MethodPtr
+    [4, 2, 2, "s", "b", ("t", 0x08)],                         # 0x06 MethodDef
+    [("t", 0x08)],                                            # 0x07 ParamPtr
+    [2, 2, "s"],                                              # 0x08 Param
+    [("t", 0x02), "TypeDefOrRef"],                            # 0x09 InterfaceImpl
+    ["MemberRefParent", "s", "b"],                            # 0x0A MemberRef
+    [2, "HasConstant", "b"],                                  # 0x0B Constant
+    ["HasCustomAttribute", "CustomAttributeType", "b"],       # 0x0C CustomAttribute
+    ["HasFieldMarshal", "b"],                                 # 0x0D FieldMarshal
+    [2, "HasDeclSecurity", "b"],                              # 0x0E DeclSecurity
+    [2, 4, ("t", 0x02)],                                      # 0x0F ClassLayout
+    [4, ("t", 0x04)],                                         # 0x10 FieldLayout
+    ["b"],                                                    # 0x11 StandAloneSig
+    [("t", 0x02), ("t", 0x14)],                               # 0x12 EventMap
+    [("t", 0x14)],                                            # 0x13 EventPtr
+    [2, "s", "TypeDefOrRef"],                                 # 0x14 Event
+    [("t", 0x02), ("t", 0x17)],                               # 0x15 PropertyMap
+    [("t", 0x17)],                                            # 0x16 PropertyPtr
+    [2, "s", "b"],                                            # 0x17 Property
+    [2, ("t", 0x06), "HasSemantics"],                         # 0x18 MethodSemantics
+    [("t", 0x02), "MethodDefOrRef", "MethodDefOrRef"],        # 0x19 MethodImpl
+    ["s"],                                                    # 0x1A ModuleRef
+    ["b"],                                                    # 0x1B TypeSpec
+    [2, "MemberForwarded", "s", ("t", 0x1A)],                 # 0x1C ImplMap
+    [4, ("t", 0x04)],                                         # 0x1D FieldRVA
+    [4, 4],                                                   # 0x1E EncLog
+    [4],                                                      # 0x1F EncMap
+]
+ASSEMBLY_TABLE = 0x20
+
+# name -> (tag bits, tables); None marks an unused tag value
+CODED_INDEXES = {
+    "TypeDefOrRef": (2, [0x02, 0x01, 0x1B]),
+    "HasConstant": (2, [0x04, 0x08, 0x17]),
+    "HasCustomAttribute": (5, [0x06, 0x04, 0x01, 0x02, 0x08, 0x09, 0x0A, 0x00, 0x0E, 0x17, 0x14,
+                               0x11, 0x1A, 0x1B, 0x20, 0x23, 0x26, 0x27, 0x28, 0x2A, 0x2C, 0x2B]),
+    "HasFieldMarshal": (1, [0x04, 0x08]),
+    "HasDeclSecurity": (2, [0x02, 0x06, 0x20]),
+    "MemberRefParent": (3, [0x02, 0x01, 0x1A, 0x06, 0x1B]),
+    "HasSemantics": (1, [0x14, 0x17]),
+    "MethodDefOrRef": (1, [0x06, 0x0A]),
+    "MemberForwarded": (1, [0x04, 0x06]),
+    "ResolutionScope": (2, [0x00, 0x1A, 0x23, 0x01]),
+    "CustomAttributeType": (3, [None, None, 0x06, 0x0A, None]),
+}
+
+
+def _column_width(column, rows, heap_sizes):
+    if isinstance(column, int):
+        return column
+    if column == "s":
+        return 4 if heap_sizes & 0x01 else 2
+    if column == "g":
+        return 4 if heap_sizes & 0x02 else 2
+    if column == "b":
+        return 4 if heap_sizes & 0x04 else 2
+    if isinstance(column, tuple):
+        return 4 if rows[column[1]] >= 1 << 16 else 2
+    bits, tables = CODED_INDEXES[column]
+    largest = max(rows[t] for t in tables if t is not None)
+    return 4 if largest >= 1 << (16 - bits) else 2
+
+
+def _metadata_streams(buf, root):
+    if _u32(buf, root) != 0x424A5342:  # "BSJB"
+        raise PEFormatError("Invalid CLR metadata signature")
+    version_length = _u32(buf, root + 12)
+    pos = root + 16 + version_length
+    stream_count = _u16(buf, pos + 2)
+    pos += 4
+
+    streams = {}
+    for _ in range(stream_count):
+        offset, size = _u32(buf, pos), _u32(buf, pos + 4)
+        name_end = bytes(buf[pos + 8:pos + 40]).find(b"\0")
+        if name_end < 0:
+            raise PEFormatError("Unterminated metadata stream name")
+        name = bytes(buf[pos + 8:pos + 8 + name_end]).decode("ascii", errors="replace")
+        streams[name] = (root + offset, size)
+        pos = _align4(pos + 8 + name_end + 1)
+    return streams
+
+
+def read_assembly_version(image):
+    """Returns the AssemblyName version ("a.b.c.d") or NOT_DOTNET."""
+    rva, size = image.directory(DIR_CLR_RUNTIME)
+    if not rva or not size:
+        return NOT_DOTNET
+
+    buf = image.buf
+    cor_header = image.rva_to_offset(rva)
+    metadata_root = image.rva_to_offset(_u32(buf, cor_header + 8))
+    streams = _metadata_streams(buf, metadata_root)
+    tables = streams.get("#~") or streams.get("#-")
+    if tables is None:
+        raise PEFormatError("CLR metadata has no table stream")
+
+    pos = tables[0]
+    heap_sizes = buf[pos + 6]
+    valid = struct.unpack_from("<Q", buf, pos + 8)[0]
+    pos += 24
+
+    rows = [0] * 64
+    for table in range(64):
+        if valid >> table & 1:
+            rows[table] = _u32(buf, pos)
+            pos += 4
+    if heap_sizes & 0x40:
+        pos += 4  # extra data in uncompressed (#-) streams
+
+    if not rows[ASSEMBLY_TABLE]:
+        return NOT_DOTNET  # a netmodule, GetAssemblyName rejects these too
+
+    for table, schema in enumerate(TABLE_SCHEMAS):
+        if rows[table]:
+            pos += rows[table] * sum(_column_width(c, rows, heap_sizes) for c in schema)
+
+    major, minor, build, revision = struct.unpack_from("<HHHH", buf, pos + 4)
+    return f"{major}.{minor}.{build}.{revision}"
+
+
+# --- Entry point ---
+def read_version_info(path):
+    """
+    Reads the file and assembly version of a DLL without spawning PowerShell.
+
+    Args:
+        path (str): Path to the PE file.
+
+    Returns:
+        dict: {"file_version": str, "assembly_version": str}, matching what
+        `(Get-Item).VersionInfo.FileVersion` and `AssemblyName.GetAssemblyName`
+        report ("" when there is no file version, NOT_DOTNET for native images).
+
+    Raises:
+        PEFormatError: if the file is not a PE image or is malformed.
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise PEFormatError("Empty file")
+
+    try:
+        image = PEImage(buf)
+
+        file_version = ""
+        resource = _find_version_resource(image)
+        if resource:
+            file_version = _string_file_version(parse_version_resource(resource))
+
+        return {
+            "file_version": file_version,
+            "assembly_version": read_assembly_version(image),
+        }
+    except (struct.error, IndexError) as e:
+        raise PEFormatError(str(e))
+    finally:
+        buf.close()
@@ -0,0 +1,109 @@
+"""
+Batched PowerShell runner for the collector.
+
+Instead of one `powershell` process per registry key or service, each probe
+section sends all of its queries as a single script and reads the results
+back as JSON. The process launcher is injectable so the script building and
+result parsing can be exercised on any OS with a fake launcher.
+"""
+
+import base64
+import json
+import subprocess
+
+POWERSHELL_ARGS = ["powershell", "-NoProfile", "-NonInteractive", "-ExecutionPolicy", "Bypass"]
+
+SCRIPT_PRELUDE = """
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+$ErrorActionPreference = 'Stop'
+$result = [ordered]@{}
+"""
+
+REGISTRY_SCRIPT = """
+foreach ($path in @(%(items)s)) {
+    try {
+        $item = Get-ItemProperty -Path $path
+        $props = [ordered]@{}
+        foreach ($p in $item.PSObject.Properties) { $props[$p.Name] = [string]$p.Value }
+        $result[$path] = @{ ok = $true; value = $props }
+    } catch {
+        $result[$path] = @{ ok = $false; error = $_.Exception.Message }
+    }
+}
+$result | ConvertTo-Json -Depth 4 -Compress
+"""
+
+SERVICES_SCRIPT = """
+foreach ($name in @(%(items)s)) {
+    try {
+        $service = Get-Service -Name $name | Select-Object -First 1
+        $result[$name] = @{ ok = $true; value = [string]$service.Status }
+    } catch {
+        $result[$name] = @{ ok = $false; error = $_.Exception.Message }
+    }
+}
+$result | ConvertTo-Json -Depth 4 -Compress
+"""
+
+
+def launch_process(args, timeout):
+    """Default launcher: runs `args` and returns stdout decoded as UTF-8."""
+    completed = subprocess.run(args, capture_output=True, timeout=timeout, check=True)
+    return completed.stdout.decode("utf-8", errors="replace")
+
+
+def ps_quote(value):
+    # Single-quoted PowerShell literal; embedded quotes are doubled
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def ps_array_items(values):
+    return ", ".join(ps_quote(v) for v in values)
+
+
+class PowerShellRunner:
+    def __init__(self, launcher=None, timeout=120):
+        self.launcher = launcher or launch_process
+        self.timeout = timeout
+        self.process_count = 0
+
+    def run_script(self, script):
+        # -EncodedCommand avoids every quoting problem with paths and values
+        encoded = base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+        self.process_count += 1
+        return self.launcher(POWERSHELL_ARGS + ["-EncodedCommand", encoded], self.timeout)
+
+    def run_json(self, script):
+        output = self.run_script(script).lstrip("\ufeff").strip()
+        return json.loads(output) if output else {}
+
+
+def build_registry_script(keys):
+    return SCRIPT_PRELUDE + REGISTRY_SCRIPT % {"items": ps_array_items(keys)}
+
+
+def build_services_script(service_names):
+    return SCRIPT_PRELUDE + SERVICES_SCRIPT % {"items": ps_array_items(service_names)}
+
+
+def run_batch(runner, script, names, on_error):
+    """
+    Runs a batch script and maps its `{name: {ok, value|error}}` output back
+    onto `names`. `on_error(message)` builds the value for failed entries.
+    """
+    try:
+        results = runner.run_json(script)
+    except Exception as e:
+        return {name: on_error(str(e)) for name in names}
+
+    # PowerShell hashtable keys are case-insensitive, so match the same way
+    by_name = {str(k).lower(): v for k, v in results.items()}
+    output = {}
+    for name in names:
+        entry = by_name.get(str(name).lower())
+        if isinstance(entry, dict) and entry.get("ok"):
+            output[name] = entry.get("value")
+        else:
+            message = entry.get("error") if isinstance(entry, dict) else "No result returned"
+            output[name] = on_error(message)
+    return output
@@ -0,0 +1,210 @@
+"""
+Deploying collector_agent.exe to a VM over WinRM.
+
+The remote agent's SHA-256 is compared with the local build first, so an
+up-to-date agent is never sent again and an outdated one is replaced. When a
+transfer is needed the binary is streamed to a ".part" file through the
+command's stdin in bounded base64 chunks (one WinRM message each, well under
+the default 500 KB envelope), its hash is verified on the VM and only then
+is it moved into place. A transfer that broke off resumes from the last
+complete chunk of the ".part" file, provided its hash matches the local
+prefix.
+
+The local build is read, hashed and split into encoded chunks once; it is
+reloaded only when the file changes.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+DEFAULT_CHUNK_BYTES = 192 * 1024
+
+PROBE_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$path = '{path}'
+$part = $path + '.part'
+$chunk = {chunk}
+$hash = ''
+if (Test-Path $path) {{ $hash = (Get-FileHash -Algorithm SHA256 -LiteralPath $path).Hash }}
+$partBytes = 0
+$partHash = ''
+if (Test-Path $part) {{
+    # Keep only whole chunks so the upload can resume on a chunk boundary
+    $fs = [System.IO.File]::Open($part, 'Open', 'ReadWrite')
+    $partBytes = $fs.Length - ($fs.Length % $chunk)
+    $fs.SetLength($partBytes)
+    $fs.Close()
+    $partHash = (Get-FileHash -Algorithm SHA256 -LiteralPath $part).Hash
+}}
+@{{ hash = $hash; part_bytes = $partBytes; part_hash = $partHash }} | ConvertTo-Json -Compress
+"""
+
+UPLOAD_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$path = '{path}'
+$part = $path + '.part'
+New-Item -ItemType Directory -Force -Path (Split-Path $path) | Out-Null
+$fs = [System.IO.File]::Open($part, 'OpenOrCreate', 'Write')
+$fs.SetLength({offset})
+$fs.Seek({offset}, 'Begin') | Out-Null
+while ($null -ne ($line = [Console]::In.ReadLine()) -and $line -ne '') {{
+    $bytes = [System.Convert]::FromBase64String($line)
+    $fs.Write($bytes, 0, $bytes.Length)
+    $fs.Flush()
+}}
+$fs.Close()
+$hash = (Get-FileHash -Algorithm SHA256 -LiteralPath $part).Hash
+if ($hash -ne '{sha256}') {{
+    Remove-Item -Force -LiteralPath $part
+    Write-Output "MISMATCH $hash"
+    exit 1
+}}
+Move-Item -Force -LiteralPath $part -Destination $path
+Write-Output "OK $hash"
+"""
+
+
+class AgentDeployError(Exception):
+    """The agent could not be copied to the VM or failed verification."""
+
+
+class AgentBuild:
+    """The local agent binary with its hash and base64 chunks, computed once."""
+
+    def __init__(self, path, data, signature):
+        self.path = path
+        self.data = data
+        self.signature = signature
+        self.size = len(data)
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.chunks = {}
+        self.lock = threading.Lock()
+
+    def encoded_chunks(self, chunk_bytes):
+        with self.lock:
+            chunks = self.chunks.get(chunk_bytes)
+            if chunks is None:
+                chunks = self.chunks[chunk_bytes] = [
+                    base64.b64encode(self.data[i:i + chunk_bytes]).decode("ascii")
+                    for i in range(0, self.size, chunk_bytes)
+                ]
+            return chunks
+
+    def prefix_sha256(self, length):
+        return hashlib.sha256(memoryview(self.data)[:length]).hexdigest()
+
+
+class AgentCache:
+    """Keeps the AgentBuild for each local path until the file changes."""
+
+    def __init__(self):
+        self.builds = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Raises:
+            FileNotFoundError: if there is no local agent build.
+        """
+        path = str(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            build = self.builds.get(path)
+            if build is not None and build.signature == signature:
+                return build
+        with open(path, "rb") as f:
+            build = AgentBuild(path, f.read(), signature)
+        with self.lock:
+            self.builds[path] = build
+        print(f"✅ Loaded agent build {path} ({build.size} bytes, sha256 {build.sha256[:12]})")
+        return build
+
+
+def ps_quote(value):
+    return str(value).replace("'", "''")
+
+
+def run_ps_with_input(session, script, lines):
+    """
+    Runs a PowerShell script and writes `lines` to its stdin, one WinRM
+    message per line.
+
+    Returns:
+        object: with status_code, std_out and std_err, like session.run_ps.
+    """
+    protocol = session.protocol
+    encoded = base64.b64encode(script.encode("utf_16_le")).decode("ascii")
+    shell_id = protocol.open_shell()
+    try:
+        command_id = protocol.run_command(
+            shell_id, "powershell", ["-NoProfile", "-NonInteractive", "-EncodedCommand", encoded]
+        )
+        try:
+            for line in lines:
+                protocol.send_command_input(shell_id, command_id, line + "\r\n")
+            protocol.send_command_input(shell_id, command_id, "\r\n", end=True)
+            std_out, std_err, status_code = protocol.get_command_output(shell_id, command_id)
+        finally:
+            protocol.cleanup_command(shell_id, command_id)
+    finally:
+        protocol.close_shell(shell_id)
+    return SimpleNamespace(status_code=status_code, std_out=std_out, std_err=std_err)
+
+
+def probe_remote_agent(session, remote_path, chunk_bytes):
+    """
+    Returns:
+        dict: {"hash": sha256 of the installed agent or "", "part_bytes", "part_hash"}
+    """
+    result = session.run_ps(PROBE_SCRIPT.format(path=ps_quote(remote_path), chunk=chunk_bytes))
+    if result.status_code != 0:
+        raise AgentDeployError(f"Agent check failed. Code {result.status_code}: "
+                               f"{result.std_err.decode(errors='ignore').strip()[-500:]}")
+    probe = json.loads(result.std_out.decode(errors="ignore").strip() or "{}")
+    return {
+        "hash": (probe.get("hash") or "").lower(),
+        "part_bytes": int(probe.get("part_bytes") or 0),
+        "part_hash": (probe.get("part_hash") or "").lower(),
+    }
+
+
+def deploy_agent(session, build, remote_path, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None):
+    """
+    Makes sure the VM runs `build`.
+
+    Returns:
+        dict: {"action": "skipped" | "deployed" | "resumed", "sha256", "bytes_sent", "chunks_sent"}
+
+    Raises:
+        AgentDeployError: if the transfer or the final hash check fails.
+    """
+    report = progress or (lambda stage: None)
+    report("checking_agent")
+    probe = probe_remote_agent(session, remote_path, chunk_bytes)
+    summary = {"sha256": build.sha256, "bytes_sent": 0, "chunks_sent": 0}
+    if probe["hash"] == build.sha256:
+        return dict(summary, action="skipped")
+
+    offset = probe["part_bytes"]
+    if offset > build.size or (offset and probe["part_hash"] != build.prefix_sha256(offset)):
+        offset = 0  # the partial file is from another build
+    chunks = build.encoded_chunks(chunk_bytes)[offset // chunk_bytes:]
+
+    print(f"⚡ Remote agent {'outdated' if probe['hash'] else 'not found'}, "
+          f"sending {build.size - offset} bytes in {len(chunks)} chunks"
+          + (f" (resuming at {offset})" if offset else ""))
+    report("deploying_agent")
+    script = UPLOAD_SCRIPT.format(path=ps_quote(remote_path), offset=offset, sha256=build.sha256.upper())
+    result = run_ps_with_input(session, script, chunks)
+    output = result.std_out.decode(errors="ignore").strip()
+    if result.status_code != 0:
+        raise AgentDeployError(f"Agent upload failed. Code {result.status_code}: "
+                               f"{(output or result.std_err.decode(errors='ignore')).strip()[-500:]}")
+    print(f"✅ Agent deployed and verified: {output}")
+    return dict(summary, action="resumed" if offset else "deployed",
+                bytes_sent=build.size - offset, chunks_sent=len(chunks))
@@ -0,0 +1,62 @@
+"""
+Benchmark: schema-aware snapshot differ vs generic DeepDiff.
+
+Builds two environment_context dicts with N DLL entries and a given drift
+rate, times both engines and checks that they report the same changes.
+
+    python benchmarks/bench_diff.py --dlls 10000 20000 --drift 0.01
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from deepdiff import DeepDiff
+from snapshot_diff import diff_environment_contexts_fast
+from generators import make_env, drift
+
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dlls", type=int, nargs="+", default=[10000, 20000, 50000])
+    parser.add_argument("--drift", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for count in args.dlls:
+        env_a = make_env(count)
+        env_b = drift(env_a, args.drift)
+
+        deep, deep_s = timed(lambda: json.loads(DeepDiff(env_a, env_b, view="tree").to_json()), 1)
+        fast, fast_s = timed(lambda: diff_environment_contexts_fast(env_a, env_b), args.repeat)
+
+        same = {k: set(v) for k, v in deep.items()} == {k: set(v) for k, v in fast.items()}
+        results.append({
+            "dlls": count,
+            "drift": args.drift,
+            "deepdiff_ms": round(deep_s * 1000, 1),
+            "fast_ms": round(fast_s * 1000, 1),
+            "speedup": round(deep_s / fast_s, 1) if fast_s else None,
+            "same_changes": same,
+        })
+        print(json.dumps(results[-1]))
+
+    return 0 if all(r["same_changes"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
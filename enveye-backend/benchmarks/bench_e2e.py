@@ -0,0 +1,478 @@
+"""
+End-to-end benchmark of the backend under concurrent load.
+
+Starts the backend and the stub LLM (stub_llm_server.py) in this process on
+local ports, with all data in a temporary ENVEYE_DATA_DIR, and drives:
+
+  - upload:            /upload_snapshot, `--hosts` hosts x `--versions` drifted snapshots
+  - compare_cold:      /compare_stored on pairs not compared before
+  - compare_warm:      /compare_stored on already compared pairs (diff cache)
+  - list:              /list_snapshots with filters and paging, /list_snapshots/latest
+  - extract_file:      log-block extraction over a generated log, full scan
+  - extract_append:    the same after 1 MB was appended (checkpointed)
+  - extract_text:      extract_important_log_blocks() on an in-memory sample
+  - explain:           /explain with a log path, against the stub LLM
+  - explain_cached:    the same payloads again (explanation cache)
+
+Every scenario reports requests, errors, throughput, p50/p90/p99/max latency
+and the process's peak RSS so far (which includes the load generator).
+Results are written as JSON and can be checked against a stored baseline;
+the exit code is 1 when a metric regressed by more than `--tolerance`.
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --profile full --output results.json
+    python benchmarks/bench_e2e.py --baseline benchmarks/baseline_e2e.json
+    python benchmarks/bench_e2e.py --save-baseline benchmarks/baseline_e2e.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from generators import drift, generate_log, make_env, make_snapshot
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILES = {
+    "quick": dict(hosts=4, versions=3, dlls=5000, config_settings=200, drift=0.01, log_mb=64,
+                  concurrency=8, compares=40, lists=100, extracts=20, explains=20),
+    "full": dict(hosts=10, versions=5, dlls=50000, config_settings=2000, drift=0.01, log_mb=2048,
+                 concurrency=32, compares=200, lists=1000, extracts=50, explains=100),
+}
+
+# (metric, True if higher is better) checked against the baseline
+BASELINE_METRICS = (("throughput_rps", True), ("p50_ms", False), ("p99_ms", False), ("peak_rss_mb", False))
+# Latency differences below this many ms are noise, whatever the ratio
+MIN_LATENCY_DELTA_MS = 2.0
+
+
+def peak_rss_mb():
+    """Peak RSS of this process so far, or None where it cannot be read."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+    except ImportError:
+        return None
+    # Peak working set on Windows
+    peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+    return round(peak / (1024 * 1024), 1) if peak is not None else None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, seconds, **extra):
+    ordered = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(latencies) / seconds, 2) if seconds else None,
+    }
+    for name, fraction in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+        value = percentile(ordered, fraction)
+        summary[name] = round(value * 1000, 2) if value is not None else None
+    summary["max_ms"] = round(ordered[-1] * 1000, 2) if ordered else None
+    summary.update(extra)
+    summary["peak_rss_mb"] = peak_rss_mb()
+    return summary
+
+
+async def run_load(requests, concurrency):
+    """
+    Runs the coroutine factories in `requests` with at most `concurrency` in flight.
+    Each returns True on success.
+
+    Returns:
+        tuple: (latencies in seconds, error count, wall seconds)
+    """
+    slots = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(request):
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            try:
+                ok = await request()
+            except Exception as e:
+                print(f"request failed: {e!r}", file=sys.stderr)
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(r) for r in requests))
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_threads(func, items, concurrency):
+    """Like run_load, for blocking functions called from a thread pool."""
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(item):
+        start = time.perf_counter()
+        func(item)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, items))
+    return latencies, 0, time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.01)
+    return server, thread
+
+
+def ok_json(response):
+    if response.status_code >= 400:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return not (isinstance(body, dict) and "error" in body)
+
+
+async def wait_for_next_second():
+    # Snapshot ids have one-second resolution: one upload per host and second
+    await asyncio.sleep(1.05 - (time.time() % 1))
+
+
+# --- Scenarios ---
+async def bench_upload(http, params, state):
+    envs = [make_env(params["dlls"], seed=host, config_settings=params["config_settings"])
+            for host in range(params["hosts"])]
+    latencies, errors, busy, total_bytes = [], 0, 0.0, 0
+    ids = [[] for _ in envs]
+    for version in range(params["versions"]):
+        if version:
+            envs = [drift(env, params["drift"], seed=host * 1000 + version) for host, env in enumerate(envs)]
+        bodies = [gzip.compress(json.dumps(make_snapshot(env)).encode("utf-8"), 1) for env in envs]
+        total_bytes += sum(len(b) for b in bodies)
+        await wait_for_next_second()
+
+        def upload(host, body):
+            async def request():
+                response = await http.post("/upload_snapshot", data={
+                    "hostname": f"bench{host:03d}", "app_path": "BenchApp"
+                }, files={"snapshot": ("snapshot.json.gz", body, "application/gzip")})
+                if ok_json(response):
+                    ids[host].append(response.json()["snapshot_id"])
+                    return True
+                return False
+            return request
+
+        round_latencies, round_errors, seconds = await run_load(
+            [upload(host, body) for host, body in enumerate(bodies)], params["concurrency"]
+        )
+        latencies += round_latencies
+        errors += round_errors
+        busy += seconds
+    state["snapshot_ids"] = ids
+    return summarize(latencies, errors, busy, upload_mb=round(total_bytes / 1024 ** 2, 1),
+                     mb_per_s=round(total_bytes / 1024 ** 2 / busy, 1) if busy else None)
+
+
+async def bench_compare(http, params, state, warm):
+    ids = state["snapshot_ids"]
+    pairs = state.setdefault("compare_pairs", [])
+    if not warm:
+        # Consecutive versions of each host, then the same version across hosts
+        for series in ids:
+            pairs += list(zip(series, series[1:]))
+        for version in range(params["versions"]):
+            column = [series[version] for series in ids if len(series) > version]
+            pairs += list(zip(column, column[1:]))
+        pairs[:] = pairs[:params["compares"]]
+        selected = pairs
+    else:
+        rng = random.Random(0)
+        selected = [rng.choice(pairs) for _ in range(params["compares"])]
+
+    def compare(a, b):
+        async def request():
+            response = await http.post("/compare_stored", json={"snapshot_a": a, "snapshot_b": b})
+            if not ok_json(response):
+                print(f"compare {a} {b}: {response.status_code} {response.text[:200]}", file=sys.stderr)
+                return False
+            state.setdefault("explain_diff", response.json()["differences"])
+            return True
+        return request
+
+    latencies, errors, seconds = await run_load([compare(a, b) for a, b in selected], params["concurrency"])
+    return summarize(latencies, errors, seconds)
+
+
+async def bench_list(http, params, state):
+    rng = random.Random(0)
+    hosts = [f"bench{h:03d}" for h in range(params["hosts"])]
+    first_page = (await http.get("/list_snapshots", params={"limit": 2})).json()
+
+    def query(i):
+        kind = i % 4
+        if kind == 0:
+            request_params = {"limit": 100}
+        elif kind == 1:
+            request_params = {"hostname": rng.choice(hosts), "limit": 50}
+        elif kind == 2:
+            request_params = {"limit": 2, "cursor": first_page.get("next_cursor")} if first_page.get("next_cursor") else {"limit": 2}
+        else:
+            request_params = None
+
+        async def request():
+            if request_params is None:
+                return ok_json(await http.get("/list_snapshots/latest", params={"app": "BenchApp"}))
+            return ok_json(await http.get("/list_snapshots", params=request_params))
+        return request
+
+    latencies, errors, seconds = await run_load([query(i) for i in range(params["lists"])], params["concurrency"])
+    return summarize(latencies, errors, seconds)
+
+
+def bench_extract_file(backend, log_path, log_bytes):
+    start = time.perf_counter()
+    backend.extract_log_blocks_safely(str(log_path))
+    seconds = time.perf_counter() - start
+    return summarize([seconds], 0, seconds, log_mb=round(log_bytes / 1024 ** 2, 1),
+                     mb_per_s=round(log_bytes / 1024 ** 2 / seconds, 1))
+
+
+def bench_extract_append(backend, log_path):
+    generate_log(log_path, 1024 ** 2, 0.01, seed=1, mode="a")
+    start = time.perf_counter()
+    backend.extract_log_blocks_safely(str(log_path))
+    seconds = time.perf_counter() - start
+    return summarize([seconds], 0, seconds, appended_mb=1)
+
+
+def bench_extract_text(backend, log_path, params):
+    with open(log_path, "r", encoding="utf-8", errors="ignore") as f:
+        sample = f.read(8 * 1024 ** 2)
+    latencies, errors, seconds = run_threads(
+        lambda _: backend.extract_important_log_blocks(sample), range(params["extracts"]), params["concurrency"]
+    )
+    mb = params["extracts"] * len(sample) / 1024 ** 2
+    return summarize(latencies, errors, seconds, sample_mb=round(len(sample) / 1024 ** 2, 1),
+                     mb_per_s=round(mb / seconds, 1))
+
+
+async def bench_explain(http, params, state, log_path, cached):
+    diff = state.get("explain_diff") or {}
+
+    def explain(i):
+        async def request():
+            response = await http.post("/explain", json={
+                "diff": diff,
+                "error_message": f"Request {i} failed: System.InvalidOperationException: Operation {i % 20} is not valid",
+                "log_path": str(log_path),
+            })
+            return ok_json(response) and response.json().get("cached") == cached
+        return request
+
+    latencies, errors, seconds = await run_load([explain(i) for i in range(params["explains"])], params["concurrency"])
+    return summarize(latencies, errors, seconds)
+
+
+async def run_scenarios(backend, base_url, params, data_dir, only):
+    import httpx
+
+    state, results = {}, {}
+    log_path = Path(data_dir) / "bench.log"
+
+    def wanted(name):
+        return not only or name in only
+
+    limits = httpx.Limits(max_connections=params["concurrency"] * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as http:
+        results["upload"] = await bench_upload(http, params, state)
+        if wanted("compare_cold"):
+            results["compare_cold"] = await bench_compare(http, params, state, warm=False)
+        if wanted("compare_warm"):
+            results["compare_warm"] = await bench_compare(http, params, state, warm=True)
+        if wanted("list"):
+            results["list"] = await bench_list(http, params, state)
+
+        if any(wanted(name) for name in ("extract_file", "extract_append", "extract_text", "explain", "explain_cached")):
+            log_bytes = generate_log(log_path, params["log_mb"] * 1024 ** 2, 0.01)
+            # Full scan first: later scenarios then use the checkpoint
+            file_result = await asyncio.to_thread(bench_extract_file, backend, log_path, log_bytes)
+            if wanted("extract_file"):
+                results["extract_file"] = file_result
+            if wanted("extract_append"):
+                results["extract_append"] = await asyncio.to_thread(bench_extract_append, backend, log_path)
+            if wanted("extract_text"):
+                results["extract_text"] = await asyncio.to_thread(bench_extract_text, backend, log_path, params)
+        if wanted("explain"):
+            results["explain"] = await bench_explain(http, params, state, log_path, cached=False)
+        if wanted("explain_cached"):
+            results["explain_cached"] = await bench_explain(http, params, state, log_path, cached=True)
+    return results
+
+
+# --- Baseline ---
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Returns:
+        list: one dict per metric that got worse by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in BASELINE_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if metric.endswith("_ms") and abs(new - old) < MIN_LATENCY_DELTA_MS:
+                continue
+            if change > tolerance:
+                regressions.append({"scenario": name, "metric": metric, "baseline": old,
+                                    "current": new, "change": round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    for name, value in PROFILES["quick"].items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=None,
+                            help=f"Overrides the profile (quick: {value})")
+    parser.add_argument("--only", nargs="+", help="Scenarios to run besides upload, e.g. compare_cold explain")
+    parser.add_argument("--llm-first-token-ms", type=float, default=50)
+    parser.add_argument("--llm-token-ms", type=float, default=2)
+    parser.add_argument("--output", help="Write the results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="Baseline results JSON to check against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression as a fraction (default 0.25)")
+    parser.add_argument("--save-baseline", help="Also write the results as the new baseline")
+    parser.add_argument("--verbose", action="store_true", help="Keep the backend's own output")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the temporary data directory")
+    args = parser.parse_args()
+
+    params = dict(PROFILES[args.profile])
+    for name in params:
+        override = getattr(args, name)
+        if override is not None:
+            params[name] = override
+
+    data_dir = tempfile.mkdtemp(prefix="enveye-bench-")
+    llm_port, backend_port = free_port(), free_port()
+    os.environ.update({
+        "ENVEYE_DATA_DIR": data_dir,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{llm_port}/v1",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "stub"),
+        "STUB_LLM_FIRST_TOKEN_MS": str(args.llm_first_token_ms),
+        "STUB_LLM_TOKEN_MS": str(args.llm_token_ms),
+    })
+    # The backend serves the frontend build from a path relative to its own directory
+    os.chdir(BACKEND_DIR)
+    quiet = contextlib.redirect_stdout(open(os.devnull, "w")) if not args.verbose else contextlib.nullcontext()
+
+    started_at = datetime.now().isoformat()
+    with quiet:
+        import stub_llm_server
+        import enveye_backend
+
+        rss_at_start = peak_rss_mb()
+        servers = [start_server(stub_llm_server.app, llm_port), start_server(enveye_backend.app, backend_port)]
+        try:
+            scenarios = asyncio.run(run_scenarios(
+                enveye_backend, f"http://127.0.0.1:{backend_port}", params, data_dir, set(args.only or ())
+            ))
+        finally:
+            for server, thread in servers:
+                server.should_exit = True
+                thread.join(timeout=10)
+            if args.keep_data:
+                print(f"Data kept in {data_dir}", file=sys.stderr)
+            else:
+                shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {
+        "benchmark": "bench_e2e",
+        "profile": args.profile,
+        "params": params,
+        "started_at": started_at,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "rss_at_start_mb": rss_at_start,
+        "peak_rss_mb": peak_rss_mb(),
+        "scenarios": scenarios,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print("⚠️ Baseline was recorded with different parameters", file=sys.stderr)
+        results["regressions"] = compare_with_baseline(results, baseline, args.tolerance)
+        exit_code = 1 if results["regressions"] else 0
+        for regression in results["regressions"]:
+            print(f"❌ {regression['scenario']}.{regression['metric']}: {regression['baseline']} -> "
+                  f"{regression['current']} ({regression['change']:+.0%})", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            f.write(json.dumps({k: v for k, v in results.items() if k != "regressions"}, indent=2) + "\n")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Benchmark: streaming log-block extraction vs the previous splitlines() loop.
+
+Generates a synthetic application log where `--error-rate` of the requests
+fail with an exception and a stack trace, then times:
+  - a full streaming scan of the whole file on one core,
+  - an incremental scan after appending a small tail (checkpointed),
+  - the previous implementation on a sample, reported as MB/s.
+
+    python benchmarks/bench_log_extract.py --size-gb 1
+    python benchmarks/bench_log_extract.py --size-gb 1 --error-rate 0.2
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from log_extractor import LogBlockExtractor
+from generators import generate_log
+
+LEGACY_KEYWORDS = ['ERROR', 'Exception', 'Traceback', 'CRITICAL', 'Failed', 'Caused by']
+
+
+def legacy_normalize(block):
+    clean = re.sub(r'\d{4}-\d{2}-\d{2}[\sT]\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', block)
+    clean = re.sub(r'\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', clean)
+    return clean.strip()
+
+
+def legacy_extract(log_text, max_blocks=30):
+    """The extractor as it was before the streaming pipeline."""
+    blocks, current, seen = [], [], set()
+
+    def commit_block():
+        if current:
+            full_block = "\n".join(current).strip()
+            norm = legacy_normalize(full_block)
+            if norm not in seen:
+                seen.add(norm)
+                blocks.append(full_block)
+            current.clear()
+
+    for line in log_text.splitlines():
+        if any(k in line for k in LEGACY_KEYWORDS):
+            commit_block()
+            current.append(line)
+        elif current and (line.startswith(" ") or line.startswith("\t") or line.strip() == ""):
+            current.append(line)
+        else:
+            commit_block()
+    commit_block()
+    return "\n\n---\n\n".join(blocks[-max_blocks:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-gb", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--append-mb", type=float, default=1.0)
+    parser.add_argument("--legacy-sample-mb", type=int, default=100)
+    parser.add_argument("--file", help="Reuse an existing log instead of generating one")
+    args = parser.parse_args()
+
+    path = args.file
+    if not path:
+        fd, path = tempfile.mkstemp(suffix=".log")
+        os.close(fd)
+        generate_log(path, int(args.size_gb * 1024 ** 3), args.error_rate)
+    size = os.path.getsize(path)
+    results = {"log_bytes": size, "error_rate": args.error_rate}
+
+    try:
+        extractor = LogBlockExtractor(max_scan_bytes=None)
+        start = time.perf_counter()
+        full = extractor.extract(path)
+        elapsed = time.perf_counter() - start
+        results["streaming_full_scan"] = {
+            "seconds": round(elapsed, 2),
+            "mb_per_s": round(size / 1024 ** 2 / elapsed, 1),
+            "output_chars": len(full),
+        }
+
+        generate_log(path, int(args.append_mb * 1024 ** 2), args.error_rate, seed=1, mode="a")
+        start = time.perf_counter()
+        extractor.extract(path)
+        results["streaming_incremental"] = {
+            "appended_mb": args.append_mb,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            sample = f.read(args.legacy_sample_mb * 1024 ** 2)
+        start = time.perf_counter()
+        legacy_extract(sample)
+        elapsed = time.perf_counter() - start
+        results["legacy_sample"] = {
+            "sample_mb": args.legacy_sample_mb,
+            "seconds": round(elapsed, 2),
+            "mb_per_s": round(args.legacy_sample_mb / elapsed, 1),
+        }
+        results["extractor_stats"] = extractor.stats()
+    finally:
+        if not args.file:
+            os.remove(path)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Cold-start benchmark: time to import the backend (and to serve its first
+request) and to import the collector agent, each in fresh interpreters.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --top 15 --output startup.json
+
+Every run starts a new process with `python -X importtime`; the slowest
+imports made by the measured modules in the last run are listed to show
+where the time goes.
+ENVEYE_DATA_DIR points at a temporary directory, so no data is touched.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+COLLECTOR_DIR = BACKEND_DIR.parent / "collector"
+
+# Each snippet prints the seconds it measured as its last stdout line
+TARGETS = {
+    "backend_import": (BACKEND_DIR, """
+import time
+start = time.perf_counter()
+import enveye_backend
+print(time.perf_counter() - start)
+"""),
+    "backend_first_request": (BACKEND_DIR, """
+import time
+start = time.perf_counter()
+import enveye_backend
+from fastapi.testclient import TestClient
+with TestClient(enveye_backend.app) as client:
+    client.get("/list_snapshots", params={"limit": 1}).raise_for_status()
+print(time.perf_counter() - start)
+"""),
+    "collector_import": (COLLECTOR_DIR, """
+import time
+start = time.perf_counter()
+import collector_agent
+print(time.perf_counter() - start)
+"""),
+}
+
+# Imported by the interpreter itself before the measured code runs
+INTERPRETER_STARTUP = {"site", "encodings", "io", "zipimport", "_frozen_importlib_external"}
+
+
+def parse_importtime(stderr, top):
+    """
+    The `top` slowest imports made directly by the measured modules
+    (cumulative ms, i.e. including what they import), from -X importtime output.
+    """
+    modules, children = [], []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nesting is shown by two spaces per level after one leading space;
+        # a module is listed after everything it imported
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() not in INTERPRETER_STARTUP:
+                modules.extend(children)
+            children = []
+    modules.sort(key=lambda m: -m[1])
+    return [{"module": name, "ms": round(ms, 1)} for name, ms in modules[:top]]
+
+
+def run_target(cwd, code, env, runs, top):
+    times = []
+    slowest = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=cwd, env=env, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr[-2000:])
+        times.append(float(completed.stdout.strip().splitlines()[-1]))
+        slowest = parse_importtime(completed.stderr, top)
+    return {
+        "runs": runs,
+        "median_s": round(statistics.median(times), 3),
+        "min_s": round(min(times), 3),
+        "max_s": round(max(times), 3),
+        "slowest_imports": slowest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    parser.add_argument("--only", nargs="+", choices=sorted(TARGETS))
+    parser.add_argument("--output", help="Write the results JSON here (default: stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="enveye-startup-") as data_dir:
+        env = dict(os.environ, ENVEYE_DATA_DIR=data_dir, PYTHONDONTWRITEBYTECODE="1")
+        env.pop("ENVEYE_WARMUP", None)
+        results = {}
+        for name, (cwd, code) in TARGETS.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = run_target(cwd, code, env, args.runs, args.top)
+            print(f"{name}: median {results[name]['median_s']}s", file=sys.stderr)
+
+    output = json.dumps({"benchmark": "bench_startup", "python": sys.version.split()[0], "targets": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
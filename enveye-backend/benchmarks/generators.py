@@ -0,0 +1,125 @@
+"""
+Synthetic test data for the benchmarks: snapshots shaped like the collector's
+output, drifted copies of them, and large application logs with stack traces.
+
+    python benchmarks/generators.py snapshot --dlls 50000 --out snap.json
+    python benchmarks/generators.py log --size-gb 2 --out app.log
+"""
+
+import argparse
+import json
+import random
+import sys
+from datetime import datetime
+
+
+def make_env(dll_count, seed=0, config_settings=200):
+    """An environment_context with `dll_count` DLLs and `config_settings` appSettings."""
+    rng = random.Random(seed)
+    dlls = {}
+    for i in range(dll_count):
+        version = f"{rng.randint(1, 9)}.{rng.randint(0, 20)}.{rng.randint(0, 9999)}.0"
+        dlls[f"C:\\Program Files\\App\\bin\\module_{i:05d}.dll"] = {
+            "file_version": version,
+            "assembly_version": version if i % 3 else "Not .NET Assembly",
+        }
+    return {
+        "os_info": {"name": "Windows", "version": "10.0.17763", "build": "2019Server", "architecture": "AMD64"},
+        "dotnet_frameworks_installed": ["4.8.03761", "4.7.03062", "4.0.0.0"],
+        "app_folder_dlls": dlls,
+        "app_config_settings": {
+            "app_settings": {f"Setting{i}": f"value{i}" for i in range(config_settings)},
+            "connection_strings": {"Main": "Server=db01;Database=App;Trusted_Connection=True"},
+        },
+        "critical_registry_keys": {"HKLM:\\SOFTWARE\\SampleApp\\Settings": {"Url": "http://app:8080"}},
+        "required_services_status": {"W3SVC": "Running", "MSSQL$SQLEXPRESS": "Running"},
+        "critical_environment_variables": {"APP_ENV": "prod", "ENVIRONMENT": "Not Set"},
+    }
+
+
+def drift(env, rate, seed=1):
+    """
+    A copy of `env` where `rate` of the DLLs changed version, as many were
+    removed and added, and `rate` of the appSettings changed (at least one of each).
+    """
+    rng = random.Random(seed)
+    new = json.loads(json.dumps(env))
+    dlls = new["app_folder_dlls"]
+    keys = list(dlls)
+    changes = max(1, int(len(keys) * rate))
+    for key in rng.sample(keys, changes):
+        dlls[key]["file_version"] = "99.0.0.0"
+    for key in rng.sample(keys, changes):
+        del dlls[key]
+    for i in range(changes):
+        dlls[f"C:\\Program Files\\App\\bin\\added_{i}.dll"] = {"file_version": "1.0.0.0", "assembly_version": "1.0.0.0"}
+    settings = new["app_config_settings"]["app_settings"]
+    setting_keys = sorted(settings)
+    for key in rng.sample(setting_keys, max(1, int(len(setting_keys) * rate))) if setting_keys else ():
+        settings[key] = "changed"
+    new["required_services_status"]["W3SVC"] = "Stopped"
+    return new
+
+
+def make_snapshot(env, collected_at=None):
+    """The JSON document the collector uploads for `env`."""
+    return {
+        "environment_context": env,
+        "timestamp": (collected_at or datetime.now()).astimezone().isoformat(),
+    }
+
+
+def generate_log(path, size_bytes, error_rate, seed=0, mode="w"):
+    """Writes request log lines; a share of them are errors with a 6-frame stack trace."""
+    rng = random.Random(seed)
+    written = 0
+    n = 0
+    with open(path, mode, encoding="utf-8") as f:
+        while written < size_bytes:
+            lines = []
+            for _ in range(1000):
+                n += 1
+                ts = f"2025-01-01 {n // 3600 % 24:02d}:{n // 60 % 60:02d}:{n % 60:02d},{n % 1000:03d}"
+                if rng.random() < error_rate:
+                    kind = rng.randrange(20)
+                    lines.append(f"{ts} ERROR [worker-{n % 16}] Request {n} failed")
+                    lines.append(f"System.InvalidOperationException: Operation {kind} is not valid in the current state")
+                    lines.extend(f"   at App.Services.Handler{kind}.Step{j}(Int32 id) in C:\\src\\App\\Handler{kind}.cs:line {100 + j}"
+                                 for j in range(6))
+                else:
+                    lines.append(f"{ts} INFO  [worker-{n % 16}] GET /api/v1/orders/{n} completed 200 in {n % 300}ms")
+            chunk = "\n".join(lines) + "\n"
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    snap = sub.add_parser("snapshot")
+    snap.add_argument("--dlls", type=int, default=10000)
+    snap.add_argument("--config-settings", type=int, default=200)
+    snap.add_argument("--drift", type=float, default=0.0, help="Drift from the seed's base snapshot")
+    snap.add_argument("--seed", type=int, default=0)
+    snap.add_argument("--out", required=True)
+    log = sub.add_parser("log")
+    log.add_argument("--size-gb", type=float, default=1.0)
+    log.add_argument("--error-rate", type=float, default=0.01)
+    log.add_argument("--seed", type=int, default=0)
+    log.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        env = make_env(args.dlls, seed=args.seed, config_settings=args.config_settings)
+        if args.drift:
+            env = drift(env, args.drift, seed=args.seed + 1)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(make_snapshot(env), f)
+    else:
+        generate_log(args.out, int(args.size_gb * 1024 ** 3), args.error_rate, seed=args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
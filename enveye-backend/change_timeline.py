@@ -0,0 +1,300 @@
+"""
+Per-host change timeline.
+
+Each uploaded snapshot is diffed against the previous snapshot of the same
+hostname and app, and every change is stored as one row, so "when did this
+DLL change on host X?" is an indexed query over precomputed diffs instead of
+a re-diff of raw snapshots.
+
+Changes are addressed by a key path: the DeepDiff path with its quoting
+dropped, e.g. root['app_folder_dlls']['C:\\App\\a.dll']['version'] becomes
+app_folder_dlls/C:\\App\\a.dll/version. Key filters are globs (`*`, `?`,
+case-insensitive); a pattern without wildcards also matches everything below
+that key.
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+from prompt_builder import split_path
+from snapshot_index import decode_cursor, encode_cursor, normalize_timestamp
+
+MAX_PAGE_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot_diffs (
+    snapshot_id TEXT PRIMARY KEY,
+    previous_id TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    previous_timestamp TEXT NOT NULL,
+    change_count INTEGER NOT NULL,
+    computed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_diffs_host_app_ts ON snapshot_diffs (hostname, app_name, timestamp);
+
+CREATE TABLE IF NOT EXISTS change_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    snapshot_id TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    category TEXT NOT NULL,
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    change TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_host_ts ON change_events (hostname, app_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_host_key ON change_events (hostname, key);
+CREATE INDEX IF NOT EXISTS idx_events_snapshot ON change_events (snapshot_id);
+"""
+
+
+def key_path(path):
+    """"root['dlls']['a.dll'][0]" -> "dlls/a.dll/[0]"; unparseable paths are kept as is."""
+    parts = split_path(path)
+    if not parts:
+        return path
+    return "/".join(f"[{p}]" if isinstance(p, int) else str(p) for p in parts)
+
+
+def glob_to_like(pattern):
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+def diff_to_events(differences):
+    """
+    Flattens a {category: {path: change}} diff.
+
+    Returns:
+        list: (category, section, key, path, change JSON) tuples.
+    """
+    events = []
+    for category, entries in (differences or {}).items():
+        if isinstance(entries, dict):
+            items = entries.items()
+        elif isinstance(entries, list):
+            items = ((path, None) for path in entries)
+        else:
+            continue
+        for path, change in items:
+            key = key_path(path)
+            section = key.split("/", 1)[0] if key != path else "other"
+            events.append((category, section, key, path,
+                           json.dumps(change, default=str) if change is not None else None))
+    return events
+
+
+class ChangeTimeline:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.write_lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # --- Writing ---
+    def record(self, snapshot, previous, differences):
+        """
+        Stores the diff between two consecutive snapshots, replacing any
+        earlier diff stored for `snapshot`.
+
+        Args:
+            snapshot, previous (dict): SnapshotIndex rows of the new and the previous snapshot.
+            differences (dict): DeepDiff-style diff from `previous` to `snapshot`.
+
+        Returns:
+            int: the number of change events stored.
+        """
+        events = diff_to_events(differences)
+        rows = [(snapshot["id"], snapshot["hostname"], snapshot["app_name"], snapshot["timestamp"], *event)
+                for event in events]
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM change_events WHERE snapshot_id = ?", (snapshot["id"],))
+            conn.executemany(
+                "INSERT INTO change_events (snapshot_id, hostname, app_name, timestamp, category, section, key, path, change) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshot_diffs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (snapshot["id"], previous["id"], snapshot["hostname"], snapshot["app_name"],
+                 snapshot["timestamp"], previous["timestamp"], len(rows),
+                 datetime.now().replace(microsecond=0).isoformat())
+            )
+        return len(rows)
+
+    def update(self, snapshot_id, index, comparer):
+        """
+        Diffs `snapshot_id` against the previous snapshot of its host/app.
+        A snapshot that arrived out of order also sits between the next
+        snapshot and the one that next was diffed against, so the next
+        snapshot's diff is recomputed too. Blocking; meant to run as a
+        background task after an upload.
+
+        Returns:
+            int: change events stored, or None if there is no previous snapshot.
+        """
+        snapshot = index.get(snapshot_id)
+        if snapshot is None:
+            return None
+        following = index.next(snapshot_id)
+        if following is not None:
+            self.diff_pair(snapshot, following, comparer)
+        previous = index.previous(snapshot_id)
+        if previous is None:
+            return None
+        return self.diff_pair(previous, snapshot, comparer)
+
+    def diff_pair(self, previous, snapshot, comparer):
+        """Stores the diff from `previous` to `snapshot` unless it is already stored; returns its change count."""
+        stored = self.get_diff(snapshot["id"])
+        if stored and stored["previous_id"] == previous["id"]:
+            return stored["change_count"]
+        differences = comparer.compare(previous["id"], snapshot["id"])["differences"]
+        return self.record(snapshot, previous, differences)
+
+    def backfill(self, index, comparer, hostname=None, app_name=None):
+        """
+        Computes the consecutive diffs that are missing or stale, e.g. for
+        snapshots stored before the timeline existed.
+
+        Returns:
+            dict: {"computed": n, "up_to_date": n, "failed": n}
+        """
+        known = {}
+        with closing(self._connect()) as conn:
+            for row in conn.execute("SELECT snapshot_id, previous_id FROM snapshot_diffs"):
+                known[row["snapshot_id"]] = row["previous_id"]
+
+        counts = {"computed": 0, "up_to_date": 0, "failed": 0}
+        cursor = None
+        last_by_series = {}
+        while True:
+            page = index.query(hostname=hostname, app_name=app_name, sort="timestamp",
+                               order="asc", limit=MAX_PAGE_SIZE, cursor=cursor)
+            for snapshot in page["items"]:
+                series = (snapshot["hostname"], snapshot["app_name"])
+                previous = last_by_series.get(series)
+                last_by_series[series] = snapshot
+                if previous is None:
+                    continue
+                if known.get(snapshot["id"]) == previous["id"]:
+                    counts["up_to_date"] += 1
+                    continue
+                try:
+                    differences = comparer.compare(previous["id"], snapshot["id"])["differences"]
+                    self.record(snapshot, previous, differences)
+                    counts["computed"] += 1
+                except Exception as e:
+                    print(f"⚠️ Timeline diff {previous['id']} -> {snapshot['id']} failed: {e}")
+                    counts["failed"] += 1
+            cursor = page["next_cursor"]
+            if not cursor:
+                return counts
+
+    def remove(self, snapshot_id):
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM change_events WHERE snapshot_id = ?", (snapshot_id,))
+            conn.execute("DELETE FROM snapshot_diffs WHERE snapshot_id = ?", (snapshot_id,))
+
+    # --- Queries ---
+    def iter_diffs(self):
+        """Yields (snapshot_diffs row, DeepDiff-style diff) for every stored consecutive diff."""
+        with closing(self._connect()) as conn:
+            diffs = [dict(row) for row in conn.execute("SELECT * FROM snapshot_diffs ORDER BY timestamp")]
+        for diff in diffs:
+            with closing(self._connect()) as conn:
+                events = conn.execute(
+                    "SELECT category, path, change FROM change_events WHERE snapshot_id = ?", (diff["snapshot_id"],)
+                ).fetchall()
+            differences = {}
+            for event in events:
+                change = json.loads(event["change"]) if event["change"] is not None else None
+                differences.setdefault(event["category"], {})[event["path"]] = change
+            yield diff, differences
+
+    def get_diff(self, snapshot_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM snapshot_diffs WHERE snapshot_id = ?", (snapshot_id,)).fetchone()
+        return dict(row) if row else None
+
+    def query(self, hostname, app_name=None, key=None, section=None, category=None,
+              since=None, until=None, order="desc", limit=200, cursor=None):
+        """
+        Change events of one host, newest first unless order="asc".
+
+        Returns:
+            dict: {"events": [...], "next_cursor": str or None}
+        """
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        where, params = ["e.hostname = ?"], [hostname]
+        if app_name:
+            where.append("e.app_name = ?")
+            params.append(app_name)
+        if key:
+            like = glob_to_like(key)
+            if "*" in key or "?" in key:
+                where.append("e.key LIKE ? ESCAPE '\\'")
+                params.append(like)
+            else:
+                where.append("(e.key LIKE ? ESCAPE '\\' OR e.key LIKE ? ESCAPE '\\')")
+                params.extend([like, like + "/%"])
+        if section:
+            where.append("e.section = ?")
+            params.append(section)
+        if category:
+            where.append("e.category = ?")
+            params.append(category)
+        if since:
+            where.append("e.timestamp >= ?")
+            params.append(normalize_timestamp(since))
+        if until:
+            where.append("e.timestamp <= ?")
+            params.append(normalize_timestamp(until))
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor)
+            op = "<" if order == "desc" else ">"
+            where.append(f"(e.timestamp, e.id) {op} (?, ?)")
+            params.extend([timestamp, last_id])
+
+        sql = f"""
+            SELECT e.*, d.previous_id, d.previous_timestamp FROM change_events e
+            JOIN snapshot_diffs d ON d.snapshot_id = e.snapshot_id
+            WHERE {" AND ".join(where)}
+            ORDER BY e.timestamp {order.upper()}, e.id {order.upper()} LIMIT ?
+        """
+        params.append(limit + 1)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        events = []
+        for row in rows[:limit]:
+            event = dict(row)
+            event["change"] = json.loads(event["change"]) if event["change"] is not None else None
+            events.append(event)
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(events[-1]["timestamp"], events[-1]["id"])
+        for event in events:
+            del event["id"]
+        return {"events": events, "next_cursor": next_cursor}
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            diffs = conn.execute("SELECT COUNT(*) FROM snapshot_diffs").fetchone()[0]
+            events = conn.execute("SELECT COUNT(*) FROM change_events").fetchone()[0]
+        return {"diffs": diffs, "events": events}
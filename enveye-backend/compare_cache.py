@@ -0,0 +1,203 @@
+"""
+Caches for comparing stored snapshots by id.
+
+- A bounded LRU of parsed snapshots, so popular snapshots are parsed once.
+- A diff-result cache keyed by the pair of environment_context content
+  hashes, so repeated comparisons of the same two states skip the diff.
+
+Both caches evict by approximate memory use rather than entry count.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Parsed JSON takes several times its serialized size as Python objects
+PARSED_SIZE_FACTOR = 4
+
+
+class SizedLRUCache:
+    """Thread-safe LRU that evicts least recently used entries above `max_bytes`."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return  # would evict everything else for one entry
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def content_hash(section_hashes):
+    """Single hash of an environment_context from its per-section hashes."""
+    digest = hashlib.sha256()
+    for name in sorted(section_hashes):
+        digest.update(f"{name}={section_hashes[name]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SnapshotComparer:
+    """
+    Compares stored snapshots by id. `diff_func(env_a, env_b, hashes_a, hashes_b)`
+    must return a JSON-serializable diff of two environment_context dicts; the
+    section hashes let it skip sections that are known to be identical.
+    """
+
+    def __init__(self, store, index, diff_func, snapshot_cache_bytes, diff_cache_bytes):
+        self.store = store
+        self.index = index
+        self.diff_func = diff_func
+        self.snapshots = SizedLRUCache(snapshot_cache_bytes)
+        self.diffs = SizedLRUCache(diff_cache_bytes)
+
+    def section_hashes(self, snapshot_id):
+        row = self.index.get(snapshot_id) if self.index else None
+        if row and row.get("section_hashes"):
+            return row["section_hashes"]
+        return self.store.section_hashes(snapshot_id)
+
+    def load(self, snapshot_id, key):
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            with self.store.open(snapshot_id) as f:
+                raw = f.read()
+            snapshot = json.loads(raw)
+            self.snapshots.put(key, snapshot, len(raw) * PARSED_SIZE_FACTOR)
+        return snapshot
+
+    def load_environment(self, snapshot_id):
+        """
+        The environment_context of a stored snapshot, from the cache when possible.
+        Shared with the cache: callers must not modify it.
+        """
+        hashes = self.section_hashes(snapshot_id)
+        return self.load(snapshot_id, content_hash(hashes)).get("environment_context", {})
+
+    def compare(self, id_a, id_b):
+        """
+        Returns:
+            dict: {"differences": ..., "cached": bool, "unchanged_sections": [...]}
+
+        Raises:
+            FileNotFoundError: if either snapshot is not stored.
+        """
+        for snapshot_id in (id_a, id_b):
+            if not self.store.exists(snapshot_id):
+                raise FileNotFoundError(snapshot_id)
+
+        hashes_a, hashes_b = self.section_hashes(id_a), self.section_hashes(id_b)
+        key_a, key_b = content_hash(hashes_a), content_hash(hashes_b)
+        unchanged = sorted(name for name, h in hashes_a.items() if hashes_b.get(name) == h)
+
+        differences = self.diffs.get((key_a, key_b))
+        if differences is not None:
+            return {"differences": differences, "cached": True, "unchanged_sections": unchanged}
+
+        env_a = self.load(id_a, key_a).get("environment_context", {})
+        env_b = self.load(id_b, key_b).get("environment_context", {})
+        differences = self.diff_func(env_a, env_b, hashes_a, hashes_b)
+        self.diffs.put((key_a, key_b), differences, len(json.dumps(differences)))
+        return {"differences": differences, "cached": False, "unchanged_sections": unchanged}
+
+    def compare_sections(self, id_a, id_b, selector):
+        """
+        Like `compare`, limited to what `selector` (a section_select.SectionSelector)
+        selects. Only the selected sections are loaded, unless the whole diff or
+        snapshot is already cached.
+
+        Returns:
+            dict: {"differences": ..., "cached": bool, "sections": [...], "unchanged_sections": [...]}
+        """
+        for snapshot_id in (id_a, id_b):
+            if not self.store.exists(snapshot_id):
+                raise FileNotFoundError(snapshot_id)
+
+        # Known without reading the snapshots for manifests (from the catalog);
+        # otherwise sections are filtered while the files are scanned
+        hashes_a, hashes_b = self.indexed_section_hashes(id_a), self.indexed_section_hashes(id_b)
+        keys = None
+        if hashes_a is not None and hashes_b is not None:
+            keys = content_hash(hashes_a), content_hash(hashes_b)
+            cached = self.diffs.get(keys + (selector.patterns,))
+            if cached is None:
+                full = self.diffs.get(keys)
+                if full is not None:
+                    cached = selector.filter_differences(full)
+            if cached is not None:
+                return dict(cached=True, **self.section_result(cached, selector, hashes_a, hashes_b))
+
+        def wanted(name):
+            # Sections with equal hashes on both sides cannot differ
+            if keys is not None and name in hashes_a and hashes_a[name] == hashes_b.get(name):
+                return False
+            return selector.wants_section(name)
+
+        env_a = self.load_selected(id_a, keys and keys[0], wanted)
+        env_b = self.load_selected(id_b, keys and keys[1], wanted)
+        differences = selector.filter_differences(self.diff_func(env_a, env_b, None, None))
+        if keys is not None:
+            self.diffs.put(keys + (selector.patterns,), differences, len(json.dumps(differences)))
+        result = self.section_result(differences, selector, hashes_a, hashes_b, env_a, env_b)
+        return dict(cached=False, **result)
+
+    def indexed_section_hashes(self, snapshot_id):
+        row = self.index.get(snapshot_id) if self.index else None
+        return row["section_hashes"] if row and row.get("section_hashes") else None
+
+    def load_selected(self, snapshot_id, key, wanted):
+        snapshot = self.snapshots.get(key) if key else None
+        if snapshot is not None:
+            env = snapshot.get("environment_context", {})
+            return {name: value for name, value in env.items() if wanted(name)}
+        return self.store.load_partial(snapshot_id, wanted)["environment_context"]
+
+    @staticmethod
+    def section_result(differences, selector, hashes_a, hashes_b, env_a=None, env_b=None):
+        if hashes_a is not None and hashes_b is not None:
+            names = set(hashes_a) | set(hashes_b)
+            sections = sorted(name for name in names if selector.wants_section(name))
+            unchanged = [name for name in sections if name in hashes_a and hashes_a[name] == hashes_b.get(name)]
+        else:
+            sections = sorted(set(env_a) | set(env_b))
+            unchanged = [name for name in sections if name in env_a and name in env_b and env_a[name] == env_b[name]]
+        return {"differences": differences, "sections": sections, "unchanged_sections": unchanged}
+
+    def stats(self):
+        return {"snapshots": self.snapshots.stats(), "diffs": self.diffs.stats()}
@@ -0,0 +1,176 @@
+"""
+Fleet-wide drift analysis: diff one baseline snapshot against the latest
+snapshot of many hosts in a process pool, streaming each host's result as
+soon as it is ready and finishing with a hosts x changed-keys matrix.
+
+Also usable from the command line:
+
+    python drift.py --baseline golden_App_20250101000000.json --hosts "web*" --app App
+"""
+
+import argparse
+import concurrent.futures
+import fnmatch
+import json
+import os
+import sys
+from pathlib import Path
+
+from snapshot_diff import diff_environment_contexts_fast
+from snapshot_index import SnapshotIndex
+from snapshot_store import SnapshotStore, DedupSnapshotStore
+
+# A key changed on at most this share of targets is reported as an outlier
+DEFAULT_OUTLIER_FRACTION = 0.1
+
+# --- Worker process state (set once per process by the pool initializer) ---
+worker_store = None
+worker_baseline_env = None
+worker_baseline_hashes = None
+
+
+def init_worker(store_class_name, root, baseline_env, baseline_hashes):
+    global worker_store, worker_baseline_env, worker_baseline_hashes
+    store_class = DedupSnapshotStore if store_class_name == "DedupSnapshotStore" else SnapshotStore
+    worker_store = store_class(root)
+    worker_baseline_env = baseline_env
+    worker_baseline_hashes = baseline_hashes
+
+
+def diff_against_baseline(target):
+    """Runs in a worker process. `target` is an index row of the snapshot to compare."""
+    try:
+        hashes = target.get("section_hashes")
+        if hashes and worker_baseline_hashes == hashes:
+            return {"hostname": target["hostname"], "app_name": target["app_name"],
+                    "snapshot_id": target["id"], "changes": {}}
+
+        env = worker_store.load(target["id"]).get("environment_context", {})
+        differences = diff_environment_contexts_fast(worker_baseline_env, env, worker_baseline_hashes, hashes)
+        changes = {}
+        for category, entries in differences.items():
+            for path in entries:
+                changes[path] = category
+        return {"hostname": target["hostname"], "app_name": target["app_name"],
+                "snapshot_id": target["id"], "changes": changes}
+    except Exception as e:
+        return {"hostname": target["hostname"], "app_name": target["app_name"],
+                "snapshot_id": target["id"], "error": str(e)}
+
+
+def select_targets(index, baseline_id, hostname=None, app_name=None, hosts=None):
+    """Latest snapshot per host/app matching a hostname glob and/or explicit host list."""
+    targets = []
+    for row in index.latest(app_name=app_name):
+        if row["id"] == baseline_id:
+            continue
+        if hosts and row["hostname"] not in hosts:
+            continue
+        if hostname and not fnmatch.fnmatch(row["hostname"], hostname):
+            continue
+        targets.append(row)
+    return targets
+
+
+def target_name(result):
+    """"hostname/app_name": one target, since a host can run several apps."""
+    return f"{result['hostname']}/{result['app_name']}"
+
+
+def summarize(results, outlier_fraction=DEFAULT_OUTLIER_FRACTION):
+    """
+    Builds the drift matrix from per-target results, keyed by `target_name`.
+
+    Returns:
+        dict: {"hosts", "keys", "matrix": {target: {key: category}},
+               "common_to_all": [...], "outliers": {key: [targets]}, "errors": {target: msg}}
+    """
+    ok = [r for r in results if "error" not in r]
+    matrix = {target_name(r): r["changes"] for r in ok}
+
+    hosts_by_key = {}
+    for host, changes in matrix.items():
+        for key in changes:
+            hosts_by_key.setdefault(key, []).append(host)
+
+    total = len(matrix)
+    outlier_limit = max(1, int(total * outlier_fraction))
+    common = sorted(k for k, hs in hosts_by_key.items() if total and len(hs) == total)
+    outliers = {k: sorted(hs) for k, hs in sorted(hosts_by_key.items())
+                if len(hs) <= outlier_limit and len(hs) < total}
+
+    return {
+        "hosts": sorted(matrix),
+        "keys": sorted(hosts_by_key),
+        "matrix": matrix,
+        "common_to_all": common,
+        "outliers": outliers,
+        "errors": {target_name(r): r["error"] for r in results if "error" in r},
+    }
+
+
+def run_drift(store, index, baseline_id, hostname=None, app_name=None, hosts=None,
+              workers=None, outlier_fraction=DEFAULT_OUTLIER_FRACTION):
+    """
+    Generator of drift events: one {"type": "host", ...} per target as it
+    finishes, then a final {"type": "summary", ...}.
+
+    Raises:
+        FileNotFoundError: if the baseline snapshot is not stored.
+    """
+    if not store.exists(baseline_id):
+        raise FileNotFoundError(baseline_id)
+
+    baseline_env = store.load(baseline_id).get("environment_context", {})
+    baseline_row = index.get(baseline_id)
+    baseline_hashes = (baseline_row or {}).get("section_hashes") or store.section_hashes(baseline_id)
+
+    # Without an explicit app, compare the baseline's own app across hosts
+    if app_name is None and baseline_row:
+        app_name = baseline_row["app_name"]
+    targets = select_targets(index, baseline_id, hostname, app_name, hosts)
+    yield {"type": "start", "baseline": baseline_id, "targets": len(targets)}
+
+    results = []
+    if targets:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(targets)))
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(type(store).__name__, str(store.root), baseline_env, baseline_hashes),
+        ) as executor:
+            futures = [executor.submit(diff_against_baseline, t) for t in targets]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results.append(result)
+                yield dict(result, type="host", changed_keys=len(result.get("changes", {})))
+
+    yield dict(summarize(results, outlier_fraction), type="summary", baseline=baseline_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff a baseline snapshot against the latest snapshot of many hosts")
+    parser.add_argument("--baseline", required=True, help="Snapshot id of the golden baseline")
+    parser.add_argument("--hosts", help="Hostname glob, e.g. 'web*'")
+    parser.add_argument("--app", help="Application name (default: the baseline's)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--outlier-fraction", type=float, default=DEFAULT_OUTLIER_FRACTION)
+    # Same locations as the backend's
+    data_dir = Path(os.getenv("ENVEYE_DATA_DIR", Path(__file__).resolve().parent))
+    parser.add_argument("--snapshot-dir", default=str(data_dir / "snapshots"))
+    parser.add_argument("--index", default=str(data_dir / "snapshot_index.db"))
+    args = parser.parse_args()
+
+    store_class = DedupSnapshotStore if os.getenv("ENVEYE_SNAPSHOT_STORE", "dedup") == "dedup" else SnapshotStore
+    store = store_class(args.snapshot_dir)
+    index = SnapshotIndex(args.index)
+    if index.count() == 0:
+        index.rebuild(store)
+
+    for event in run_drift(store, index, args.baseline, hostname=args.hosts, app_name=args.app,
+                           workers=args.workers, outlier_fraction=args.outlier_fraction):
+        print(json.dumps(event), flush=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
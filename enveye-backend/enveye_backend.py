@@ -1,26 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Request, Query, BackgroundTasks
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from deepdiff import DeepDiff
-import google.generativeai as genai
-import winrm
 import json
 import os
-import concurrent.futures
+import time
 import traceback
 from pathlib import Path
 from datetime import datetime
 import base64
 from fastapi import Body
-from PIL import Image
-import pytesseract
-import base64
-import io
-import re
-import unicodedata
-from openai import OpenAI
-from tiktoken import get_encoding
+import asyncio
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+from starlette.concurrency import run_in_threadpool
+from metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram, CollectorStatsAggregator
+from snapshot_index import SnapshotIndex
+from compare_cache import SnapshotComparer
+from change_timeline import ChangeTimeline
+from incident_index import IncidentIndex
+from snapshot_diff import diff_environment_contexts_fast
+from drift import DEFAULT_OUTLIER_FRACTION, run_drift
+from explain_cache import ExplainCache, explain_cache_key
+from log_extractor import ExtractionRules, LogBlockExtractor, extract_blocks_from_text
+from prompt_builder import build_prompt_sections, count_tokens, get_encoder
+from ocr_worker import OcrService
+from remote_jobs import CollectionJobQueue, RemoteCollectError, load_session_factory, normalize_targets
+from snapshot_store import (
+    SnapshotStore, DedupSnapshotStore, SnapshotValidationError, SnapshotHashMismatch, decode_snapshot_bytes,
+    read_partial_snapshot
+)
+from section_select import SectionSelector
+from snapshot_delta import DeltaBaseUnknown, InvalidPatch, store_delta_snapshot
 
 
 
@@ -36,18 +48,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Request Metrics ---
+HTTP_REQUEST_SECONDS = Histogram(
+    "enveye_http_request_duration_seconds",
+    "Request latency per endpoint (for streamed responses: until the response starts).",
+    ["method", "route", "status"]
+)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template, not the raw path, so ids do not become labels;
+        # static mounts set no route but their prefix in root_path
+        route = getattr(request.scope.get("route"), "path", None) or request.scope.get("root_path") or "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, method=request.method, route=route, status=str(status)
+        )
+
 # --- Configure Gemini API ---
+# (google.generativeai is not imported: it is unused and takes ~1 s to import)
 #genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+LLM_MODEL = os.getenv("ENVEYE_LLM_MODEL", "gpt-4")
+
+@lru_cache(maxsize=1)
+def get_llm_client():
+    """
+    The async OpenAI client, created on first use; importing openai takes
+    about a second that every worker would otherwise pay at startup.
+    OPENAI_BASE_URL may point at a compatible server, e.g. stub_llm_server.py for offline testing.
+    """
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# Max LLM calls in flight; further /explain requests wait for a slot
+explain_semaphore = asyncio.Semaphore(int(os.getenv("ENVEYE_EXPLAIN_CONCURRENCY", "4")))
+
+# --- Data Directory ---
+# Snapshots and the SQLite indexes; ENVEYE_DATA_DIR moves them elsewhere, e.g. for benchmarks
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = Path(os.getenv("ENVEYE_DATA_DIR", BASE_DIR))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# --- Explanation Cache ---
+explain_cache = ExplainCache(
+    DATA_DIR / "explain_cache.db",
+    ttl_seconds=int(os.getenv("ENVEYE_EXPLAIN_CACHE_TTL_HOURS", "168")) * 3600,
+    max_bytes=int(os.getenv("ENVEYE_EXPLAIN_CACHE_MB", "64")) * 1024 * 1024
+)
 
 # --- Serve Frontend Static Files ---
 app.mount("/static", StaticFiles(directory="../enveye-frontend/dist"), name="static")
 
 # --- Setup Snapshot Directory ---
-BASE_DIR = Path(__file__).resolve().parent
-SNAPSHOT_DIR = BASE_DIR / "snapshots"
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
 SNAPSHOT_DIR.mkdir(exist_ok=True)
 
+# "dedup" stores environment_context sections once by content hash; "compressed" keeps one file per snapshot
+SNAPSHOT_STORE_BACKEND = os.getenv("ENVEYE_SNAPSHOT_STORE", "dedup")
+if SNAPSHOT_STORE_BACKEND == "dedup":
+    snapshot_store = DedupSnapshotStore(SNAPSHOT_DIR)
+else:
+    snapshot_store = SnapshotStore(SNAPSHOT_DIR)
+
+# --- Snapshot Catalog (SQLite) ---
+SNAPSHOT_INDEX_PATH = DATA_DIR / "snapshot_index.db"
+index_is_new = not SNAPSHOT_INDEX_PATH.exists()
+snapshot_index = SnapshotIndex(SNAPSHOT_INDEX_PATH)
+if index_is_new:
+    print(f"\u2705 Indexed {snapshot_index.rebuild(snapshot_store)} existing snapshots")
+
+UPLOADS = Counter("enveye_snapshot_uploads_total", "Snapshot uploads by result.", ["result"])
+UPLOAD_BYTES = Counter("enveye_snapshot_upload_bytes_total", "Uncompressed bytes of accepted snapshot uploads.")
+UPLOAD_STORED_BYTES = Counter("enveye_snapshot_stored_bytes_total", "Bytes written to the snapshot store by uploads.")
+SNAPSHOTS_STORED = Gauge("enveye_snapshots_stored", "Snapshots in the catalog.", function=snapshot_index.count)
+
+# Per-host timings and subprocess counts the collector reports in collection_stats
+collector_stats = CollectorStatsAggregator()
+
 # --- Mount Snapshots as Static ---
 app.mount("/snapshots", StaticFiles(directory=SNAPSHOT_DIR), name="snapshots")
 
@@ -60,79 +143,339 @@ async def serve_spa():
 async def serve_spa():
     return FileResponse("../enveye-frontend/dist/index.html")
 
+# --- Diffing ---
+# "fast" is the schema-aware differ in snapshot_diff.py; "deepdiff" keeps the generic engine
+DIFF_ENGINE = os.getenv("ENVEYE_DIFF_ENGINE", "fast")
+
+def diff_environment_contexts(env1, env2, hashes1=None, hashes2=None):
+    if DIFF_ENGINE == "deepdiff":
+        from deepdiff import DeepDiff  # only needed for this engine
+        diff = DeepDiff(env1, env2, view='tree')
+        return json.loads(diff.to_json())
+    return diff_environment_contexts_fast(env1, env2, hashes1, hashes2)
+
+# Parsed snapshots and diff results are cached by content hash, bounded by memory
+snapshot_comparer = SnapshotComparer(
+    snapshot_store,
+    snapshot_index,
+    diff_environment_contexts,
+    snapshot_cache_bytes=int(os.getenv("ENVEYE_SNAPSHOT_CACHE_MB", "256")) * 1024 * 1024,
+    diff_cache_bytes=int(os.getenv("ENVEYE_DIFF_CACHE_MB", "64")) * 1024 * 1024
+)
+
+# --- Change Timeline ---
+# Consecutive diffs per host/app, computed after each upload
+change_timeline = ChangeTimeline(DATA_DIR / "change_timeline.db")
+
+# --- Similar Incidents ---
+# MinHash/LSH over changed keys and error/log text of past diffs, explanations and flags
+incident_index = IncidentIndex(DATA_DIR / "incident_index.db")
+# Every /flag report, appended; /incidents/rebuild replays it
+FLAGGED_FEEDBACK_PATH = DATA_DIR / "flagged_feedback.jsonl"
+
+def index_change_incident(snapshot):
+    incident_id = f"change:{snapshot['id']}"
+    diff = change_timeline.get_diff(snapshot["id"])
+    if not diff or not diff["change_count"]:
+        # e.g. a diff recomputed after an out-of-order upload that no longer changes anything
+        if incident_index.exists(incident_id):
+            incident_index.remove(incident_id)
+        return
+    # The comparer just cached this diff
+    differences = snapshot_comparer.compare(diff["previous_id"], snapshot["id"])["differences"]
+    incident_index.add(
+        incident_id, "change", differences=differences,
+        hostname=snapshot["hostname"], app_name=snapshot["app_name"], snapshot_id=snapshot["id"]
+    )
+
+def update_change_timeline(snapshot_id):
+    try:
+        count = change_timeline.update(snapshot_id, snapshot_index, snapshot_comparer)
+        if count is not None:
+            print(f"\u2705 Timeline: {count} changes in {snapshot_id}")
+        snapshot = snapshot_index.get(snapshot_id)
+        if snapshot:
+            index_change_incident(snapshot)
+        # Uploaded out of order: the next snapshot's diff now starts from this one
+        following = snapshot_index.next(snapshot_id)
+        if following:
+            index_change_incident(following)
+    except Exception as e:
+        print(f"\u274C Timeline update failed for {snapshot_id}: {e}")
+
+def record_collector_stats(snapshot_id, hostname):
+    try:
+        # Read from the manifest with the dedup store; the plain store parses the whole file
+        stats = snapshot_store.top_level(snapshot_id).get("collection_stats")
+        collector_stats.record(hostname, stats, snapshot_id)
+    except Exception as e:
+        print(f"\u26A0\uFE0F Could not read collection stats of {snapshot_id}: {e}")
+
 # --- Upload Snapshot API ---
+def read_delta_patch(snapshot):
+    """The JSON Patch operations of a delta upload (plain, gzip or zstd)."""
+    try:
+        return decode_snapshot_bytes(snapshot.file.read())
+    except (ValueError, OSError, EOFError) as e:
+        raise InvalidPatch(f"Delta upload is not valid JSON: {e}")
+
+def save_uploaded_snapshot(snapshot_id, snapshot, hostname, app_name, base_hash=None, target_hash=None):
+    if base_hash:
+        saved = store_delta_snapshot(
+            snapshot_store, snapshot_index, snapshot_comparer, snapshot_id,
+            read_delta_patch(snapshot), base_hash, target_hash
+        )
+    else:
+        saved = snapshot_store.save_stream(snapshot_id, snapshot.file)
+    snapshot_index.add(
+        snapshot_id, hostname=hostname, app_name=app_name,
+        size_bytes=saved["raw_bytes"], stored_bytes=saved["stored_bytes"],
+        section_hashes=saved.get("section_hashes"), content_hash=saved["content_hash"]
+    )
+    return saved
+
 @app.post("/upload_snapshot")
-async def upload_snapshot(request: Request, snapshot: UploadFile = File(...)):
+async def upload_snapshot(request: Request, background_tasks: BackgroundTasks, snapshot: UploadFile = File(...)):
+    """
+    A full snapshot, or with the `base_hash` and `target_hash` form fields a
+    JSON Patch against the stored snapshot whose content hash is `base_hash`.
+    Both return `snapshot_hash`, the base for the collector's next delta.
+    """
     try:
         form_data = await request.form()
         hostname = form_data.get("hostname", "unknown_host")
         app_folder = form_data.get("app_path", "unknown_app")
         app_name = os.path.basename(app_folder)
         app_name = app_name.replace(" ","")
+        base_hash = form_data.get("base_hash")
+        target_hash = form_data.get("target_hash")
         
         print(f"app name:{app_name}")
 
-        content = await snapshot.read()
-        parsed_content = json.loads(content)
-
-        filename = SNAPSHOT_DIR / f"{hostname}_{app_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+        if base_hash and not target_hash:
+            raise InvalidPatch("A delta upload needs target_hash")
 
-        with open(filename, "w") as f:
-            f.write(json.dumps(parsed_content, indent=4))
+        snapshot_id = f"{hostname}_{app_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
 
-        print(f"\u2705 Snapshot received and saved: {filename}")
-
-        return {"message": f"Snapshot from {hostname} collected successfully!"}
+        # Stream the (possibly compressed) body to disk, or rebuild it from the delta, off the event loop
+        saved = await run_in_threadpool(
+            save_uploaded_snapshot, snapshot_id, snapshot, hostname, app_name, base_hash, target_hash
+        )
 
+        if base_hash:
+            print(f"\u2705 Snapshot rebuilt from delta and saved: {snapshot_id} "
+                  f"(base {saved['base_id']}, {saved['stored_bytes']} stored as {saved['encoding']})")
+            UPLOADS.inc(result="delta")
+        else:
+            print(f"\u2705 Snapshot received and saved: {snapshot_id} "
+                  f"({saved['raw_bytes']} bytes, {saved['stored_bytes']} stored as {saved['encoding']})")
+            UPLOADS.inc(result="stored")
+            UPLOAD_BYTES.inc(saved["raw_bytes"])
+        UPLOAD_STORED_BYTES.inc(saved["stored_bytes"])
+
+        # Diffed against the previous snapshot of this host/app after the response is sent
+        background_tasks.add_task(update_change_timeline, snapshot_id)
+        background_tasks.add_task(record_collector_stats, snapshot_id, hostname)
+
+        return {
+            "message": f"Snapshot from {hostname} collected successfully!",
+            "snapshot_id": snapshot_id,
+            "snapshot_hash": saved["content_hash"],
+        }
+
+    except DeltaBaseUnknown:
+        # The collector falls back to a full upload
+        print(f"\u26A0\uFE0F Delta upload from {hostname} against an unknown base")
+        UPLOADS.inc(result="base_unknown")
+        return JSONResponse(content={"error": "base unknown", "code": "base_unknown"}, status_code=409)
+    except SnapshotHashMismatch as e:
+        print(f"\u274C Rejected delta upload from {hostname}: {e}")
+        UPLOADS.inc(result="rejected")
+        return JSONResponse(content={"error": str(e), "code": "hash_mismatch"}, status_code=409)
+    except SnapshotValidationError as e:
+        print(f"\u274C Rejected snapshot upload: {e}")
+        UPLOADS.inc(result="rejected")
+        return JSONResponse(content={"error": str(e)}, status_code=400)
     except Exception as e:
         print(f"\u274C Error while saving snapshot: {e}")
+        UPLOADS.inc(result="error")
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 # --- Compare Snapshots API ---
+def compare_uploaded_sections(file1, file2, selector):
+    # Scan the uploads for the selected sections instead of parsing them whole
+    env1 = read_partial_snapshot(file1, selector.wants_section)["environment_context"]
+    env2 = read_partial_snapshot(file2, selector.wants_section)["environment_context"]
+    return selector.filter_differences(diff_environment_contexts(env1, env2))
+
 @app.post("/compare")
-async def compare_snapshots(file1: UploadFile = File(...), file2: UploadFile = File(...)):
+async def compare_snapshots(request: Request, file1: UploadFile = File(...), file2: UploadFile = File(...)):
+    """
+    Diffs two uploaded snapshots. An optional `sections` form field (comma-separated
+    section names or key globs) limits the compare, and the parsing, to those keys.
+    """
     try:
+        form_data = await request.form()
+        selector = SectionSelector.parse(form_data.get("sections"))
+        if selector is not None:
+            differences = await run_in_threadpool(compare_uploaded_sections, file1.file, file2.file, selector)
+            return JSONResponse(content={"differences": differences, "sections": list(selector.patterns)})
+
         file1_content = await file1.read()
         file2_content = await file2.read()
 
-        data1 = json.loads(file1_content)
-        data2 = json.loads(file2_content)
+        data1 = decode_snapshot_bytes(file1_content)
+        data2 = decode_snapshot_bytes(file2_content)
 
-        diff = DeepDiff(data1.get('environment_context', {}), data2.get('environment_context', {}), view='tree')
+        differences = await run_in_threadpool(
+            diff_environment_contexts,
+            data1.get('environment_context', {}), data2.get('environment_context', {})
+        )
 
-        return JSONResponse(content={"differences": json.loads(diff.to_json())})
+        return JSONResponse(content={"differences": differences})
 
     except Exception as e:
         print(f"\u274C Exception during /compare: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=400)
 
-# --- Explain Differences API ---
-@app.post("/explain")
-async def explain_diff(payload: dict = Body(...)):
+# --- Compare Stored Snapshots API ---
+@app.post("/compare_stored")
+async def compare_stored_snapshots(payload: dict = Body(...)):
+    """
+    Diffs two stored snapshots by id. With `sections` (a list of section names or
+    key globs such as "app_config_settings/*Connection*") only those are loaded and compared.
+    """
     try:
-        diff = payload.get("diff", {})
-        error_message = payload.get("error_message", "").strip()
-        error_screenshot = payload.get("error_screenshot", None)
-        log_path = payload.get("log_path", "").strip()
-
-        # Extract log content
-        log_content = ""
-        if log_path:
-            full_log = read_log_file_safely(log_path)
-            log_content = extract_important_log_blocks(full_log, max_blocks=30)
-            
-            if estimate_token_count(log_content) > 10000:
-                log_content = log_content[:2000] + "\n\n[Log truncated due to size]"
-
-        # Extract text from image if present
-        screenshot_text = ""
-        if error_screenshot:
-            screenshot_text = extract_text_from_screenshot(error_screenshot)
-
-        # Construct the prompt
-        prompt = f"""
+        snapshot_a = payload.get("snapshot_a")
+        snapshot_b = payload.get("snapshot_b")
+        if not snapshot_a or not snapshot_b:
+            return JSONResponse(content={"error": "snapshot_a and snapshot_b are required."}, status_code=400)
+
+        selector = SectionSelector.parse(payload.get("sections"))
+        if selector is not None:
+            result = await run_in_threadpool(snapshot_comparer.compare_sections, snapshot_a, snapshot_b, selector)
+        else:
+            result = await run_in_threadpool(snapshot_comparer.compare, snapshot_a, snapshot_b)
+        return JSONResponse(content=result)
+
+    except FileNotFoundError as e:
+        return JSONResponse(content={"error": f"Snapshot not found: {e}"}, status_code=404)
+    except Exception as e:
+        print(f"\u274C Exception during /compare_stored: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+# --- Fleet Drift API ---
+# Drift worker processes per request; a request may ask for fewer
+DRIFT_MAX_WORKERS = int(os.getenv("ENVEYE_DRIFT_MAX_WORKERS", str(os.cpu_count() or 1)))
+
+@app.post("/drift")
+async def fleet_drift(payload: dict = Body(...)):
+    baseline = payload.get("baseline")
+    if not baseline or not snapshot_store.exists(baseline):
+        return JSONResponse(content={"error": "A stored baseline snapshot id is required."}, status_code=404)
+
+    workers = payload.get("workers")
+    if workers is not None:
+        if isinstance(workers, bool) or not isinstance(workers, int) or workers < 1:
+            return JSONResponse(content={"error": "workers must be a positive integer."}, status_code=400)
+        workers = min(workers, DRIFT_MAX_WORKERS)
+
+    outlier_fraction = payload.get("outlier_fraction", DEFAULT_OUTLIER_FRACTION)
+    is_number = isinstance(outlier_fraction, (int, float)) and not isinstance(outlier_fraction, bool)
+    if not is_number or not 0 <= outlier_fraction <= 1:
+        return JSONResponse(content={"error": "outlier_fraction must be a number between 0 and 1."}, status_code=400)
+
+    events = run_drift(
+        snapshot_store,
+        snapshot_index,
+        baseline,
+        hostname=payload.get("hostname"),
+        app_name=payload.get("app"),
+        hosts=payload.get("hosts"),
+        workers=workers or DRIFT_MAX_WORKERS,
+        outlier_fraction=outlier_fraction
+    )
+
+    # One JSON object per line, flushed as each host finishes
+    def stream():
+        try:
+            for event in events:
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"\u274C Exception during /drift: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/compare_cache_stats")
+async def compare_cache_stats():
+    return snapshot_comparer.stats()
+
+# --- Explain Differences API ---
+EXPLAIN_STAGE_SECONDS = Histogram("enveye_explain_stage_seconds", "Time per /explain stage.", ["stage"])
+EXPLAIN_REQUESTS = Counter("enveye_explain_requests_total", "/explain requests by endpoint and result.", ["endpoint", "result"])
+
+class ExplainTimings:
+    """
+    Seconds per stage of one /explain request: log_read, log_extract, ocr,
+    tokenize, llm_wait (for a free LLM slot), llm_first_token, llm and total.
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, result):
+        """Records the stages in the metrics. Returns them in ms, for the response."""
+        self.seconds["total"] = time.perf_counter() - self.started
+        for stage, seconds in self.seconds.items():
+            EXPLAIN_STAGE_SECONDS.observe(seconds, stage=stage)
+        EXPLAIN_REQUESTS.inc(endpoint=self.endpoint, result=result)
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.seconds.items()}
+
+def prepare_explain_inputs(payload, timings=None):
+    """
+    Reads logs and runs OCR for an /explain request. Blocking; call off the event loop.
+    `timings` (dict) receives the seconds spent per stage.
+    """
+    timings = timings if timings is not None else {}
+    diff = payload.get("diff", {})
+    error_message = payload.get("error_message", "").strip()
+    error_screenshot = payload.get("error_screenshot", None)
+    log_path = payload.get("log_path", "").strip()
+
+    # Extract log content (only the part of the log appended since the last call is scanned)
+    log_content = ""
+    if log_path:
+        rules = ExtractionRules.from_payload(payload.get("log_rules"))
+        log_content = extract_log_blocks_safely(log_path, rules, timings)
+
+    # Extract text from image if present
+    screenshot_text = ""
+    if error_screenshot:
+        start = time.perf_counter()
+        screenshot_text = extract_text_from_screenshot(error_screenshot)
+        timings["ocr"] = time.perf_counter() - start
+
+    return {
+        "diff": diff,
+        "error_message": error_message,
+        "screenshot_text": screenshot_text,
+        "log_content": log_content
+    }
+
+EXPLAIN_PROMPT_TEMPLATE = """
 You are a helpful assistant specialized in IT system configuration comparisons.
-Given the following DeepDiff output between two VMs, do the following:
+Given the following differences between the configuration snapshots of two VMs
+(grouped by section; ~ changed, + added, - removed), do the following:
 
 1. Give a summary of what has changed
 2. If an error message is provided or found in a screenshot, analyze it in context of the diff.
@@ -141,222 +484,540 @@ Given the following DeepDiff output between two VMs, do the following:
 5. Be concise and highlight important issues
 
 Diff data:
-{json.dumps(diff, indent=2)}
+{diff}
 
 Error message (if any):
-{error_message or 'None'}
+{error_message}
 
 Error message (from screenshot):
-{screenshot_text or 'None'}
+{screenshot_text}
 
 Log Content (if any):
-{log_content or 'None'}
+{log_content}
 """
 
-        # Use OpenAI GPT-4. If "gpt-4.1" is not supported, fallback to "gpt-4"
-        response = client.chat.completions.create(
-            model="gpt-4",  # Adjust this if "gpt-4.1" is confirmed supported
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            stream=True
-        )
+# Total tokens for the /explain prompt, split across diff, error, OCR and log text
+PROMPT_TOKEN_BUDGET = int(os.getenv("ENVEYE_PROMPT_TOKEN_BUDGET", "12000"))
+
+@lru_cache(maxsize=1)
+def explain_template_tokens():
+    return count_tokens(EXPLAIN_PROMPT_TEMPLATE.format(diff="", error_message="", screenshot_text="", log_content=""))
+
+def build_explain_prompt(inputs):
+    sections, stats = build_prompt_sections(inputs, explain_template_tokens(), PROMPT_TOKEN_BUDGET)
+    used = stats["used"]
+    print(f"🧮 Prompt tokens: {sum(used.values())}/{PROMPT_TOKEN_BUDGET} "
+          f"(diff {used['diff']}, log {used['log']}, dropped log blocks {stats['log_blocks_dropped']})")
+    return EXPLAIN_PROMPT_TEMPLATE.format(**{name: text or "None" for name, text in sections.items()})
 
-        # Aggregate streamed content
-        full_response = ""
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                full_response += chunk.choices[0].delta.content
+async def stream_llm_completion(prompt, timings=None):
+    """
+    Yields response text deltas from the async LLM client. `timings` (dict)
+    receives llm_first_token and, once the answer is complete, llm.
+    """
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    # Use OpenAI GPT-4. If "gpt-4.1" is not supported, fallback to "gpt-4"
+    response = await get_llm_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        stream=True
+    )
+    try:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                timings.setdefault("llm_first_token", time.perf_counter() - start)
+                yield chunk.choices[0].delta.content
+        timings["llm"] = time.perf_counter() - start
+    finally:
+        # Closing the stream aborts the upstream request when the client has gone away
+        await response.close()
+
+def index_explanation(cache_key, inputs, explanation):
+    try:
+        incident_index.add(
+            f"explain:{cache_key}", "explanation", differences=inputs["diff"],
+            error_message=inputs["error_message"], screenshot_text=inputs["screenshot_text"],
+            log_content=inputs["log_content"], explanation=explanation
+        )
+    except Exception as e:
+        print(f"\u26A0\uFE0F Could not index explanation: {e}")
 
-        return {"explanation": full_response}
+@app.post("/explain")
+async def explain_diff(payload: dict = Body(...)):
+    timings = ExplainTimings("explain")
+    try:
+        inputs = await run_in_threadpool(prepare_explain_inputs, payload, timings.seconds)
+        cache_key = explain_cache_key(inputs, LLM_MODEL)
+
+        if not payload.get("bypass_cache"):
+            cached = await run_in_threadpool(explain_cache.get, cache_key)
+            if cached is not None:
+                return {"explanation": cached, "cached": True, "timings_ms": timings.finish("cached")}
+
+        with timings.stage("tokenize"):
+            prompt = build_explain_prompt(inputs)
+        waiting = time.perf_counter()
+        async with explain_semaphore:
+            timings.seconds["llm_wait"] = time.perf_counter() - waiting
+            parts = [delta async for delta in stream_llm_completion(prompt, timings.seconds)]
+
+        explanation = "".join(parts)
+        await run_in_threadpool(explain_cache.put, cache_key, inputs, explanation)
+        await run_in_threadpool(index_explanation, cache_key, inputs, explanation)
+        return {"explanation": explanation, "cached": False, "timings_ms": timings.finish("generated")}
 
     except Exception as e:
         print("❌ Error during AI explanation:", e)
+        timings.finish("error")
         return {"error": str(e)}
 
+@app.post("/explain/stream")
+async def explain_diff_stream(request: Request, payload: dict = Body(...)):
+    """Server-Sent Events: `data: {"delta": "..."}` per token chunk, then `event: done`."""
+    async def events():
+        timings = ExplainTimings("explain_stream")
+        try:
+            inputs = await run_in_threadpool(prepare_explain_inputs, payload, timings.seconds)
+            cache_key = explain_cache_key(inputs, LLM_MODEL)
+
+            if not payload.get("bypass_cache"):
+                cached = await run_in_threadpool(explain_cache.get, cache_key)
+                if cached is not None:
+                    yield f"data: {json.dumps({'delta': cached})}\n\n"
+                    done = {"cached": True, "timings_ms": timings.finish("cached")}
+                    yield f"event: done\ndata: {json.dumps(done)}\n\n"
+                    return
+
+            with timings.stage("tokenize"):
+                prompt = build_explain_prompt(inputs)
+            parts = []
+            waiting = time.perf_counter()
+            async with explain_semaphore:
+                timings.seconds["llm_wait"] = time.perf_counter() - waiting
+                async for delta in stream_llm_completion(prompt, timings.seconds):
+                    if await request.is_disconnected():
+                        print("\u26A1 /explain/stream client disconnected, cancelling LLM call")
+                        timings.finish("disconnected")
+                        return
+                    parts.append(delta)
+                    yield f"data: {json.dumps({'delta': delta})}\n\n"
+
+            # Only complete answers are cached
+            await run_in_threadpool(explain_cache.put, cache_key, inputs, "".join(parts))
+            await run_in_threadpool(index_explanation, cache_key, inputs, "".join(parts))
+            done = {"cached": False, "timings_ms": timings.finish("generated")}
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+        except Exception as e:
+            print("❌ Error during streamed AI explanation:", e)
+            timings.finish("error")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- Screenshot OCR API ---
+# Tesseract runs in worker processes; results are cached by image hash
+ocr_service = OcrService(
+    workers=int(os.getenv("ENVEYE_OCR_WORKERS", "2")),
+    timeout=float(os.getenv("ENVEYE_OCR_TIMEOUT_S", "30")),
+)
+
+@app.post("/ocr")
+async def ocr_screenshot(payload: dict = Body(...)):
+    """
+    OCR of {"image": "<data URL or base64>"}. The UI calls this as soon as a
+    screenshot is attached, so /explain later finds the text in the cache.
+    """
+    image = payload.get("image")
+    if not image:
+        return JSONResponse(status_code=400, content={"error": "Missing image"})
+    result = await run_in_threadpool(ocr_service.extract, image)
+    if "error" in result:
+        return JSONResponse(status_code=422, content=result)
+    return result
+
+@app.get("/ocr/stats")
+async def ocr_stats():
+    return ocr_service.stats()
+
+@app.on_event("shutdown")
+def shutdown_ocr_pool():
+    ocr_service.shutdown()
+
+@app.get("/explain/log_checkpoints")
+async def explain_log_checkpoints():
+    return log_extractor.stats()
+
+@app.get("/explain/cache_stats")
+async def explain_cache_stats():
+    return await run_in_threadpool(explain_cache.stats)
+
 
 # --- Remote Collection API ---
+BACKEND_UPLOAD_URL = os.getenv("ENVEYE_UPLOAD_URL", "http://10.40.10.214:8000/upload_snapshot")
+
+# WinRM calls run in a shared thread pool under global and per-VM limits
+remote_jobs = CollectionJobQueue(
+    load_session_factory(os.getenv("ENVEYE_WINRM_SESSION_FACTORY")),
+    agent_path=BASE_DIR / "collector" / "collector_agent.exe",
+    upload_url=BACKEND_UPLOAD_URL,
+    max_concurrency=int(os.getenv("ENVEYE_REMOTE_CONCURRENCY", "16")),
+    per_host_concurrency=int(os.getenv("ENVEYE_REMOTE_PER_HOST", "1")),
+    max_retries=int(os.getenv("ENVEYE_REMOTE_RETRIES", "2")),
+    timeout_s=float(os.getenv("ENVEYE_REMOTE_TIMEOUT_S", "900")),
+    agent_chunk_bytes=int(os.getenv("ENVEYE_AGENT_CHUNK_KB", "192")) * 1024
+)
+
 @app.post("/remote_collect")
 async def remote_collect(request: Request):
     try:
         body = await request.json()
         vm_ip = body.get("vm_ip")
-        username = body.get("username")
-        password = body.get("password")
         app_folder = body.get("app_folder")
-        app_type = body.get("app_type")
 
         print(f"\u2705 Remote Collect Request: {vm_ip}, AppFolder={app_folder}")
 
-        session = winrm.Session(
-            f'http://{vm_ip}:5985/wsman',
-            auth=(username, password),
-            transport='ntlm'
-        )
+        target = normalize_targets([body])[0]
+        try:
+            result = await remote_jobs.collect_one(target)
+        except RemoteCollectError as e:
+            print(f"\u274C Remote collection on {vm_ip} failed: {e}")
+            return JSONResponse(content={"error": str(e)}, status_code=500)
+
+        return {
+            "status": "success",
+            "message": f"Snapshot from {vm_ip} collected and uploaded!",
+            "vm_hostname": vm_ip,
+            "timings_ms": result["timings_ms"]
+        }
+
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        print("\u274C FULL EXCEPTION in /remote_collect")
+        print(traceback.format_exc())
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.post("/remote_jobs")
+async def submit_remote_job(payload: dict = Body(...)):
+    """
+    Bulk collection: {"targets": ["10.0.0.5", {"vm_ip": ..., "app_folder": ...}], ...}.
+    Top-level username, password, app_folder and app_type apply to every
+    target that does not set its own.
+    """
+    try:
+        targets = normalize_targets(payload.get("targets"), defaults=payload)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    job_id = remote_jobs.submit(targets, max_retries=payload.get("max_retries"))
+    print(f"\u2705 Remote job {job_id} queued for {len(targets)} hosts")
+    return {"job_id": job_id, "hosts": [t["vm_ip"] for t in targets]}
 
-        backend_ip = "10.40.10.214"
-        upload_url = f"http://{backend_ip}:8000/upload_snapshot"
-
-        # Check if agent exists remotely
-        check_command = "if (!(Test-Path 'C:\\Tools\\Collector\\collector_agent.exe')) { exit 1 }"
-        check_result = session.run_ps(check_command)
-
-        if check_result.status_code != 0:
-            print("\u26A1 Remote agent not found, uploading...")
-
-            local_agent_path = BASE_DIR / "collector" / "collector_agent.exe"
-            with open(local_agent_path, "rb") as agent_file:
-                encoded_agent = base64.b64encode(agent_file.read()).decode()
-
-            ps_script = f"""
-            $bytes = [System.Convert]::FromBase64String(\"{encoded_agent}\")
-            $path = 'C:\\Tools\\Collector\\collector_agent.exe'
-            New-Item -ItemType Directory -Force -Path (Split-Path $path) | Out-Null
-            [System.IO.File]::WriteAllBytes($path, $bytes)
-            """
-            upload_result = session.run_ps(ps_script)
-            print("✅ Agent upload result:", upload_result.status_code)
-
-        collector_command = (
-            f'cmd /c "C:\\Tools\\Collector\\collector_agent.exe '
-            f'--app-folder \"{app_folder}\" '
-            f'--app-type {app_type} '
-            f'--upload-url {upload_url}"'
+
+@app.get("/remote_jobs")
+async def list_remote_jobs():
+    return {"jobs": remote_jobs.list_jobs()}
+
+
+@app.get("/remote_jobs/{job_id}")
+async def remote_job_status(job_id: str, include_output: bool = False):
+    status = remote_jobs.status(job_id, include_output=include_output)
+    if status is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return status
+
+
+@app.post("/remote_jobs/{job_id}/retry")
+async def retry_remote_job(job_id: str):
+    try:
+        hosts = remote_jobs.retry_failed(job_id)
+    except RuntimeError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=409)
+    if hosts is None:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return {"job_id": job_id, "retrying": hosts}
+
+
+@app.post("/remote_jobs/{job_id}/cancel")
+async def cancel_remote_job(job_id: str):
+    if not remote_jobs.cancel(job_id):
+        return JSONResponse(content={"error": "Job not found or already finished"}, status_code=404)
+    return {"job_id": job_id, "cancelled": True}
+
+
+@app.on_event("shutdown")
+def shutdown_remote_jobs():
+    remote_jobs.shutdown()
+
+
+# --- Warm-up ---
+# Heavy dependencies load on first use. ENVEYE_WARMUP=tokenizer,llm,ocr (or "all")
+# loads them in the background right after startup instead, so the first
+# request does not pay for them either.
+def warm_up_tokenizer():
+    get_encoder()
+    explain_template_tokens()
+
+def warm_up_deepdiff():
+    import deepdiff
+
+WARMUPS = {
+    "tokenizer": warm_up_tokenizer,
+    "llm": get_llm_client,
+    "deepdiff": warm_up_deepdiff,
+    "ocr": lambda: ocr_service.warm_up(),
+}
+
+def run_warmups(names):
+    for name in names:
+        start = time.perf_counter()
+        try:
+            WARMUPS[name]()
+            print(f"\u2705 Warm-up {name}: {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"\u26A0\uFE0F Warm-up {name} failed: {e}")
+
+@app.on_event("startup")
+def start_warmup():
+    requested = [n.strip() for n in os.getenv("ENVEYE_WARMUP", "").split(",") if n.strip()]
+    names = list(WARMUPS) if "all" in requested else [n for n in requested if n in WARMUPS]
+    for unknown in set(requested) - set(WARMUPS) - {"all"}:
+        print(f"\u26A0\uFE0F Unknown warm-up '{unknown}', expected one of {', '.join(WARMUPS)}")
+    if names:
+        threading.Thread(target=run_warmups, args=(names,), name="warmup", daemon=True).start()
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text format: request latencies, uploads, /explain and remote collection stages, collector stats."""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/metrics/collector")
+def collector_metrics(hostname: str = None):
+    """Per-host collector section timings (avg/max/last ms) and subprocess counts, from uploaded snapshots."""
+    return {"hosts": collector_stats.summary(hostname)}
+
+
+DEFAULT_LIST_PAGE_SIZE = 500
+
+@app.get("/list_snapshots")
+def list_snapshots(
+    hostname: str = None,
+    app: str = None,
+    since: str = None,
+    until: str = None,
+    sort: str = "timestamp",
+    order: str = "desc",
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = None,
+):
+    """
+    Catalog listing. Without `limit` and `cursor` every snapshot is returned,
+    as the snapshot viewers expect; pass `limit` to page with `next_cursor`.
+    """
+    try:
+        if limit is None and cursor:
+            limit = DEFAULT_LIST_PAGE_SIZE
+        page = snapshot_index.query(
+            hostname=hostname, app_name=app, since=since, until=until,
+            sort=sort, order=order, limit=limit, cursor=cursor
         )
+        return {
+            "snapshots": [item["id"] for item in page["items"]],
+            "items": page["items"],
+            "next_cursor": page["next_cursor"]
+        }
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        print(f"\u2705 Prepared Command: {collector_command}")
-
-        def run_remote_cmd():
-            return session.run_cmd(collector_command)
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(run_remote_cmd)
-            try:
-                result = future.result(timeout=900)
-            except concurrent.futures.TimeoutError:
-                print("\u274C Remote Collector Timed Out after 10 minutes!")
-                return JSONResponse(content={"error": "Timeout after 10 minutes."}, status_code=500)
-
-        print(f"\u2705 Remote Collector exited with code {result.status_code}")
-        print("✅ StdOut:", result.std_out.decode(errors="ignore"))
-        print("✅ StdErr:", result.std_err.decode(errors="ignore"))
-
-        if result.status_code == 0:
-            return {
-                "status": "success",
-                "message": f"Snapshot from {vm_ip} collected and uploaded!",
-                "vm_hostname": vm_ip
-            }
-        else:
-            return JSONResponse(
-                content={"error": f"Remote agent failed. Code {result.status_code}"},
-                status_code=500
-            )
 
+@app.get("/list_snapshots/latest")
+def list_latest_snapshots(hostname: str = None, app: str = None):
+    try:
+        return {"snapshots": snapshot_index.latest(hostname=hostname, app_name=app)}
     except Exception as e:
-        print("\u274C FULL EXCEPTION in /remote_collect")
-        print(traceback.format_exc())
         return JSONResponse(content={"error": str(e)}, status_code=500)
-        
-        
-@app.get("/list_snapshots")
-async def list_snapshots():
+
+
+@app.post("/reindex_snapshots")
+def reindex_snapshots():
+    try:
+        return {"indexed": snapshot_index.rebuild(snapshot_store)}
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.get("/timeline")
+def change_timeline_events(
+    hostname: str,
+    app: str = None,
+    key: str = None,
+    section: str = None,
+    category: str = None,
+    since: str = None,
+    until: str = None,
+    order: str = "desc",
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: str = None,
+):
+    """
+    Every change on a host between consecutive snapshots, e.g.
+    /timeline?hostname=web01&key=app_folder_dlls/*Newtonsoft.Json.dll*
+    """
+    try:
+        return change_timeline.query(
+            hostname, app_name=app, key=key, section=section, category=category,
+            since=since, until=until, order=order, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.post("/timeline/rebuild")
+def rebuild_change_timeline(hostname: str = None, app: str = None):
+    """Computes the consecutive diffs missing from the timeline, e.g. for older snapshots."""
     try:
-        snapshots = []
-        for file in SNAPSHOT_DIR.glob("*.json"):
-            snapshots.append(file.name)
-        return {"snapshots": snapshots}
+        result = change_timeline.backfill(snapshot_index, snapshot_comparer, hostname=hostname, app_name=app)
+        return dict(result, **change_timeline.stats())
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
 @app.get("/download_snapshot/{filename}")
-async def download_snapshot(filename: str):
-    file_path = SNAPSHOT_DIR / filename
-    if file_path.exists():
-        return FileResponse(file_path, filename=filename, media_type='application/json')
-    else:
+async def download_snapshot(filename: str, request: Request, sections: str = None):
+    """The stored snapshot; `sections` (comma-separated names or globs) returns only those sections."""
+    file_path, encoding = snapshot_store.path_for(filename)
+    if file_path is None:
         return JSONResponse(content={"error": "File not found."}, status_code=404)
+
+    try:
+        selector = SectionSelector.parse(sections)
+        if selector is not None:
+            snapshot = await run_in_threadpool(snapshot_store.load_partial, filename, selector.wants_section)
+            return JSONResponse(content=snapshot)
+    except Exception as e:
+        print(f"\u274C Exception during /download_snapshot: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    # Serve gzip at rest as-is when the client can decode it, otherwise decompress on the fly
+    if encoding == "identity":
+        return FileResponse(file_path, filename=filename, media_type='application/json')
+    if encoding == "gzip" and "gzip" in request.headers.get("accept-encoding", ""):
+        return FileResponse(file_path, filename=filename, media_type='application/json',
+                            headers={"Content-Encoding": "gzip"})
+    return StreamingResponse(
+        snapshot_store.iter_bytes(filename),
+        media_type='application/json',
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
         
 @app.post("/flag")
 async def flag_feedback(payload: dict = Body(...)):
     try:
         # Save flagged content for review or retraining
-        with open("flagged_feedback.jsonl", "a") as f:
+        with open(FLAGGED_FEEDBACK_PATH, "a") as f:
             f.write(json.dumps(payload) + "\n")
-        return {"message": "Feedback recorded"}
+
+        # Never serve a flagged explanation from the cache again
+        evicted = await run_in_threadpool(explain_cache.evict_flagged, payload)
+        incident_id = await run_in_threadpool(incident_index.flag, payload)
+        return {"message": "Feedback recorded", "evicted_cached_explanations": evicted, "incident_id": incident_id}
     except Exception as e:
         print("Feedback error:", e)
         return {"error": str(e)}
 
+
+
+@app.post("/incidents/similar")
+async def similar_incidents(payload: dict = Body(...)):
+    """
+    Past incidents most similar to an /explain-style payload (diff,
+    error_message, error_screenshot, log_path), to check for a known cause
+    before asking the LLM. Optional: limit (default 10), min_score (default 0.2).
+    """
+    try:
+        inputs = await run_in_threadpool(prepare_explain_inputs, payload)
+        matches = await run_in_threadpool(
+            incident_index.similar,
+            inputs["diff"], inputs["error_message"], inputs["screenshot_text"], inputs["log_content"],
+            int(payload.get("limit", 10)), float(payload.get("min_score", 0.2))
+        )
+        return {"incidents": matches}
+    except Exception as e:
+        print("\u274C Error during similar-incident lookup:", e)
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.get("/incidents/stats")
+async def incident_stats():
+    return incident_index.stats()
+
+
+@app.post("/incidents/rebuild")
+def rebuild_incident_index():
+    """Indexes stored timeline diffs and past flags that are not in the index yet."""
+    before = incident_index.stats()["incidents"]
+    for diff, differences in change_timeline.iter_diffs():
+        incident_id = f"change:{diff['snapshot_id']}"
+        if not incident_index.exists(incident_id):
+            incident_index.add(
+                incident_id, "change", differences=differences, hostname=diff["hostname"],
+                app_name=diff["app_name"], snapshot_id=diff["snapshot_id"]
+            )
+    if FLAGGED_FEEDBACK_PATH.exists():
+        with open(FLAGGED_FEEDBACK_PATH) as f:
+            for line in f:
+                try:
+                    incident_index.flag(json.loads(line))
+                except ValueError:
+                    continue
+    stats = incident_index.stats()
+    return dict(stats, added=stats["incidents"] - before)
+
         
 # --- Utilities ---
-def read_log_file_safely(path, max_lines=200000):
-    """
-    Safely reads the last `max_lines` from a log file to avoid memory overload.
-    
-    Args:
-        path (str): Path to the log file.
-        max_lines (int): Number of lines to read from the end (default 200k).
+# At most this many bytes from the end of a log are scanned for error blocks
+LOG_TAIL_MAX_BYTES = int(os.getenv("ENVEYE_LOG_TAIL_MB", "50")) * 1024 * 1024
+
+log_extractor = LogBlockExtractor(max_scan_bytes=LOG_TAIL_MAX_BYTES)
 
-    Returns:
-        str: A string of the last N lines of the log.
+def extract_log_blocks_safely(path, rules=None, timings=None):
+    """
+    Extracts the latest unique error blocks (with stack traces) from a log
+    file. Checkpoints per path mean a growing log is only scanned from where
+    the previous call stopped.
     """
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()
-            return ''.join(lines[-max_lines:])
-    except Exception as e:
+        return log_extractor.extract(path, rules, timings)
+    except OSError as e:
         print(f"⚠️ Error reading log file at {path}: {e}")
         return ""
 
-
-def normalize_log_block(block):
-    # Remove timestamps and join for deduplication
-    clean = re.sub(r'\d{4}-\d{2}-\d{2}[\sT]\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', block)
-    clean = re.sub(r'\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', clean)
-    return clean.strip()
-
 def extract_important_log_blocks(log_text, keywords=None, max_blocks=30):
     """
     Extracts important log blocks, including multi-line stack traces,
     filters by keyword, deduplicates by content (ignoring timestamps),
     and limits output to the latest N unique blocks.
     """
-    keywords = keywords or ['ERROR', 'Exception', 'Traceback', 'CRITICAL', 'Failed', 'Caused by']
-    lines = log_text.splitlines()
-
-    blocks = []
-    current_block = []
-    seen = set()
-
-    def commit_block():
-        if current_block:
-            full_block = "\n".join(current_block).strip()
-            norm = normalize_log_block(full_block)
-            if norm not in seen:
-                seen.add(norm)
-                blocks.append(full_block)
-            current_block.clear()
-
-    for line in lines:
-        if any(k in line for k in keywords):
-            commit_block()  # Save previous block before starting new one
-            current_block.append(line)
-        elif current_block and (line.startswith(" ") or line.startswith("\t") or line.strip() == ""):
-            # Likely a stack trace or continuation
-            current_block.append(line)
-        else:
-            commit_block()
-
-    commit_block()  # Final block
-
-    return "\n\n---\n\n".join(blocks[-max_blocks:])
-
-def estimate_token_count(text):
-    enc = get_encoding("cl100k_base")
-    return len(enc.encode(text))
+    if keywords:
+        rules = ExtractionRules(keywords=keywords, max_blocks=max_blocks)
+    else:
+        rules = ExtractionRules(max_blocks=max_blocks)
+    return extract_blocks_from_text(log_text, rules)
 
 def read_log_file(path):
     try:
@@ -369,25 +1030,6 @@ def read_log_file(path):
 
 
 def extract_text_from_screenshot(base64_image):
-    try:
-        image_data = base64.b64decode(base64_image.split(",")[-1])
-        image = Image.open(io.BytesIO(image_data))
-        raw_text = pytesseract.image_to_string(image)
-        cleaned_text = clean_ocr_text(raw_text)
-        return cleaned_text
-    except Exception as e:
-        print("Error extracting text from screenshot:", e)
-        return ""
-        
-def clean_ocr_text(text):
-    # Normalize Unicode (e.g., accented characters)
-    text = unicodedata.normalize("NFKD", text)
-
-    # Remove non-printable characters (keep ASCII)
-    text = re.sub(r'[^\x20-\x7E]+', '', text)
-
-    # Collapse multiple spaces, remove leading/trailing whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-
-    return text
+    """OCR in the worker pool; cached by image hash, "" on failure or timeout."""
+    return ocr_service.extract(base64_image)["text"]
 
@@ -0,0 +1,138 @@
+"""
+Persistent cache of /explain responses.
+
+Keyed by a canonical hash of the prompt inputs (diff with keys sorted, error
+message, OCR text and extracted log blocks) plus the model name, so asking
+again about the same incident skips the LLM call. Entries expire after a TTL
+and the least recently used are evicted once the cache grows past a size
+limit. Flagged explanations are removed so they are not served again.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS explanations (
+    key TEXT PRIMARY KEY,
+    diff_hash TEXT NOT NULL,
+    error_hash TEXT NOT NULL,
+    response_hash TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_explanations_diff ON explanations (diff_hash, error_hash);
+CREATE INDEX IF NOT EXISTS idx_explanations_response ON explanations (response_hash);
+CREATE INDEX IF NOT EXISTS idx_explanations_access ON explanations (last_access);
+"""
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def diff_hash(diff):
+    # Order-insensitive: the same diff with keys in another order hashes the same
+    return sha256_text(json.dumps(diff, sort_keys=True, separators=(",", ":"), default=str))
+
+
+def explain_cache_key(inputs, model):
+    """
+    Args:
+        inputs (dict): {"diff", "error_message", "screenshot_text", "log_content"}
+        model (str): LLM model name; a different model never reuses an answer.
+    """
+    return sha256_text(json.dumps({
+        "model": model,
+        "diff": diff_hash(inputs.get("diff", {})),
+        "error_message": (inputs.get("error_message") or "").strip(),
+        "screenshot_text": inputs.get("screenshot_text") or "",
+        "log_content": inputs.get("log_content") or "",
+    }, sort_keys=True))
+
+
+class ExplainCache:
+    def __init__(self, db_path, ttl_seconds, max_bytes):
+        self.db_path = str(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.write_lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM explanations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM explanations WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE explanations SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, inputs, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        row = (
+            key,
+            diff_hash(inputs.get("diff", {})),
+            sha256_text((inputs.get("error_message") or "").strip()),
+            sha256_text(response),
+            response,
+            size,
+            now,
+            now,
+        )
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO explanations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM explanations WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM explanations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM explanations ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM explanations WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def evict_flagged(self, flag_payload):
+        """
+        Drops cached answers matching a /flag payload: the flagged explanation
+        text itself, and anything cached for the same diff and error message.
+
+        Returns:
+            int: number of entries removed.
+        """
+        explanation = flag_payload.get("explanation") or ""
+        diff = flag_payload.get("diff", {})
+        error_message = (flag_payload.get("error_message") or "").strip()
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "DELETE FROM explanations WHERE response_hash = ? OR (diff_hash = ? AND error_hash = ?)",
+                (sha256_text(explanation), diff_hash(diff), sha256_text(error_message)),
+            )
+            return cursor.rowcount
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM explanations"
+            ).fetchone()
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes, "ttl_seconds": self.ttl_seconds}
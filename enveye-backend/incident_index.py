@@ -0,0 +1,407 @@
+"""
+Similar-incident lookup.
+
+Every incident (a stored consecutive diff, an /explain answer, a /flag
+report) is reduced to two feature sets:
+
+- "diff": the changed key paths, with DLL and file paths reduced to their
+  file name so the same change matches across install folders;
+- "text": word 3-shingles and exception type names from the error message,
+  OCR text and the first lines of the extracted log blocks, after numbers,
+  GUIDs, hex values and timestamps have been masked.
+
+Each set gets a MinHash signature, and the signatures are banded into
+in-memory LSH buckets, so a lookup only scores incidents that share at least
+one bucket with the query; the best candidates are then re-scored on their
+exact feature sets. Incidents and signatures are persisted in SQLite;
+the buckets are rebuilt from it at startup and updated as incidents arrive.
+"""
+
+import hashlib
+import json
+import ntpath
+import re
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from contextlib import closing
+from datetime import datetime
+
+from change_timeline import key_path
+from log_extractor import BLOCK_SEPARATOR, strip_timestamps
+
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+MAX_FEATURES = 4096
+MAX_TEXT_CHARS = 4000
+# Candidates re-scored exactly per lookup: limit * RESCORE_FACTOR, at least RESCORE_MIN
+RESCORE_FACTOR = 5
+RESCORE_MIN = 50
+CHANNELS = ("diff", "text")
+
+BIN_BITS = NUM_PERM.bit_length() - 1  # NUM_PERM must be a power of two
+# Estimated similarity from the number of matching bands: a band matches with probability s ** ROWS
+HITS_TO_SIMILARITY = [(hits / BANDS) ** (1 / ROWS) for hits in range(BANDS + 1)]
+
+MASKS = (
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.I), " <guid> "),
+    (re.compile(r"\b0x[0-9a-f]+\b", re.I), " <hex> "),
+    (re.compile(r"\d+"), " <n> "),
+)
+WORD_RE = re.compile(r"[a-z_<][a-z0-9_.<>]*")
+EXCEPTION_RE = re.compile(r"\b([A-Za-z_][\w.]*(?:Exception|Error))\b")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    hostname TEXT,
+    app_name TEXT,
+    snapshot_id TEXT,
+    summary TEXT,
+    error_message TEXT,
+    explanation TEXT,
+    explanation_hash TEXT,
+    flagged INTEGER NOT NULL DEFAULT 0,
+    feedback TEXT,
+    features TEXT NOT NULL,
+    signatures BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_incidents_explanation ON incidents (explanation_hash);
+"""
+
+
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def cap_features(features):
+    """At most MAX_FEATURES, chosen by hash so that two large sets keep comparable samples."""
+    if len(features) <= MAX_FEATURES:
+        return set(features)
+    return set(sorted(features, key=feature_hash)[:MAX_FEATURES])
+
+
+def minhash(features):
+    """
+    One-permutation MinHash: each feature hash goes to one of NUM_PERM bins by
+    its low bits and each bin keeps its minimum, so a signature costs one pass
+    over the features. Empty bins borrow the next non-empty bin's value,
+    tagged with the distance (rotation densification), to keep the
+    signatures of small sets comparable.
+    """
+    bins = [None] * NUM_PERM
+    for feature in features:
+        h = feature_hash(feature)
+        slot, value = h & (NUM_PERM - 1), h >> BIN_BITS
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+    if all(value is None for value in bins):
+        return None
+    signature = array("Q")
+    for i in range(NUM_PERM):
+        distance = 0
+        while bins[(i + distance) % NUM_PERM] is None:
+            distance += 1
+        signature.append((distance << (64 - BIN_BITS)) | bins[(i + distance) % NUM_PERM])
+    return signature
+
+
+def band_keys(signature):
+    return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+# --- Features ---
+def diff_features(differences):
+    features = set()
+    for category, entries in (differences or {}).items():
+        paths = entries.keys() if isinstance(entries, dict) else entries if isinstance(entries, list) else ()
+        for path in paths:
+            parts = key_path(path).split("/")
+            # DLL and config paths differ per install folder; the file name does not
+            parts = [ntpath.basename(p).lower() if "\\" in p else p for p in parts]
+            features.add(f"k:{category}:{'/'.join(parts)}")
+            features.add(f"s:{category}:{parts[0]}")
+    return cap_features(features)
+
+
+def normalize_text(text):
+    text = strip_timestamps(text.encode("utf-8", "ignore")).decode("utf-8", "ignore")
+    for pattern, replacement in MASKS:
+        text = pattern.sub(replacement, text)
+    return WORD_RE.findall(text.lower())
+
+
+def text_features(*texts, log_content=None):
+    """Word 3-shingles and exception names of the error texts and of the first line of each log block."""
+    features = set()
+    sources = [t for t in texts if t]
+    for block in (log_content or "").split(BLOCK_SEPARATOR):
+        lines = [line for line in block.strip().splitlines() if line.strip()]
+        sources.extend(lines[:2])
+    for text in sources:
+        features.update(f"x:{name}" for name in EXCEPTION_RE.findall(text))
+        words = normalize_text(text)
+        if len(words) < 3:
+            features.update(f"w:{w}" for w in words)
+        features.update(f"e:{' '.join(words[i:i + 3])}" for i in range(len(words) - 2))
+    return cap_features(features)
+
+
+def describe_feature(feature):
+    kind, _, value = feature.partition(":")
+    if kind in ("k", "s"):
+        category, _, key = value.partition(":")
+        return f"{category} {key}"
+    return value
+
+
+def summarize(differences, error_message):
+    keys = []
+    for entries in (differences or {}).values():
+        paths = entries.keys() if isinstance(entries, dict) else entries if isinstance(entries, list) else ()
+        keys.extend(key_path(p) for p in paths)
+    summary = f"{len(keys)} changes"
+    if keys:
+        summary += ": " + ", ".join(keys[:5]) + (" ..." if len(keys) > 5 else "")
+    first_line = (error_message or "").strip().split("\n", 1)[0]
+    if first_line:
+        summary += f" | {first_line[:200]}"
+    return summary
+
+
+def explanation_hash(explanation):
+    return hashlib.sha256((explanation or "").encode("utf-8")).hexdigest()
+
+
+def flag_incident_id(payload):
+    return "flag:" + hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+class IncidentIndex:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        self.signatures = {}
+        self.buckets = {}
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            for row in conn.execute("SELECT id, signatures FROM incidents"):
+                self._index(row["id"], self._load_signatures(row["signatures"]))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _dump_signatures(signatures):
+        blob = bytearray()
+        for channel in CHANNELS:
+            signature = signatures.get(channel)
+            blob += b"\x01" + signature.tobytes() if signature is not None else b"\x00"
+        return bytes(blob)
+
+    @staticmethod
+    def _load_signatures(blob):
+        signatures, position = {}, 0
+        size = NUM_PERM * 8
+        for channel in CHANNELS:
+            present = blob[position]
+            position += 1
+            if present:
+                signatures[channel] = array("Q", blob[position:position + size])
+                position += size
+        return signatures
+
+    # --- In-memory LSH (callers hold self.lock) ---
+    def _index(self, incident_id, signatures):
+        self._unindex(incident_id)
+        self.signatures[incident_id] = signatures
+        for channel, signature in signatures.items():
+            for key in band_keys(signature):
+                self.buckets.setdefault((channel, key), set()).add(incident_id)
+
+    def _unindex(self, incident_id):
+        old = self.signatures.pop(incident_id, None)
+        for channel, signature in (old or {}).items():
+            for key in band_keys(signature):
+                bucket = self.buckets.get((channel, key))
+                if bucket is not None:
+                    bucket.discard(incident_id)
+                    if not bucket:
+                        del self.buckets[(channel, key)]
+
+    # --- Writing ---
+    def add(self, incident_id, kind, differences=None, error_message="", screenshot_text="",
+            log_content="", explanation=None, hostname=None, app_name=None, snapshot_id=None):
+        """
+        Adds or replaces an incident. The flag state and feedback of an
+        existing incident are kept.
+
+        Returns:
+            bool: False if the incident has nothing to index.
+        """
+        features = {
+            "diff": diff_features(differences),
+            "text": text_features(error_message, screenshot_text, log_content=log_content),
+        }
+        signatures = {channel: minhash(f) for channel, f in features.items() if f}
+        if not signatures:
+            return False
+        row = (
+            incident_id, kind, datetime.now().replace(microsecond=0).isoformat(),
+            hostname, app_name, snapshot_id, summarize(differences, error_message or screenshot_text),
+            (error_message or "")[:MAX_TEXT_CHARS],
+            (explanation or "")[:MAX_TEXT_CHARS] or None,
+            explanation_hash(explanation) if explanation else None,
+            json.dumps({channel: sorted(f) for channel, f in features.items()}),
+            self._dump_signatures(signatures),
+        )
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO incidents (id, kind, created_at, hostname, app_name, snapshot_id, summary,
+                                       error_message, explanation, explanation_hash, features, signatures)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    kind = excluded.kind, hostname = excluded.hostname, app_name = excluded.app_name,
+                    snapshot_id = excluded.snapshot_id, summary = excluded.summary,
+                    error_message = excluded.error_message,
+                    explanation = COALESCE(excluded.explanation, incidents.explanation),
+                    explanation_hash = COALESCE(excluded.explanation_hash, incidents.explanation_hash),
+                    features = excluded.features, signatures = excluded.signatures
+                """,
+                row
+            )
+            self._index(incident_id, signatures)
+        return True
+
+    def flag(self, payload):
+        """
+        Records /flag feedback. The incident whose explanation was flagged is
+        marked; a flag for an explanation never indexed becomes an incident
+        of its own.
+
+        Returns:
+            str: the id of the flagged incident, or None if nothing could be indexed.
+        """
+        explanation = payload.get("explanation") or ""
+        feedback = {key: payload[key] for key in ("comment", "resolution", "log_path") if payload.get(key)}
+        feedback["flagged_at"] = datetime.now().replace(microsecond=0).isoformat()
+
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, feedback FROM incidents WHERE explanation_hash = ? ORDER BY created_at DESC LIMIT 1",
+                (explanation_hash(explanation),)
+            ).fetchone() if explanation else None
+        if row is not None:
+            incident_id = row["id"]
+        else:
+            incident_id = flag_incident_id(payload)
+            if not self.add(incident_id, "flag", differences=payload.get("diff"),
+                            error_message=payload.get("error_message") or "", explanation=explanation):
+                return None
+        return self._append_feedback(incident_id, feedback)
+
+    def _append_feedback(self, incident_id, feedback):
+        with self.lock, closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT feedback FROM incidents WHERE id = ?", (incident_id,)).fetchone()
+            entries = json.loads(row["feedback"]) if row and row["feedback"] else []
+            # The same feedback again (e.g. replayed from the feedback log) is recorded once
+            if not any(dict(entry, flagged_at=None) == dict(feedback, flagged_at=None) for entry in entries):
+                entries.append(feedback)
+            conn.execute("UPDATE incidents SET flagged = 1, feedback = ? WHERE id = ?",
+                         (json.dumps(entries), incident_id))
+        return incident_id
+
+    def exists(self, incident_id):
+        with self.lock:
+            return incident_id in self.signatures
+
+    def remove(self, incident_id):
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM incidents WHERE id = ?", (incident_id,))
+            self._unindex(incident_id)
+
+    # --- Queries ---
+    def similar(self, differences=None, error_message="", screenshot_text="", log_content="",
+                limit=10, min_score=0.2):
+        """
+        Most similar stored incidents. LSH buckets give the candidates and,
+        by the number of bands they share with the query, a first estimate;
+        the best of them are re-scored on their exact feature sets. The score is the mean Jaccard similarity
+        over the channels (diff, text) the query has.
+
+        Returns:
+            list: incident dicts with "score", per-channel "scores" and the
+                  "shared" features that matched, best first.
+        """
+        features = {
+            "diff": diff_features(differences),
+            "text": text_features(error_message, screenshot_text, log_content=log_content),
+        }
+        features = {channel: f for channel, f in features.items() if f}
+        query = {channel: minhash(f) for channel, f in features.items()}
+        if not query:
+            return []
+
+        with self.lock:
+            band_hits = {}
+            for channel, signature in query.items():
+                hits = band_hits[channel] = Counter()
+                for key in band_keys(signature):
+                    hits.update(self.buckets.get((channel, key), ()))
+        estimated = Counter()
+        for hits in band_hits.values():
+            for incident_id, count in hits.items():
+                estimated[incident_id] += HITS_TO_SIMILARITY[count]
+        # Estimates are coarse; leave room for the exact re-score
+        threshold = min_score / 2 * len(query)
+        ids = [incident_id for incident_id, score in estimated.most_common(max(limit * RESCORE_FACTOR, RESCORE_MIN))
+               if score >= threshold]
+        if not ids:
+            return []
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT * FROM incidents WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        scored = []
+        for row in rows:
+            stored_features = {channel: set(f) for channel, f in json.loads(row["features"]).items()}
+            scores, shared = {}, []
+            for channel, query_features in features.items():
+                other = stored_features.get(channel, set())
+                common = query_features & other
+                scores[channel] = len(common) / len(query_features | other)
+                shared.extend(sorted(common)[:10])
+            score = sum(scores.values()) / len(scores)
+            if score >= min_score:
+                scored.append((score, row, scores, shared))
+        scored.sort(key=lambda item: (-item[0], item[1]["id"]))
+
+        return [{
+            "incident_id": row["id"],
+            "kind": row["kind"],
+            "score": round(score, 3),
+            "scores": {channel: round(s, 3) for channel, s in scores.items()},
+            "created_at": row["created_at"],
+            "hostname": row["hostname"],
+            "app_name": row["app_name"],
+            "snapshot_id": row["snapshot_id"],
+            "summary": row["summary"],
+            "error_message": row["error_message"],
+            "explanation": row["explanation"],
+            "flagged": bool(row["flagged"]),
+            "feedback": json.loads(row["feedback"]) if row["feedback"] else [],
+            "shared": [describe_feature(f) for f in shared[:10]],
+        } for score, row, scores, shared in scored[:limit]]
+
+    def stats(self):
+        with self.lock:
+            incidents = len(self.signatures)
+            buckets = len(self.buckets)
+        return {"incidents": incidents, "buckets": buckets, "num_perm": NUM_PERM, "bands": BANDS}
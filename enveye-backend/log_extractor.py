@@ -0,0 +1,427 @@
+"""
+Streaming extraction of important log blocks for /explain.
+
+The log is read in large binary chunks and pushed through a generator
+pipeline: chunks -> keyword blocks (with their stack-trace continuation
+lines) -> unique blocks. Keywords are located with literal searches over each
+whole chunk, so lines without a keyword are skipped in C rather than tested one
+by one in Python. (`re` has no multi-literal search: one bytes.find pass per
+keyword is several times faster than a single alternation.)
+
+The extractor keeps a checkpoint per log path (byte offset, fingerprint of the
+bytes before it, dedup set and latest blocks), so asking again about a log
+that has only grown scans just the new tail.
+"""
+
+import bisect
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+DEFAULT_KEYWORDS = ('ERROR', 'Exception', 'Traceback', 'CRITICAL', 'Failed', 'Caused by')
+DEFAULT_CONTINUATION_PREFIXES = (' ', '\t')
+DEFAULT_MAX_BLOCKS = 30
+DEFAULT_MAX_SCAN_BYTES = 50 * 1024 * 1024
+
+CHUNK_SIZE = 8 * 1024 * 1024
+# A block still growing at the end of a chunk is carried into the next one;
+# past this size it is emitted as is
+MAX_BLOCK_BYTES = 1024 * 1024
+FINGERPRINT_BYTES = 256
+MAX_CHECKPOINTS = 256
+
+BLOCK_SEPARATOR = "\n\n---\n\n"
+
+# Timestamps are found from their ":MM:SS" part, which starts with a literal
+# and so is searched much faster than a pattern starting with \d
+TIME_TAIL_RE = re.compile(rb':\d{2}:\d{2}(?:[,\.]\d+)?')
+DATE_PREFIX_RE = re.compile(rb'\d{4}-\d{2}-\d{2}[\sT]')
+DIGITS = b"0123456789"
+
+
+@lru_cache(maxsize=64)
+def compile_keyword_matchers(keywords, ignore_case=False):
+    """
+    One matcher per keyword, on raw bytes: the keyword itself (searched with
+    bytes.find, the fastest literal search available) or, when ignoring case,
+    a compiled pattern.
+    """
+    needles = [k.encode("utf-8") for k in dict.fromkeys(keywords)]
+    if ignore_case:
+        return tuple(re.compile(re.escape(k), re.IGNORECASE) for k in needles)
+    return tuple(needles)
+
+
+def keyword_positions(matchers, buf, end):
+    """Sorted start offsets of every keyword match in buf[:end]."""
+    positions = []
+    for matcher in matchers:
+        if isinstance(matcher, bytes):
+            i = buf.find(matcher, 0, end)
+            while i >= 0:
+                positions.append(i)
+                i = buf.find(matcher, i + 1, end)
+        else:
+            positions.extend(m.start() for m in matcher.finditer(buf, 0, end))
+    if len(matchers) > 1:
+        positions.sort()
+    return positions
+
+
+class ExtractionRules:
+    """
+    Which lines start a block and which following lines belong to it.
+
+    A line containing any keyword always starts a new block. A following line
+    continues the block if it starts with one of `continuation_prefixes`, is
+    blank (when `blank_lines_continue`), or matches `continuation_pattern`.
+    """
+
+    def __init__(self, keywords=DEFAULT_KEYWORDS, continuation_prefixes=DEFAULT_CONTINUATION_PREFIXES,
+                 continuation_pattern=None, blank_lines_continue=True, ignore_case=False,
+                 max_blocks=DEFAULT_MAX_BLOCKS):
+        self.keywords = tuple(k for k in keywords if k)
+        if not self.keywords:
+            raise ValueError("At least one log keyword is required")
+        self.continuation_prefixes = tuple(p for p in continuation_prefixes if p)
+        self.continuation_pattern = continuation_pattern or None
+        self.blank_lines_continue = bool(blank_lines_continue)
+        self.ignore_case = bool(ignore_case)
+        self.max_blocks = max(1, int(max_blocks))
+
+        if any("\n" in p for p in self.continuation_prefixes):
+            raise ValueError("continuation_prefixes cannot contain newlines")
+
+        self.matchers = compile_keyword_matchers(self.keywords, self.ignore_case)
+        self._prefixes = tuple(p.encode("utf-8") for p in self.continuation_prefixes)
+        try:
+            self._pattern = re.compile(self.continuation_pattern.encode("utf-8")) if self.continuation_pattern else None
+        except re.error as e:
+            raise ValueError(f"Invalid continuation_pattern: {e}")
+        self.continuation_run = None if self._pattern else self._compile_continuation_run()
+
+    def _compile_continuation_run(self):
+        """
+        Without a custom pattern, a whole run of continuation lines is matched
+        by one regex starting at the newline before it, instead of line by line.
+        """
+        alternatives = []
+        if self._prefixes:
+            alternatives.append(b"(?:" + b"|".join(re.escape(p) for p in self._prefixes) + rb")[^\n]*")
+        if self.blank_lines_continue:
+            # Whitespace-only line, or an empty one that is not the end of the data
+            alternatives.append(rb"[ \t\r\x0b\x0c]+(?=\n|\Z)|(?=\n)")
+        if not alternatives:
+            return None
+        return re.compile(rb"(?:\n(?:" + b"|".join(alternatives) + rb"))*")
+
+    @classmethod
+    def from_payload(cls, rules):
+        """
+        Builds rules from the optional `log_rules` object of an /explain request:
+        {"keywords", "continuation_prefixes", "continuation_pattern",
+         "blank_lines_continue", "ignore_case", "max_blocks"}.
+        """
+        rules = rules or {}
+        if not isinstance(rules, dict):
+            raise ValueError("log_rules must be an object")
+        for field in ("keywords", "continuation_prefixes"):
+            value = rules.get(field)
+            if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                raise ValueError(f"log_rules.{field} must be a list of strings")
+        return cls(
+            keywords=rules.get("keywords") or DEFAULT_KEYWORDS,
+            continuation_prefixes=rules.get("continuation_prefixes", DEFAULT_CONTINUATION_PREFIXES),
+            continuation_pattern=rules.get("continuation_pattern"),
+            blank_lines_continue=rules.get("blank_lines_continue", True),
+            ignore_case=rules.get("ignore_case", False),
+            max_blocks=rules.get("max_blocks", DEFAULT_MAX_BLOCKS),
+        )
+
+    @property
+    def signature(self):
+        return (self.keywords, self.continuation_prefixes, self.continuation_pattern,
+                self.blank_lines_continue, self.ignore_case)
+
+    def is_continuation(self, line):
+        if self._prefixes and line.startswith(self._prefixes):
+            return True
+        if self.blank_lines_continue and not line.strip():
+            return True
+        return bool(self._pattern and self._pattern.match(line))
+
+
+def find_blocks(buf, rules, end=None):
+    """
+    Yields (start, stop) byte ranges of the blocks in buf[:end]. `stop` is the
+    index of the newline ending the block's last line (or `end`).
+    """
+    n = len(buf) if end is None else end
+    positions = keyword_positions(rules.matchers, buf, n)
+    count = len(positions)
+    i = 0
+    while i < count:
+        start = buf.rfind(b"\n", 0, positions[i]) + 1
+        stop = buf.find(b"\n", positions[i], n)
+        if stop < 0:
+            stop = n
+        # Further keywords on the same line belong to this block
+        i = bisect.bisect_left(positions, stop, i)
+
+        if rules.continuation_run is not None:
+            run_end = rules.continuation_run.match(buf, stop, n).end()
+            if i < count and positions[i] < run_end:
+                run_end = buf.rfind(b"\n", stop, positions[i])  # a keyword line starts the next block
+            yield start, run_end
+            continue
+
+        while stop < n:
+            line_start = stop + 1
+            if line_start >= n:
+                break
+            line_end = buf.find(b"\n", line_start, n)
+            if line_end < 0:
+                line_end = n
+            if i < count and positions[i] < line_end:
+                break  # a keyword line starts the next block
+            if not rules.is_continuation(buf[line_start:line_end]):
+                break
+            stop = line_end
+        yield start, stop
+
+
+def decode_block(raw):
+    text = raw.decode("utf-8", errors="ignore")
+    if "\r" in text:
+        text = "\n".join(line.rstrip("\r") for line in text.split("\n"))
+    return text.strip()
+
+
+def strip_timestamps(raw):
+    """
+    Removes "YYYY-MM-DD HH:MM:SS[.fff]" and bare "HH:MM:SS[.fff]" timestamps,
+    so repeats of the same error deduplicate.
+    """
+    match = TIME_TAIL_RE.search(raw)
+    if match is None:
+        return raw
+    parts = []
+    last = 0
+    while match is not None:
+        start = match.start() - 2
+        if start < last or raw[start] not in DIGITS or raw[start + 1] not in DIGITS:
+            # Not preceded by "HH": a timestamp may still start inside this match
+            match = TIME_TAIL_RE.search(raw, match.start() + 1)
+            continue
+        if start - 11 >= last and DATE_PREFIX_RE.fullmatch(raw, start - 11, start):
+            start -= 11
+        parts.append(raw[last:start])
+        last = match.end()
+        match = TIME_TAIL_RE.search(raw, last)
+    if not parts:
+        return raw
+    parts.append(raw[last:])
+    return b"".join(parts)
+
+
+def block_key(raw):
+    if b"\r" in raw:
+        raw = raw.replace(b"\r\n", b"\n")
+    return hashlib.blake2b(strip_timestamps(raw).strip(), digest_size=16).digest()
+
+
+class BlockScanner:
+    """
+    Scans a byte range of a file for blocks. `scan()` yields complete raw blocks;
+    afterwards `resume_offset` is where the next incremental scan must start
+    and `pending` holds blocks that touch the end of the data and may still
+    grow (returned to the caller, but not checkpointed).
+    """
+
+    def __init__(self, rules, chunk_size=CHUNK_SIZE):
+        self.rules = rules
+        self.chunk_size = chunk_size
+        self.resume_offset = 0
+        self.pending = []
+        self.read_seconds = 0.0
+
+    def scan(self, f, start, end):
+        offset = start
+        size = self.chunk_size
+        self.pending = []
+
+        while offset < end:
+            read_start = time.perf_counter()
+            f.seek(offset)
+            buf = f.read(min(size, end - offset))
+            self.read_seconds += time.perf_counter() - read_start
+            if not buf:
+                break
+            at_end = offset + len(buf) >= end
+            cut = buf.rfind(b"\n") + 1  # only complete lines are scanned here
+
+            keep = cut
+            for block_start, block_stop in find_blocks(buf, self.rules, cut):
+                if block_stop >= cut - 1 and cut - block_start <= MAX_BLOCK_BYTES:
+                    keep = block_start  # may continue past this chunk
+                    break
+                yield buf[block_start:block_stop]
+
+            if at_end:
+                tail = buf[keep:]
+                self.pending = [tail[s:e] for s, e in find_blocks(tail, self.rules)]
+                offset += keep
+                break
+            if keep == 0:
+                size *= 2  # a line or block longer than the chunk: read more at once
+                continue
+            # The next chunk starts at the first byte not yet scanned
+            offset += keep
+            size = self.chunk_size
+
+        self.resume_offset = offset
+
+
+def unique_blocks(raw_blocks, seen, known=frozenset()):
+    """
+    Decodes the raw blocks not seen before (ignoring timestamps) and records
+    them in `seen`. Blocks whose key is in `known` are dropped too, but
+    `known` is left untouched.
+    """
+    for raw in raw_blocks:
+        key = block_key(raw)
+        if key not in seen and key not in known:
+            seen.add(key)
+            yield decode_block(raw)
+
+
+def extract_blocks_from_text(log_text, rules=None):
+    """Runs the pipeline over an in-memory log. Returns the latest unique blocks joined."""
+    rules = rules or ExtractionRules()
+    data = log_text.encode("utf-8")
+    latest = deque(maxlen=rules.max_blocks)
+    raw_blocks = (data[s:e] for s, e in find_blocks(data, rules))
+    latest.extend(unique_blocks(raw_blocks, set()))
+    return BLOCK_SEPARATOR.join(latest)
+
+
+def fingerprint(f, offset):
+    f.seek(max(0, offset - FINGERPRINT_BYTES))
+    return hashlib.blake2b(f.read(min(offset, FINGERPRINT_BYTES)), digest_size=16).hexdigest()
+
+
+class LogCheckpoint:
+    def __init__(self, max_blocks):
+        self.offset = 0
+        self.inode = None
+        self.fingerprint = None
+        self.seen = set()
+        self.blocks = deque(maxlen=max_blocks)
+        self.lock = threading.Lock()
+
+
+class LogBlockExtractor:
+    """
+    Extracts the latest unique important blocks of a log file, remembering
+    where it stopped so the next call on the same path only scans new bytes.
+
+    A checkpoint is discarded when the file was replaced, truncated or
+    rewritten before the offset, or when more than `max_scan_bytes` were
+    appended since; the extractor then rescans the last `max_scan_bytes`.
+    """
+
+    def __init__(self, max_scan_bytes=DEFAULT_MAX_SCAN_BYTES, max_checkpoints=MAX_CHECKPOINTS,
+                 chunk_size=CHUNK_SIZE):
+        self.max_scan_bytes = max_scan_bytes
+        self.max_checkpoints = max_checkpoints
+        self.chunk_size = chunk_size
+        self.checkpoints = OrderedDict()
+        self.lock = threading.Lock()
+        self.full_scans = 0
+        self.incremental_scans = 0
+        self.scanned_bytes = 0
+
+    def _checkpoint(self, key, max_blocks):
+        with self.lock:
+            checkpoint = self.checkpoints.get(key)
+            if checkpoint is None or checkpoint.blocks.maxlen != max_blocks:
+                checkpoint = LogCheckpoint(max_blocks)
+                self.checkpoints[key] = checkpoint
+            self.checkpoints.move_to_end(key)
+            while len(self.checkpoints) > self.max_checkpoints:
+                self.checkpoints.popitem(last=False)
+            return checkpoint
+
+    def _is_current(self, checkpoint, f, stat):
+        if checkpoint.fingerprint is None or checkpoint.inode != stat.st_ino:
+            return False
+        if stat.st_size < checkpoint.offset:
+            return False
+        if self.max_scan_bytes is not None and stat.st_size - checkpoint.offset > self.max_scan_bytes:
+            return False
+        return fingerprint(f, checkpoint.offset) == checkpoint.fingerprint
+
+    def _scan_start(self, f, size):
+        if self.max_scan_bytes is None or size <= self.max_scan_bytes:
+            return 0
+        # Start at the first whole line inside the budget
+        f.seek(size - self.max_scan_bytes - 1)
+        f.readline()
+        return f.tell()
+
+    def extract(self, path, rules=None, timings=None):
+        """
+        Args:
+            timings (dict): if given, receives "log_read" (seconds spent reading
+                the file) and "log_extract" (the rest of the scan).
+
+        Returns:
+            str: the latest `rules.max_blocks` unique blocks, oldest first,
+                 joined by "---" separators.
+        """
+        started = time.perf_counter()
+        rules = rules or ExtractionRules()
+        key = (os.path.realpath(path), rules.signature)
+        checkpoint = self._checkpoint(key, rules.max_blocks)
+
+        with checkpoint.lock, open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if self._is_current(checkpoint, f, stat):
+                start = checkpoint.offset
+                self.incremental_scans += 1
+            else:
+                checkpoint.seen = set()
+                checkpoint.blocks.clear()
+                start = self._scan_start(f, stat.st_size)
+                self.full_scans += 1
+
+            scanner = BlockScanner(rules, self.chunk_size)
+            checkpoint.blocks.extend(unique_blocks(scanner.scan(f, start, stat.st_size), checkpoint.seen))
+            self.scanned_bytes += stat.st_size - start
+
+            checkpoint.offset = scanner.resume_offset
+            checkpoint.inode = stat.st_ino
+            checkpoint.fingerprint = fingerprint(f, checkpoint.offset)
+
+            latest = deque(checkpoint.blocks, maxlen=rules.max_blocks)
+            # Blocks still being written are returned but not checkpointed
+            latest.extend(unique_blocks(scanner.pending, set(), known=checkpoint.seen))
+        result = BLOCK_SEPARATOR.join(latest)
+        if timings is not None:
+            timings["log_read"] = scanner.read_seconds
+            timings["log_extract"] = time.perf_counter() - started - scanner.read_seconds
+        return result
+
+    def stats(self):
+        with self.lock:
+            tracked = len(self.checkpoints)
+        return {
+            "tracked_logs": tracked,
+            "full_scans": self.full_scans,
+            "incremental_scans": self.incremental_scans,
+            "scanned_bytes": self.scanned_bytes,
+        }
@@ -0,0 +1,284 @@
+"""
+In-process metrics in the Prometheus text exposition format, for /metrics.
+
+A small stand-in for prometheus_client: counters, gauges and histograms with
+labels, registered in a module-level REGISTRY that any backend module can add
+to. Updates are thread-safe, since most work runs in thread pools.
+
+Also aggregates the per-section timings and subprocess counts that the
+collector stores in each snapshot's `collection_stats`, per host.
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+# Seconds; from fast API calls up to multi-minute remote collections
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """All metrics in the text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+
+class Counter(Metric):
+    """Names end in _total, as they appear in the exposition."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield "", self._labels(key), value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, function=None):
+        """`function`, if given, is called at scrape time for the (unlabelled) value."""
+        super().__init__(name, documentation, labelnames, registry)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield "", [], self.function()
+            except Exception as e:
+                print(f"⚠️ Metric {self.name} failed: {e}")
+            return
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield "", self._labels(key), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self.values.items())
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield "_bucket", labels + [("le", format_value(bound))], cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+# --- Collector statistics ---
+COLLECTOR_RUNS = Counter(
+    "enveye_collector_runs_total", "Snapshots uploaded with collection_stats, per host.", ["hostname"]
+)
+COLLECTOR_SECONDS = Counter(
+    "enveye_collector_seconds_total", "Total collector wall time, per host.", ["hostname"]
+)
+COLLECTOR_SECTION_SECONDS = Counter(
+    "enveye_collector_section_seconds_total", "Collector time per section, per host.", ["hostname", "section"]
+)
+COLLECTOR_SECTION_SUBPROCESSES = Counter(
+    "enveye_collector_section_subprocesses_total", "Processes the collector started per section, per host.",
+    ["hostname", "section"]
+)
+COLLECTOR_LAST_SECTION_SECONDS = Gauge(
+    "enveye_collector_last_section_seconds", "Collector time per section in the latest snapshot of a host.",
+    ["hostname", "section"]
+)
+
+
+class CollectorStatsAggregator:
+    """
+    Per-host aggregate of the collector's own measurements: wall time and
+    subprocess count of every section, from the `collection_stats` of each
+    uploaded snapshot. Kept in memory; exported both as Prometheus metrics
+    and as JSON.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def record(self, hostname, stats, snapshot_id=None):
+        """
+        Args:
+            stats (dict): `collection_stats` of a snapshot, with section_timings_ms
+                and (from newer collectors) subprocess_counts.
+
+        Returns:
+            bool: False if `stats` carries no section timings.
+        """
+        timings = (stats or {}).get("section_timings_ms")
+        if not isinstance(timings, dict):
+            return False
+        subprocesses = stats.get("subprocess_counts") or {}
+        total_ms = stats.get("total_ms")
+
+        COLLECTOR_RUNS.inc(hostname=hostname)
+        if isinstance(total_ms, (int, float)):
+            COLLECTOR_SECONDS.inc(total_ms / 1000, hostname=hostname)
+
+        with self.lock:
+            host = self.hosts.setdefault(hostname, {"runs": 0, "total_ms": self._new_aggregate(), "sections": {}})
+            host["runs"] += 1
+            host["last_snapshot"] = snapshot_id
+            host["last_recorded_at"] = datetime.now().replace(microsecond=0).isoformat()
+            if isinstance(total_ms, (int, float)):
+                self._add(host["total_ms"], total_ms)
+            for section, ms in timings.items():
+                if not isinstance(ms, (int, float)):
+                    continue
+                count = subprocesses.get(section)
+                count = count if isinstance(count, int) else 0
+                aggregate = host["sections"].setdefault(section, dict(self._new_aggregate(), subprocesses=0))
+                self._add(aggregate, ms)
+                aggregate["subprocesses"] += count
+                aggregate["last_subprocesses"] = count
+                COLLECTOR_SECTION_SECONDS.inc(ms / 1000, hostname=hostname, section=section)
+                COLLECTOR_SECTION_SUBPROCESSES.inc(count, hostname=hostname, section=section)
+                COLLECTOR_LAST_SECTION_SECONDS.set(ms / 1000, hostname=hostname, section=section)
+        return True
+
+    @staticmethod
+    def _new_aggregate():
+        return {"count": 0, "sum_ms": 0.0, "max_ms": None, "last_ms": None}
+
+    @staticmethod
+    def _add(aggregate, ms):
+        aggregate["count"] += 1
+        aggregate["sum_ms"] += ms
+        aggregate["max_ms"] = ms if aggregate["max_ms"] is None else max(aggregate["max_ms"], ms)
+        aggregate["last_ms"] = ms
+
+    @staticmethod
+    def _summary(aggregate):
+        summary = {k: v for k, v in aggregate.items() if k != "sum_ms"}
+        summary["avg_ms"] = round(aggregate["sum_ms"] / aggregate["count"], 1) if aggregate["count"] else None
+        return summary
+
+    def summary(self, hostname=None):
+        """{hostname: {"runs", "total_ms": {...}, "sections": {section: {...}}}}, optionally one host."""
+        with self.lock:
+            hosts = {name: host for name, host in self.hosts.items() if hostname in (None, name)}
+            return {
+                name: {
+                    "runs": host["runs"],
+                    "last_snapshot": host.get("last_snapshot"),
+                    "last_recorded_at": host.get("last_recorded_at"),
+                    "total_ms": self._summary(host["total_ms"]),
+                    "sections": {section: self._summary(a) for section, a in sorted(host["sections"].items())},
+                }
+                for name, host in sorted(hosts.items())
+            }
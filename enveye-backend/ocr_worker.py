@@ -0,0 +1,200 @@
+"""
+Screenshot OCR off the event loop.
+
+Images are decoded, preprocessed and run through Tesseract in a process pool,
+so a large screenshot never stalls the API. Before OCR the image is converted
+to grayscale, downscaled to at most MAX_OCR_PIXELS and cropped to the area
+that contains text-like edges; an image without any is not sent to Tesseract
+at all. Results are cached by the SHA-256 of the image bytes, and a second
+request for an image that is still being processed waits for the same job.
+"""
+
+import base64
+import concurrent.futures
+import hashlib
+import io
+import re
+import threading
+import unicodedata
+
+from compare_cache import SizedLRUCache
+
+MAX_OCR_PIXELS = 4_000_000
+EDGE_THRESHOLD = 60
+CROP_PADDING = 12
+DEFAULT_TIMEOUT_S = 30
+DEFAULT_WORKERS = 2
+DEFAULT_CACHE_BYTES = 8 * 1024 * 1024
+
+
+def clean_ocr_text(text):
+    # Normalize Unicode (e.g., accented characters)
+    text = unicodedata.normalize("NFKD", text)
+
+    # Remove non-printable characters (keep ASCII)
+    text = re.sub(r'[^\x20-\x7E]+', '', text)
+
+    # Collapse multiple spaces, remove leading/trailing whitespace
+    text = re.sub(r'\s+', ' ', text).strip()
+
+    return text
+
+
+def decode_image_payload(base64_image):
+    """Accepts a data URL or bare base64 string; returns the image bytes."""
+    return base64.b64decode(base64_image.split(",")[-1])
+
+
+def image_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def preprocess_image(image):
+    """
+    Grayscale, downscale and crop to text. Returns None when the image has
+    no text-like edges.
+    """
+    from PIL import ImageFilter
+
+    gray = image.convert("L")
+    pixels = gray.width * gray.height
+    if pixels > MAX_OCR_PIXELS:
+        scale = (MAX_OCR_PIXELS / pixels) ** 0.5
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))))
+
+    # Text produces dense high-contrast edges; flat backgrounds produce none.
+    # The outermost pixel ring is skipped: the filter leaves artifacts there.
+    edges = gray.filter(ImageFilter.FIND_EDGES).point(lambda p: 255 if p > EDGE_THRESHOLD else 0)
+    bbox = edges.crop((1, 1, max(1, gray.width - 1), max(1, gray.height - 1))).getbbox()
+    if bbox is None:
+        return None
+    left, top, right, bottom = (v + 1 for v in bbox)
+    return gray.crop((
+        max(0, left - CROP_PADDING),
+        max(0, top - CROP_PADDING),
+        min(gray.width, right + CROP_PADDING),
+        min(gray.height, bottom + CROP_PADDING),
+    ))
+
+
+def preload_ocr_modules():
+    """Runs in a worker process: imports PIL and pytesseract ahead of the first job."""
+    import pytesseract
+    from PIL import Image, ImageFilter
+    return True
+
+
+def ocr_image_bytes(image_bytes, timeout):
+    """Runs in a worker process: decode, preprocess and OCR one image."""
+    import pytesseract
+    from PIL import Image
+
+    try:
+        image = preprocess_image(Image.open(io.BytesIO(image_bytes)))
+        if image is None:
+            return ""
+        # Tesseract runs as a subprocess; pytesseract kills it after `timeout`
+        return clean_ocr_text(pytesseract.image_to_string(image, timeout=timeout))
+    except Exception as e:
+        # Some pytesseract errors cannot be unpickled in the parent, which would
+        # mark the whole pool as broken
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+class OcrService:
+    """
+    Process pool for OCR jobs with a per-job timeout and an image-hash cache.
+    The pool is started on first use.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT_S, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache = SizedLRUCache(cache_bytes)
+        self.executor = None
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.timeouts = 0
+        self.failures = 0
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def warm_up(self):
+        """Starts the worker processes and has each one import the OCR modules."""
+        executor = self._executor()
+        futures = [executor.submit(preload_ocr_modules) for _ in range(self.workers)]
+        for future in futures:
+            future.result(timeout=self.timeout)
+
+    def submit(self, image_bytes):
+        """
+        Returns:
+            tuple: (image hash, cached text or None, future or None)
+        """
+        key = image_hash(image_bytes)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return key, cached, None
+
+        executor = self._executor()
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = executor.submit(ocr_image_bytes, image_bytes, self.timeout)
+                self.in_flight[key] = future
+                future.add_done_callback(lambda f, key=key: self._finish(key, f))
+        return key, None, future
+
+    def _finish(self, key, future):
+        with self.lock:
+            self.in_flight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        text = future.result()
+        self.cache.put(key, text, len(text) + 100)
+
+    def extract(self, base64_image):
+        """
+        Blocking OCR of a base64 image (call off the event loop).
+
+        Returns:
+            dict: {"text", "image_hash", "cached"}; "error" is set on timeout
+                  or failure, with empty text.
+        """
+        try:
+            image_bytes = decode_image_payload(base64_image)
+        except ValueError as e:
+            return {"text": "", "image_hash": None, "cached": False, "error": f"Invalid image data: {e}"}
+        key, cached, future = self.submit(image_bytes)
+        if future is None:
+            return {"text": cached, "image_hash": key, "cached": True}
+        try:
+            # A little grace on top of Tesseract's own timeout for decoding and preprocessing
+            text = future.result(timeout=self.timeout + 5)
+            return {"text": text, "image_hash": key, "cached": False}
+        except concurrent.futures.TimeoutError:
+            self.timeouts += 1
+            print(f"⚠️ OCR timed out after {self.timeout}s for image {key[:12]}")
+            return {"text": "", "image_hash": key, "cached": False, "error": "OCR timed out"}
+        except Exception as e:
+            self.failures += 1
+            if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                self.shutdown()  # a worker died; start a fresh pool on the next job
+            print("Error extracting text from screenshot:", e)
+            return {"text": "", "image_hash": key, "cached": False, "error": str(e)}
+
+    def stats(self):
+        with self.lock:
+            in_flight = len(self.in_flight)
+        return dict(self.cache.stats(), in_flight=in_flight, timeouts=self.timeouts,
+                    failures=self.failures, workers=self.workers, timeout_s=self.timeout)
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
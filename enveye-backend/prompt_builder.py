@@ -0,0 +1,327 @@
+"""
+Token-budgeted prompt assembly for /explain.
+
+The prompt has four variable sections: the snapshot diff, the error message,
+the OCR text of the screenshot and the extracted log blocks. Each gets a share
+of a total token budget; a section that needs less than its share passes the
+rest on to the others. Within its budget:
+
+- the diff is rendered compactly, grouped by top-level section with the
+  repeated "root['section']" prefix dropped, and long lists summarized with
+  fewer items shown until it fits;
+- log blocks are dropped lowest-priority first (least severe, then oldest)
+  instead of cutting the text at a character offset;
+- error and OCR text are cut at a token boundary.
+"""
+
+import json
+import re
+from functools import lru_cache
+
+from log_extractor import BLOCK_SEPARATOR as LOG_BLOCK_SEPARATOR
+
+ENCODING_NAME = "cl100k_base"
+DEFAULT_TOKEN_BUDGET = 12000
+
+# Share of the budget left after the instructions, per section
+SECTION_SHARES = {"diff": 0.45, "log": 0.35, "error": 0.1, "screenshot": 0.1}
+
+MAX_VALUE_CHARS = 120
+
+CHANGE_LABELS = {
+    "values_changed": ("~", "changed"),
+    "type_changes": ("~", "type changed"),
+    "dictionary_item_added": ("+", "added"),
+    "iterable_item_added": ("+", "added"),
+    "dictionary_item_removed": ("-", "removed"),
+    "iterable_item_removed": ("-", "removed"),
+}
+
+PATH_PART_RE = re.compile(r"""\['((?:[^']|'(?!\]))*)'\]|\["((?:[^"]|"(?!\]))*)"\]|\[(\d+)\]""")
+
+# Log block priority by the most severe marker in its first line
+SEVERITY_MARKERS = (
+    (3, ("CRITICAL", "FATAL", "Traceback")),
+    (2, ("Exception", "Caused by")),
+    (1, ("ERROR", "Failed")),
+)
+OMITTED_NOTE_TOKENS = 20
+
+
+@lru_cache(maxsize=1)
+def get_encoder():
+    """The tokenizer, loaded once on first use. None if it cannot be loaded (e.g. offline)."""
+    try:
+        from tiktoken import get_encoding
+        return get_encoding(ENCODING_NAME)
+    except Exception as e:
+        print(f"⚠️ Could not load tokenizer {ENCODING_NAME}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoder = get_encoder()
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts `text` to at most `max_tokens` tokens, noting how much was left out."""
+    if max_tokens <= 0:
+        return ""
+    encoder = get_encoder()
+    if encoder is None:
+        if len(text) // 4 + 1 <= max_tokens:
+            return text
+        return text[:max(0, max_tokens - 4) * 4] + "\n[truncated]"
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    kept = max(0, max_tokens - 12)
+    return encoder.decode(tokens[:kept]) + f"\n[truncated: {kept} of {len(tokens)} tokens shown]"
+
+
+# --- Diff rendering ---
+def split_path(path):
+    """"root['dlls']['a.dll'][0]" -> ["dlls", "a.dll", 0]; None if not a DeepDiff path."""
+    if not isinstance(path, str) or not path.startswith("root"):
+        return None
+    parts = []
+    position = 4
+    for match in PATH_PART_RE.finditer(path, 4):
+        if match.start() != position:
+            return None
+        single, double, index = match.groups()
+        parts.append(int(index) if index is not None else (single if single is not None else double))
+        position = match.end()
+    return parts if position == len(path) else None
+
+
+def compact_value(value):
+    text = value if isinstance(value, str) else json.dumps(value, separators=(",", ":"), default=str)
+    if len(text) > MAX_VALUE_CHARS:
+        text = text[:MAX_VALUE_CHARS - 3] + "..."
+    return text
+
+
+def describe_change(category, subpath, change):
+    if category in ("values_changed", "type_changes") and isinstance(change, dict):
+        return f"{subpath}: {compact_value(change.get('old_value'))} -> {compact_value(change.get('new_value'))}"
+    if change is None:
+        return subpath
+    return f"{subpath}: {compact_value(change)}"
+
+
+def group_diff(diff):
+    """
+    Regroups a DeepDiff-style {category: {path: change}} by top-level section.
+
+    Returns:
+        dict: {section: {label: ["~ path: old -> new", ...]}} in first-seen order.
+    """
+    groups = {}
+    for category, entries in (diff or {}).items():
+        symbol, label = CHANGE_LABELS.get(category, ("*", category))
+        if isinstance(entries, dict):
+            items = entries.items()
+        elif isinstance(entries, list):
+            items = ((path, None) for path in entries)
+        else:
+            continue
+        for path, change in items:
+            parts = split_path(path)
+            if parts:
+                section, rest = str(parts[0]), parts[1:]
+            else:
+                section, rest = "other", [path]
+            subpath = "/".join(f"[{p}]" if isinstance(p, int) else str(p) for p in rest) or "(whole section)"
+            groups.setdefault(section, {}).setdefault(label, []).append(f"{symbol} {describe_change(category, subpath, change)}")
+    return groups
+
+
+def render_grouped_diff(groups, item_limit=None):
+    """Renders grouped changes, showing at most `item_limit` lines per section and change type."""
+    if not groups:
+        return ""
+    lines = []
+    for section, by_label in groups.items():
+        counts = ", ".join(f"{len(items)} {label}" for label, items in by_label.items())
+        lines.append(f"[{section}] {counts}")
+        for label, items in by_label.items():
+            shown = items if item_limit is None else items[:item_limit]
+            lines.extend(f"  {item}" for item in shown)
+            if len(shown) < len(items) and shown:
+                lines.append(f"  ... and {len(items) - len(shown)} more {label}")
+    return "\n".join(lines)
+
+
+def render_diff(groups, max_tokens):
+    """
+    Compact diff text within `max_tokens`: the largest number of items per
+    section and change type that fits is found by binary search; the rest of
+    each list is summarized as a count.
+
+    Returns:
+        tuple: (text, tokens, item_limit used, None when nothing was cut)
+    """
+    text = render_grouped_diff(groups)
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens, None
+
+    longest = max(len(items) for by_label in groups.values() for items in by_label.values())
+    best = None
+    low, high = 0, longest - 1
+    while low <= high:
+        limit = (low + high) // 2
+        candidate = render_grouped_diff(groups, limit)
+        candidate_tokens = count_tokens(candidate)
+        if candidate_tokens <= max_tokens:
+            best = (candidate, candidate_tokens, limit)
+            low = limit + 1
+        else:
+            high = limit - 1
+    if best:
+        return best
+
+    # Even the per-section counts do not fit
+    text = truncate_to_tokens(render_grouped_diff(groups, 0), max_tokens)
+    return text, count_tokens(text), 0
+
+
+# --- Log blocks ---
+def block_severity(block):
+    first_line = block.split("\n", 1)[0]
+    for severity, markers in SEVERITY_MARKERS:
+        if any(m in first_line for m in markers):
+            return severity
+    return 0
+
+
+def split_log_blocks(log_content):
+    return [b for b in (log_content or "").split(LOG_BLOCK_SEPARATOR) if b.strip()]
+
+
+def select_log_blocks(blocks, sizes, max_tokens):
+    """
+    Keeps the highest-priority log blocks that fit in `max_tokens`, in their
+    original order. Priority is severity, then recency.
+
+    Args:
+        blocks (list): extracted log blocks, oldest first.
+        sizes (list): token count of each block.
+
+    Returns:
+        tuple: (text, tokens, kept, dropped)
+    """
+    if not blocks:
+        return "", 0, 0, 0
+    separator_tokens = count_tokens(LOG_BLOCK_SEPARATOR)
+    if sum(sizes) + separator_tokens * (len(blocks) - 1) > max_tokens:
+        max_tokens -= OMITTED_NOTE_TOKENS  # room for the "omitted" note
+    by_priority = sorted(range(len(blocks)), key=lambda i: (block_severity(blocks[i]), i), reverse=True)
+
+    chosen = set()
+    used = 0
+    for i in by_priority:
+        cost = sizes[i] + (separator_tokens if chosen else 0)
+        if used + cost <= max_tokens:
+            chosen.add(i)
+            used += cost
+
+    kept = [blocks[i] for i in sorted(chosen)]
+    if not kept:
+        # Not even the top block fits whole: keep the start of it
+        top = by_priority[0]
+        kept = [truncate_to_tokens(blocks[top], max_tokens)]
+        chosen = {top}
+    dropped = len(blocks) - len(chosen)
+    text = LOG_BLOCK_SEPARATOR.join(kept)
+    if dropped:
+        text += f"\n\n[{dropped} lower-priority log block(s) omitted to fit the token budget]"
+    return text, count_tokens(text), len(chosen), dropped
+
+
+# --- Budget ---
+def allocate_budget(available, needs, shares=SECTION_SHARES):
+    """
+    Splits `available` tokens by `shares`. Sections needing less than their
+    share get what they need; the surplus is split among the others by share.
+    """
+    allocation = {}
+    remaining = {name: needs.get(name, 0) for name in shares}
+    budget = max(0, available)
+    while remaining:
+        total_share = sum(shares[name] for name in remaining)
+        satisfied = {name: need for name, need in remaining.items()
+                     if need <= budget * shares[name] / total_share}
+        if not satisfied:
+            for name in remaining:
+                allocation[name] = int(budget * shares[name] / total_share)
+            break
+        for name, need in satisfied.items():
+            allocation[name] = need
+            budget -= need
+            del remaining[name]
+    return allocation
+
+
+def build_prompt_sections(inputs, template_tokens, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Renders the variable parts of the /explain prompt within the budget.
+
+    Args:
+        inputs (dict): {"diff", "error_message", "screenshot_text", "log_content"}
+        template_tokens (int): tokens used by the fixed instructions.
+
+    Returns:
+        tuple: ({"diff", "error_message", "screenshot_text", "log_content"} texts, stats dict)
+    """
+    groups = group_diff(inputs.get("diff"))
+    error_text = inputs.get("error_message") or ""
+    screenshot_text = inputs.get("screenshot_text") or ""
+    log_blocks = split_log_blocks(inputs.get("log_content"))
+    log_sizes = [count_tokens(b) for b in log_blocks]
+    full_diff_text = render_grouped_diff(groups)
+
+    needs = {
+        "diff": count_tokens(full_diff_text),
+        "error": count_tokens(error_text),
+        "screenshot": count_tokens(screenshot_text),
+        "log": sum(log_sizes) + count_tokens(LOG_BLOCK_SEPARATOR) * max(0, len(log_blocks) - 1),
+    }
+    allocation = allocate_budget(token_budget - template_tokens, needs)
+
+    if needs["diff"] <= allocation["diff"]:
+        diff_text, diff_tokens, item_limit = full_diff_text, needs["diff"], None
+    else:
+        diff_text, diff_tokens, item_limit = render_diff(groups, allocation["diff"])
+    log_text, log_tokens, kept, dropped = select_log_blocks(log_blocks, log_sizes, allocation["log"])
+    error_text = truncate_to_tokens(error_text, allocation["error"])
+    screenshot_text = truncate_to_tokens(screenshot_text, allocation["screenshot"])
+
+    sections = {
+        "diff": diff_text,
+        "error_message": error_text,
+        "screenshot_text": screenshot_text,
+        "log_content": log_text,
+    }
+    stats = {
+        "token_budget": token_budget,
+        "needed": needs,
+        "allocated": allocation,
+        "used": {
+            "template": template_tokens,
+            "diff": diff_tokens,
+            "error": count_tokens(error_text),
+            "screenshot": count_tokens(screenshot_text),
+            "log": log_tokens,
+        },
+        "diff_item_limit": item_limit,
+        "log_blocks_kept": kept,
+        "log_blocks_dropped": dropped,
+    }
+    return sections, stats
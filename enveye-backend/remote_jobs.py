@@ -0,0 +1,472 @@
+"""
+Bulk remote collection over WinRM.
+
+A job is a list of targets (VMs). Each host is collected in a shared thread
+pool, off the event loop, under a global concurrency limit and a per-host
+limit (so two jobs never hit the same VM at once). A host that fails is
+retried with exponential backoff; whatever still fails can be retried later
+as a whole with `retry_failed`. Status and progress are kept per host and
+can be polled while the job runs.
+
+The WinRM session is created by a pluggable factory, `factory(target)`, so the
+scheduler can run against a fake session on Linux, e.g.
+
+    ENVEYE_WINRM_SESSION_FACTORY=my_fakes:FakeSession
+"""
+
+import asyncio
+import concurrent.futures
+import importlib
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from agent_deploy import DEFAULT_CHUNK_BYTES, AgentCache, AgentDeployError, deploy_agent
+from metrics import Counter, Histogram
+
+REMOTE_AGENT_PATH = "C:\\Tools\\Collector\\collector_agent.exe"
+DEFAULT_TIMEOUT_S = 900
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_PER_HOST_CONCURRENCY = 1
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF_S = 5.0
+MAX_OUTPUT_CHARS = 4000
+MAX_JOBS = 200
+
+TARGET_FIELDS = ("vm_ip", "username", "password", "app_folder", "app_type")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+
+# Progress stages of collect_from_host and their metric names
+STAGE_METRIC_NAMES = {
+    "connecting": "connect",
+    "checking_agent": "agent_check",
+    "deploying_agent": "agent_deploy",
+    "collecting": "run",
+}
+
+REMOTE_STAGE_SECONDS = Histogram(
+    "enveye_remote_collect_stage_seconds", "Time per stage of one remote collection attempt.", ["stage"]
+)
+REMOTE_ATTEMPTS = Counter(
+    "enveye_remote_collect_attempts_total", "Remote collection attempts by outcome.", ["result"]
+)
+AGENT_DEPLOY_BYTES = Counter(
+    "enveye_agent_deploy_bytes_total", "Collector agent bytes sent to VMs."
+)
+
+
+class RemoteCollectError(Exception):
+    """A remote collection step failed."""
+
+
+class StageTimer:
+    """
+    A progress callback that also times each stage until the next one starts
+    (or `stop()`), then passes the stage on to `progress`.
+    """
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.seconds = {}
+        self.stage = None
+        self.started = None
+
+    def __call__(self, stage):
+        self.stop()
+        self.stage, self.started = stage, time.perf_counter()
+        if self.progress:
+            self.progress(stage)
+
+    def stop(self):
+        if self.stage is not None:
+            elapsed = time.perf_counter() - self.started
+            self.seconds[self.stage] = self.seconds.get(self.stage, 0.0) + elapsed
+            self.stage = None
+
+    def timings_ms(self):
+        return {STAGE_METRIC_NAMES.get(stage, stage): round(seconds * 1000, 1)
+                for stage, seconds in self.seconds.items()}
+
+
+def winrm_session_factory(target):
+    import winrm
+
+    return winrm.Session(
+        f"http://{target['vm_ip']}:5985/wsman",
+        auth=(target.get("username"), target.get("password")),
+        transport="ntlm"
+    )
+
+
+def load_session_factory(spec):
+    """"package.module:callable" -> the callable; None/"" -> the real WinRM factory."""
+    if not spec:
+        return winrm_session_factory
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr or "session_factory")
+
+
+# The local agent is hashed and encoded once, not on every collection
+agent_cache = AgentCache()
+
+
+def ensure_agent(session, agent_path, chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None):
+    """
+    Deploys the local agent build unless the VM already has the same one.
+
+    Returns:
+        dict: see `agent_deploy.deploy_agent`; action is "unverified" when
+              there is no local build to compare with.
+    """
+    try:
+        build = agent_cache.get(agent_path)
+    except FileNotFoundError:
+        # No local build: use whatever agent the VM has
+        if progress:
+            progress("checking_agent")
+        check_command = f"if (!(Test-Path '{REMOTE_AGENT_PATH}')) {{ exit 1 }}"
+        if session.run_ps(check_command).status_code != 0:
+            raise RemoteCollectError(f"Agent missing on the VM and no local build at {agent_path}")
+        print(f"\u26A1 No local agent build at {agent_path}, using the one on the VM")
+        return {"action": "unverified", "sha256": None, "bytes_sent": 0, "chunks_sent": 0}
+    try:
+        return deploy_agent(session, build, REMOTE_AGENT_PATH, chunk_bytes, progress)
+    except AgentDeployError as e:
+        raise RemoteCollectError(str(e)) from None
+
+
+def collector_command(target, upload_url):
+    return (
+        f'cmd /c "{REMOTE_AGENT_PATH} '
+        f'--app-folder \"{target.get("app_folder")}\" '
+        f'--app-type {target.get("app_type")} '
+        f'--upload-url {upload_url}"'
+    )
+
+
+def collect_from_host(target, session_factory, agent_path, upload_url, progress=None,
+                      chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Blocking: deploys the agent if needed and runs it on one VM.
+
+    Args:
+        progress (callable): called with the name of each stage as it starts.
+
+    Returns:
+        dict: {"exit_code", "agent_deployed", "agent_deploy", "timings_ms", "stdout", "stderr"}
+
+    Raises:
+        RemoteCollectError: when the agent cannot be deployed or exits with a
+            non-zero code.
+    """
+    report = StageTimer(progress)
+    succeeded = False
+    try:
+        report("connecting")
+        session = session_factory(target)
+
+        deploy = ensure_agent(session, agent_path, chunk_bytes, report)
+        AGENT_DEPLOY_BYTES.inc(deploy["bytes_sent"])
+
+        command = collector_command(target, upload_url)
+        print(f"\u2705 Prepared Command: {command}")
+        report("collecting")
+        result = session.run_cmd(command)
+
+        stdout = result.std_out.decode(errors="ignore")
+        stderr = result.std_err.decode(errors="ignore")
+        print(f"\u2705 Remote Collector on {target['vm_ip']} exited with code {result.status_code}")
+        if result.status_code != 0:
+            raise RemoteCollectError(f"Remote agent failed. Code {result.status_code}: {stderr[-500:].strip()}")
+        succeeded = True
+    finally:
+        # Stages of failed attempts are recorded too, up to where they stopped
+        report.stop()
+        for stage, seconds in report.seconds.items():
+            REMOTE_STAGE_SECONDS.observe(seconds, stage=STAGE_METRIC_NAMES.get(stage, stage))
+        REMOTE_ATTEMPTS.inc(result="succeeded" if succeeded else "failed")
+    return {
+        "exit_code": result.status_code,
+        "agent_deployed": deploy["action"] in ("deployed", "resumed"),
+        "agent_deploy": deploy,
+        "timings_ms": report.timings_ms(),
+        "stdout": stdout[-MAX_OUTPUT_CHARS:],
+        "stderr": stderr[-MAX_OUTPUT_CHARS:],
+    }
+
+
+def normalize_targets(targets, defaults=None):
+    """
+    Fills per-target fields from `defaults` and drops duplicate hosts.
+
+    Raises:
+        ValueError: on an empty list, or a target without vm_ip, app_folder or app_type.
+    """
+    if not isinstance(targets, list) or not targets:
+        raise ValueError("targets must be a non-empty list")
+    defaults = defaults or {}
+    normalized = OrderedDict()
+    for item in targets:
+        target = {"vm_ip": item} if isinstance(item, str) else dict(item or {})
+        for field in TARGET_FIELDS:
+            if not target.get(field) and defaults.get(field):
+                target[field] = defaults[field]
+        if not target.get("vm_ip"):
+            raise ValueError("every target needs a vm_ip")
+        if not target.get("app_folder") or not target.get("app_type"):
+            raise ValueError(f"app_folder and app_type are required for {target['vm_ip']}")
+        normalized.setdefault(target["vm_ip"], target)
+    return list(normalized.values())
+
+
+class CollectionJobQueue:
+    """
+    Runs bulk collection jobs on the event loop; the WinRM calls themselves
+    run in a thread pool of `max_concurrency` threads.
+    """
+
+    def __init__(self, session_factory, agent_path, upload_url,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 per_host_concurrency=DEFAULT_PER_HOST_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 retry_backoff_s=DEFAULT_RETRY_BACKOFF_S,
+                 timeout_s=DEFAULT_TIMEOUT_S,
+                 max_jobs=MAX_JOBS,
+                 agent_chunk_bytes=DEFAULT_CHUNK_BYTES):
+        self.session_factory = session_factory
+        self.agent_path = agent_path
+        self.upload_url = upload_url
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+        self.timeout_s = timeout_s
+        self.max_jobs = max_jobs
+        self.agent_chunk_bytes = agent_chunk_bytes
+        self.jobs = OrderedDict()
+        self.tasks = {}
+        self.executor = None
+        self.global_slots = None
+        self.host_slots = {}
+
+    def _ensure_started(self):
+        # Created on first use so that the semaphores bind to the running loop
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix="remote-collect"
+            )
+            self.global_slots = asyncio.Semaphore(self.max_concurrency)
+
+    def _host_slot(self, vm_ip):
+        slot = self.host_slots.get(vm_ip)
+        if slot is None:
+            slot = self.host_slots[vm_ip] = asyncio.Semaphore(self.per_host_concurrency)
+        return slot
+
+    # --- Running one host ---
+    async def _run_host(self, target, progress):
+        """One attempt on one host within the concurrency limits. Raises on failure or timeout."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+
+        def report(stage):
+            loop.call_soon_threadsafe(progress, stage)
+
+        host_slot = self._host_slot(target["vm_ip"])
+        await host_slot.acquire()
+        try:
+            await self.global_slots.acquire()
+        except BaseException:
+            host_slot.release()
+            raise
+
+        def release_slots():
+            self.global_slots.release()
+            host_slot.release()
+
+        def on_done(_):
+            # A timed-out call keeps running in its thread; its slots stay taken until it returns
+            try:
+                loop.call_soon_threadsafe(release_slots)
+            except RuntimeError:
+                pass  # event loop already closed
+
+        try:
+            future = self.executor.submit(
+                collect_from_host,
+                target, self.session_factory, self.agent_path, self.upload_url, report,
+                self.agent_chunk_bytes
+            )
+        except BaseException:
+            release_slots()
+            raise
+        future.add_done_callback(on_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout_s)
+        except asyncio.TimeoutError:
+            raise RemoteCollectError(f"Timeout after {self.timeout_s:g} seconds.") from None
+
+    async def collect_one(self, target):
+        """A single collection without retries, e.g. for /remote_collect."""
+        return await self._run_host(target, lambda stage: None)
+
+    async def _collect_with_retries(self, job, host):
+        target = job["targets"][host["vm_ip"]]
+
+        def progress(stage):
+            # The first stage report means a concurrency slot was granted
+            if host["status"] in ("queued", "retrying"):
+                host["status"] = "running"
+                host["started_at"] = host["started_at"] or datetime.now().isoformat()
+            host["stage"] = stage
+
+        try:
+            while True:
+                host["attempts"] += 1
+                host["stage"] = "waiting"
+                start = time.perf_counter()
+                try:
+                    result = await self._run_host(target, progress)
+                    host.update(status="succeeded", stage="done", error=None,
+                                duration_s=round(time.perf_counter() - start, 2), **result)
+                    break
+                except RemoteCollectError as e:
+                    error = str(e)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                host["error"] = error
+                host["duration_s"] = round(time.perf_counter() - start, 2)
+                print(f"\u274C Remote collection on {host['vm_ip']} failed (attempt {host['attempts']}): {error}")
+                if host["attempts"] > host["max_retries"]:
+                    host.update(status="failed", stage=None)
+                    break
+                host.update(status="retrying", stage="backoff")
+                await asyncio.sleep(self.retry_backoff_s * 2 ** (host["attempts"] - 1))
+        except asyncio.CancelledError:
+            host.update(status="cancelled", stage=None)
+            raise
+        finally:
+            host["finished_at"] = datetime.now().isoformat()
+
+    async def _run_job(self, job, hosts):
+        try:
+            await asyncio.gather(*(self._collect_with_retries(job, host) for host in hosts))
+        finally:
+            job["finished_at"] = datetime.now().isoformat()
+            self.tasks.pop(job["job_id"], None)
+            succeeded = sum(1 for h in job["hosts"].values() if h["status"] == "succeeded")
+            print(f"\u2705 Remote job {job['job_id']}: {succeeded}/{len(job['hosts'])} hosts collected")
+
+    # --- Job API ---
+    def submit(self, targets, max_retries=None):
+        """
+        Starts a job for already-normalized targets (see `normalize_targets`).
+        Must be called from the event loop.
+
+        Returns:
+            str: the job id.
+        """
+        self._ensure_started()
+        job_id = uuid.uuid4().hex[:12]
+        retries = self.max_retries if max_retries is None else max(0, int(max_retries))
+        job = {
+            "job_id": job_id,
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "targets": {t["vm_ip"]: t for t in targets},
+            "hosts": OrderedDict((t["vm_ip"], self._new_host(t["vm_ip"], retries)) for t in targets),
+        }
+        self.jobs[job_id] = job
+        self._prune()
+        self._start(job, list(job["hosts"].values()))
+        return job_id
+
+    @staticmethod
+    def _new_host(vm_ip, max_retries):
+        return {
+            "vm_ip": vm_ip, "status": "queued", "stage": "waiting", "attempts": 0,
+            "max_retries": max_retries, "error": None, "started_at": None,
+            "finished_at": None, "duration_s": None,
+        }
+
+    def _start(self, job, hosts):
+        job["finished_at"] = None
+        self.tasks[job["job_id"]] = asyncio.get_running_loop().create_task(self._run_job(job, hosts))
+
+    def retry_failed(self, job_id):
+        """
+        Re-runs the failed and cancelled hosts of a finished job.
+
+        Returns:
+            list: the hosts queued again; None if the job does not exist.
+
+        Raises:
+            RuntimeError: if the job is still running.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job_id in self.tasks:
+            raise RuntimeError("Job is still running")
+        hosts = [h for h in job["hosts"].values() if h["status"] in ("failed", "cancelled")]
+        for host in hosts:
+            host.update(self._new_host(host["vm_ip"], host["max_retries"]))
+        if hosts:
+            self._start(job, hosts)
+        return [h["vm_ip"] for h in hosts]
+
+    def cancel(self, job_id):
+        task = self.tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def _prune(self):
+        # Oldest finished jobs go first; running jobs are never dropped
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if job_id not in self.tasks:
+                del self.jobs[job_id]
+
+    def status(self, job_id, include_output=False):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        hosts = []
+        for host in job["hosts"].values():
+            entry = dict(host)
+            if not include_output:
+                entry.pop("stdout", None)
+                entry.pop("stderr", None)
+            hosts.append(entry)
+        return dict(self.summary(job), hosts=hosts)
+
+    def summary(self, job):
+        counts = {}
+        for host in job["hosts"].values():
+            counts[host["status"]] = counts.get(host["status"], 0) + 1
+        total = len(job["hosts"])
+        done = sum(counts.get(state, 0) for state in FINISHED_STATES)
+        return {
+            "job_id": job["job_id"],
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+            "running": job["job_id"] in self.tasks,
+            "total": total,
+            "completed": done,
+            "progress": round(done / total, 3) if total else 1.0,
+            "counts": counts,
+        }
+
+    def list_jobs(self):
+        return [self.summary(job) for job in reversed(self.jobs.values())]
+
+    def shutdown(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,94 @@
+"""
+Section-selective compares.
+
+A selection is a list of environment_context section names or key-path
+globs in the change timeline's format, e.g. `required_services_status` or
+`app_config_settings/*Connection*`. Matching is case-insensitive, and a
+pattern without wildcards also matches everything below that key.
+
+Only the sections a selection can match are loaded from the store. Manifests
+read just those section objects. Full snapshot files are scanned without
+parsing the rest. The diff is then narrowed to the matching keys.
+"""
+
+from fnmatch import fnmatchcase
+
+from change_timeline import key_path
+
+# Same wildcards as the timeline's key filter; "[" stays literal, list indexes look like [0]
+WILDCARDS = ("*", "?")
+
+
+def has_wildcard(text):
+    return any(w in text for w in WILDCARDS)
+
+
+def glob(pattern):
+    return pattern.replace("[", "[[]")
+
+
+class SectionSelector:
+    def __init__(self, patterns):
+        self.patterns = tuple(p.strip().strip("/") for p in patterns if p and p.strip().strip("/"))
+        if not self.patterns:
+            raise ValueError("No sections selected")
+        self.lowered = [p.lower() for p in self.patterns]
+
+    @classmethod
+    def parse(cls, value):
+        """A selector from a list or a comma-separated string; None when nothing is selected."""
+        if not value:
+            return None
+        if isinstance(value, str):
+            value = value.split(",")
+        if not isinstance(value, (list, tuple)) or not all(isinstance(p, str) for p in value):
+            raise ValueError("sections must be a list of section names or key globs")
+        if not any(p.strip().strip("/") for p in value):
+            return None
+        return cls(value)
+
+    def wants_section(self, name):
+        """True if any pattern can match a key inside section `name`."""
+        name = name.lower()
+        for pattern in self.lowered:
+            head = pattern.split("/", 1)[0]
+            if "*" in head:
+                # `*` also matches "/", so everything the part before it allows may match
+                head = head[:head.index("*") + 1]
+            if fnmatchcase(name, glob(head)):
+                return True
+        return False
+
+    def matches_key(self, key):
+        """
+        True if a change at `key` (e.g. app_config_settings/DbConn) is selected:
+        it matches a pattern, lies below a plain key, or is an ancestor of the
+        keys a pattern selects (a whole section added or removed).
+        """
+        key = key.lower()
+        for pattern in self.lowered:
+            if fnmatchcase(key, glob(pattern)):
+                return True
+            if not has_wildcard(pattern) and key.startswith(pattern + "/"):
+                return True
+            literal = pattern
+            for w in WILDCARDS:
+                if w in literal:
+                    literal = literal[:literal.index(w)]
+            if literal.startswith(key + "/"):
+                return True
+        return False
+
+    def filter_differences(self, differences):
+        """A {category: {path: change}} diff narrowed to the selected keys."""
+        filtered = {}
+        for category, entries in (differences or {}).items():
+            if isinstance(entries, dict):
+                kept = {path: change for path, change in entries.items() if self.matches_key(key_path(path))}
+            elif isinstance(entries, list):
+                kept = [path for path in entries if self.matches_key(key_path(path))]
+            else:
+                continue
+            if kept:
+                filtered[category] = kept
+        return filtered
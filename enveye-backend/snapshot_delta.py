@@ -0,0 +1,202 @@
+"""
+Delta uploads: a snapshot sent as a JSON Patch (RFC 6902) against a base
+snapshot the server already has.
+
+The collector keeps the last snapshot it uploaded together with the content
+hash the server returned for it (see `snapshot_store.snapshot_content_hash`).
+On the next run it sends only the operations that turn that snapshot into the
+new one, plus the base hash and the hash of the result. The server rebuilds
+the full snapshot and checks the hash; if it does not know the base, the
+collector falls back to a full upload.
+
+Only "add", "remove" and "replace" are produced by the collector and
+accepted here. Patches are applied copy-on-write: only the containers on the
+changed paths are copied, so a cached base snapshot is never modified and a
+50k-DLL inventory is not deep-copied for a handful of changes.
+"""
+
+import json
+
+from snapshot_store import SnapshotHashMismatch, SnapshotValidationError, section_hash, snapshot_content_hash
+
+ENVIRONMENT_CONTEXT = "environment_context"
+SUPPORTED_OPS = ("add", "remove", "replace")
+
+
+class DeltaBaseUnknown(LookupError):
+    """The base snapshot of a delta upload is not stored (or was never indexed)."""
+
+
+class InvalidPatch(SnapshotValidationError):
+    """A delta upload is not a patch this server can apply."""
+
+
+def parse_pointer(pointer):
+    """"/a/b~1c" -> ["a", "b/c"]; "" -> [] (the whole document)."""
+    if pointer == "":
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise InvalidPatch(f"Invalid JSON pointer: {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def list_index(container, token, op):
+    if op == "add" and token == "-":
+        return len(container)
+    if not token.isdigit():
+        raise InvalidPatch(f"Invalid list index: {token!r}")
+    index = int(token)
+    limit = len(container) if op == "add" else len(container) - 1
+    if index > limit:
+        raise InvalidPatch(f"List index out of range: {index}")
+    return index
+
+
+def apply_patch(document, operations):
+    """
+    Returns `document` with `operations` applied, leaving `document` untouched.
+
+    Raises:
+        InvalidPatch: on an unsupported operation or a path that does not resolve.
+    """
+    if not isinstance(operations, list):
+        raise InvalidPatch("A patch must be a JSON array of operations")
+
+    # Ids of the copies made in this call; the copies stay referenced by the
+    # result, so their ids are not reused while the patch is applied
+    copied = set()
+
+    def own(container):
+        if id(container) in copied:
+            return container
+        container = container.copy()
+        copied.add(id(container))
+        return container
+
+    root = own(document) if isinstance(document, (dict, list)) else document
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in SUPPORTED_OPS:
+            raise InvalidPatch(f"Unsupported patch operation: {operation!r}")
+        op = operation["op"]
+        if op != "remove" and "value" not in operation:
+            raise InvalidPatch(f"Missing value in {op} operation at {operation.get('path')!r}")
+        tokens = parse_pointer(operation.get("path"))
+        if not tokens:
+            if op == "remove":
+                raise InvalidPatch("Cannot remove the whole document")
+            root = operation["value"]
+            continue
+
+        parent = root
+        try:
+            for token in tokens[:-1]:
+                key = list_index(parent, token, "get") if isinstance(parent, list) else token
+                child = parent[key]
+                if not isinstance(child, (dict, list)):
+                    raise InvalidPatch(f"Path does not resolve: {operation['path']}")
+                parent[key] = child = own(child)
+                parent = child
+
+            last = tokens[-1]
+            if isinstance(parent, list):
+                index = list_index(parent, last, op)
+                if op == "add":
+                    parent.insert(index, operation["value"])
+                elif op == "remove":
+                    del parent[index]
+                else:
+                    parent[index] = operation["value"]
+            elif isinstance(parent, dict):
+                if op != "add" and last not in parent:
+                    raise InvalidPatch(f"Path does not exist: {operation['path']}")
+                if op == "remove":
+                    del parent[last]
+                else:
+                    parent[last] = operation["value"]
+            else:
+                raise InvalidPatch(f"Path does not resolve: {operation['path']}")
+        except (KeyError, IndexError, TypeError):
+            raise InvalidPatch(f"Path does not resolve: {operation['path']}") from None
+    return root
+
+
+def touched_sections(operations):
+    """
+    Names of the environment_context sections a patch changes, or None when
+    it replaces environment_context (or the whole document) as a whole.
+    """
+    sections = set()
+    for operation in operations:
+        tokens = parse_pointer(operation.get("path"))
+        if not tokens or (tokens[0] == ENVIRONMENT_CONTEXT and len(tokens) == 1):
+            return None
+        if tokens[0] == ENVIRONMENT_CONTEXT:
+            sections.add(tokens[1])
+    return sections
+
+
+def json_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def rebuilt_size(base_size, base, snapshot, touched):
+    """
+    Uncompressed size of a snapshot rebuilt from a delta: the base's size
+    adjusted by the top-level fields and the sections the patch touched, so
+    unchanged sections are not serialized just to measure them. None when
+    the base's size is not known or the patch replaced environment_context.
+    """
+    base_env, env = base[ENVIRONMENT_CONTEXT], snapshot[ENVIRONMENT_CONTEXT]
+    if base_size is None or touched is None or not isinstance(base_env, dict):
+        return None
+    size = base_size
+    size += json_size({k: v for k, v in snapshot.items() if k != ENVIRONMENT_CONTEXT})
+    size -= json_size({k: v for k, v in base.items() if k != ENVIRONMENT_CONTEXT})
+    size += json_size({name: env[name] for name in touched if name in env})
+    size -= json_size({name: base_env[name] for name in touched if name in base_env})
+    return max(size, 0)
+
+
+def store_delta_snapshot(store, index, comparer, snapshot_id, operations, base_hash, target_hash):
+    """
+    Rebuilds a snapshot from a delta upload and stores it under `snapshot_id`.
+    Only the sections the patch touches are hashed and written; the others
+    keep the base snapshot's section hashes.
+
+    Returns:
+        dict: what `store.save_document` returns, plus "base_id".
+
+    Raises:
+        DeltaBaseUnknown: if no stored snapshot has the content hash `base_hash`.
+        InvalidPatch: if the patch does not apply to the base snapshot.
+        SnapshotHashMismatch: if the result does not hash to `target_hash`.
+    """
+    base = index.find_by_hash(base_hash)
+    if base is None or not store.exists(base["id"]):
+        raise DeltaBaseUnknown(base_hash)
+    base_id = base["id"]
+
+    document = dict(store.top_level(base_id))
+    document[ENVIRONMENT_CONTEXT] = comparer.load_environment(base_id)
+    snapshot = apply_patch(document, operations)
+
+    env = snapshot.get(ENVIRONMENT_CONTEXT) if isinstance(snapshot, dict) else None
+    if not isinstance(env, dict):
+        raise InvalidPatch("Patched snapshot has no environment_context object")
+
+    base_hashes = comparer.section_hashes(base_id)
+    touched = touched_sections(operations)
+    hashes = {}
+    for name, value in env.items():
+        if touched is not None and name not in touched and name in base_hashes:
+            hashes[name] = base_hashes[name]
+        else:
+            hashes[name] = section_hash(value)
+
+    if snapshot_content_hash(snapshot, hashes) != target_hash:
+        raise SnapshotHashMismatch("Snapshot rebuilt from the delta does not match its expected hash")
+
+    saved = store.save_document(snapshot_id, snapshot, section_hashes=hashes,
+                                raw_bytes=rebuilt_size(base["size_bytes"], document, snapshot, touched))
+    saved["base_id"] = base_id
+    return saved
@@ -0,0 +1,141 @@
+"""
+Schema-aware differ for EnvEye snapshots.
+
+Produces the same change categories and path format as
+`json.loads(DeepDiff(a, b, view='tree').to_json())` for the parts of the
+snapshot format we know (`values_changed`, `type_changes`,
+`dictionary_item_added`, `dictionary_item_removed`, `iterable_item_added`,
+`iterable_item_removed`), but with plain keyed set operations:
+
+- identical sections are skipped up front (by content hash when given,
+  otherwise by `==`, which runs in C);
+- path-keyed maps such as `app_folder_dlls` are diffed with set operations
+  on their keys, so finding added/removed/changed DLLs is linear;
+- lists that are really sets (installed .NET versions) are compared as
+  such, so a new version in the middle does not report every later index
+  as changed.
+
+Unlike DeepDiff it always descends into changed dicts instead of reporting
+a mostly-different dict as one `values_changed` entry.
+"""
+
+# environment_context sections whose list values carry no meaningful order
+UNORDERED_LIST_SECTIONS = {"dotnet_frameworks_installed"}
+
+CATEGORIES = [
+    "type_changes",
+    "dictionary_item_added",
+    "dictionary_item_removed",
+    "values_changed",
+    "iterable_item_added",
+    "iterable_item_removed",
+]
+
+
+def path_key(key):
+    # Same quoting as DeepDiff's path strings (no backslash escaping)
+    if not isinstance(key, str):
+        return f"[{key}]"
+    if "'" in key and '"' in key:
+        return f"[{key!r}]"
+    if "'" in key:
+        return f'["{key}"]'
+    return f"['{key}']"
+
+
+class SnapshotDiffer:
+    def __init__(self):
+        self.result = {}
+
+    def emit(self, category, path, value):
+        self.result.setdefault(category, {})[path] = value
+
+    def diff_value(self, a, b, path, unordered=False):
+        if a == b and type(a) is type(b):
+            return
+        if type(a) is not type(b):
+            self.emit("type_changes", path, {
+                "old_type": type(a).__name__,
+                "new_type": type(b).__name__,
+                "old_value": a,
+                "new_value": b,
+            })
+        elif isinstance(a, dict):
+            self.diff_dict(a, b, path)
+        elif isinstance(a, list):
+            if unordered:
+                self.diff_unordered_list(a, b, path)
+            else:
+                self.diff_list(a, b, path)
+        else:
+            self.emit("values_changed", path, {"new_value": b, "old_value": a})
+
+    def diff_dict(self, a, b, path):
+        # Iterate in document order so the output is stable between runs
+        for key, vb in b.items():
+            if key not in a:
+                self.emit("dictionary_item_added", path + path_key(key), vb)
+        for key, va in a.items():
+            if key not in b:
+                self.emit("dictionary_item_removed", path + path_key(key), va)
+                continue
+            vb = b[key]
+            if va != vb or type(va) is not type(vb):
+                self.diff_value(va, vb, path + path_key(key))
+
+    def diff_list(self, a, b, path):
+        common = min(len(a), len(b))
+        for i in range(common):
+            self.diff_value(a[i], b[i], path + path_key(i))
+        for i in range(common, len(b)):
+            self.emit("iterable_item_added", path + path_key(i), b[i])
+        for i in range(common, len(a)):
+            self.emit("iterable_item_removed", path + path_key(i), a[i])
+
+    def diff_unordered_list(self, a, b, path):
+        try:
+            set_a, set_b = set(a), set(b)
+        except TypeError:
+            return self.diff_list(a, b, path)
+        for i, item in enumerate(b):
+            if item not in set_a:
+                self.emit("iterable_item_added", path + path_key(i), item)
+        for i, item in enumerate(a):
+            if item not in set_b:
+                self.emit("iterable_item_removed", path + path_key(i), item)
+
+
+def diff_environment_contexts_fast(env_a, env_b, hashes_a=None, hashes_b=None):
+    """
+    Diffs two environment_context dicts.
+
+    Args:
+        env_a, env_b (dict): environment_context of the old and new snapshot.
+        hashes_a, hashes_b (dict): optional {section: content hash}; sections
+            with equal hashes are skipped without being looked at.
+
+    Returns:
+        dict: DeepDiff-style {category: {path: change}}, empty categories omitted.
+    """
+    if not isinstance(env_a, dict) or not isinstance(env_b, dict):
+        differ = SnapshotDiffer()
+        differ.diff_value(env_a, env_b, "root")
+        return differ.result
+
+    hashes_a = hashes_a or {}
+    hashes_b = hashes_b or {}
+    differ = SnapshotDiffer()
+
+    for name, value in env_b.items():
+        if name not in env_a:
+            differ.emit("dictionary_item_added", "root" + path_key(name), value)
+    for name, value in env_a.items():
+        if name not in env_b:
+            differ.emit("dictionary_item_removed", "root" + path_key(name), value)
+        elif name in hashes_a and hashes_a.get(name) == hashes_b.get(name):
+            continue
+        else:
+            differ.diff_value(value, env_b[name], "root" + path_key(name),
+                              unordered=name in UNORDERED_LIST_SECTIONS)
+
+    return {category: differ.result[category] for category in CATEGORIES if category in differ.result}
@@ -0,0 +1,320 @@
+"""
+SQLite catalog of stored snapshots.
+
+Filled on upload and rebuildable from the snapshot directory, so that
+/list_snapshots can filter, sort and paginate without globbing the disk.
+"""
+
+import base64
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+SORT_COLUMNS = {"timestamp", "hostname", "app_name", "size_bytes"}
+# Sort key per column; unknown sizes (older rows) sort as -1 so keyset cursors can pass them
+SORT_EXPRESSIONS = {"size_bytes": "COALESCE(size_bytes, -1)"}
+MAX_PAGE_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    size_bytes INTEGER,
+    stored_bytes INTEGER,
+    section_hashes TEXT,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_host_app_ts ON snapshots (hostname, app_name, timestamp);
+CREATE INDEX IF NOT EXISTS idx_snapshots_ts ON snapshots (timestamp);
+"""
+
+# Catalogs created before delta uploads lack the content_hash column
+MIGRATIONS = {
+    "content_hash": "ALTER TABLE snapshots ADD COLUMN content_hash TEXT",
+}
+POST_MIGRATION = "CREATE INDEX IF NOT EXISTS idx_snapshots_content_hash ON snapshots (content_hash)"
+
+COLUMNS = ("id", "hostname", "app_name", "timestamp", "size_bytes", "stored_bytes", "section_hashes", "content_hash")
+INSERT_SQL = f"INSERT OR REPLACE INTO snapshots ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+# The backend's fallback hostname for uploads without one
+DEFAULT_HOSTNAME = "unknown_host"
+
+
+def parse_snapshot_id(snapshot_id):
+    """
+    Splits `{hostname}_{app_name}_{YYYYmmddHHMMSS}.json` into its parts.
+    The timestamp is split off from the right. Windows hostnames cannot
+    contain underscores (except the backend's own `unknown_host`), app
+    folder names can, so the rest is split at the first underscore. The
+    catalog keeps the hostname and app recorded at upload; this is only
+    the fallback for files it has no row for.
+
+    Returns:
+        tuple: (hostname, app_name, ISO timestamp) or None if the id does not match.
+    """
+    stem = snapshot_id[:-len(".json")] if snapshot_id.endswith(".json") else snapshot_id
+    if "_" not in stem:
+        return None
+    rest, stamp = stem.rsplit("_", 1)
+    try:
+        timestamp = datetime.strptime(stamp, "%Y%m%d%H%M%S").isoformat()
+    except ValueError:
+        return None
+    if rest.startswith(DEFAULT_HOSTNAME + "_"):
+        hostname, app_name = DEFAULT_HOSTNAME, rest[len(DEFAULT_HOSTNAME) + 1:]
+    elif "_" in rest:
+        hostname, app_name = rest.split("_", 1)
+    else:
+        return None
+    if not hostname or not app_name:
+        return None
+    return hostname, app_name, timestamp
+
+
+def normalize_timestamp(value):
+    """Accepts ISO 8601 or the compact YYYYmmddHHMMSS form used in snapshot ids."""
+    if value is None or value == "":
+        return None
+    if value.isdigit() and len(value) == 14:
+        return datetime.strptime(value, "%Y%m%d%H%M%S").isoformat()
+    return datetime.fromisoformat(value).replace(tzinfo=None).isoformat()
+
+
+def encode_cursor(sort_value, snapshot_id):
+    raw = json.dumps([sort_value, snapshot_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, snapshot_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return sort_value, snapshot_id
+
+
+class SnapshotIndex:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.write_lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(snapshots)")}
+            for column, sql in MIGRATIONS.items():
+                if column not in existing:
+                    conn.execute(sql)
+            conn.execute(POST_MIGRATION)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _row_to_dict(row):
+        item = dict(row)
+        item["section_hashes"] = json.loads(item["section_hashes"]) if item["section_hashes"] else None
+        return item
+
+    # --- Writing ---
+    def add(self, snapshot_id, hostname=None, app_name=None, timestamp=None,
+            size_bytes=None, stored_bytes=None, section_hashes=None, content_hash=None):
+        parsed = parse_snapshot_id(snapshot_id) or (None, None, None)
+        row = (
+            snapshot_id,
+            hostname or parsed[0] or "unknown_host",
+            app_name or parsed[1] or "unknown_app",
+            timestamp or parsed[2] or datetime.now().replace(microsecond=0).isoformat(),
+            size_bytes,
+            stored_bytes,
+            json.dumps(section_hashes) if section_hashes is not None else None,
+            content_hash,
+        )
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            conn.execute(INSERT_SQL, row)
+
+    def remove(self, snapshot_id):
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+
+    def count(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+    def rebuild(self, store):
+        """
+        Re-creates the catalog from what is actually stored on disk. Rows of
+        snapshots that are still stored keep what was recorded at upload
+        (hostname, app, uncompressed size, hashes); full files not in the
+        catalog are scanned for theirs.
+        """
+        with closing(self._connect()) as conn:
+            known = {row["id"]: dict(row) for row in conn.execute("SELECT * FROM snapshots")}
+
+        rows = []
+        for snapshot_id in store.list_ids():
+            path, encoding = store.path_for(snapshot_id)
+            if path is None:
+                continue
+            row = known.get(snapshot_id)
+            if row is not None:
+                row["stored_bytes"] = path.stat().st_size
+                rows.append(tuple(row[column] for column in COLUMNS))
+                continue
+            parsed = parse_snapshot_id(snapshot_id)
+            if parsed is None:
+                continue
+            if encoding == "manifest":
+                # Manifests carry their section and content hashes, but not the full size
+                size, hashes, content_hash = None, store.section_hashes(snapshot_id), store.content_hash(snapshot_id)
+            else:
+                # Full files are scanned once, one section in memory at a time
+                try:
+                    scanned = store.scan(snapshot_id)
+                except Exception as e:
+                    print(f"\u26A0\uFE0F Could not read {snapshot_id} while rebuilding the catalog: {e}")
+                    scanned = {"raw_bytes": None, "section_hashes": None, "content_hash": None}
+                size, hashes, content_hash = scanned["raw_bytes"], scanned["section_hashes"], scanned["content_hash"]
+            rows.append((
+                snapshot_id, parsed[0], parsed[1], parsed[2], size, path.stat().st_size,
+                json.dumps(hashes) if hashes is not None else None, content_hash,
+            ))
+
+        with self.write_lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM snapshots")
+            conn.executemany(INSERT_SQL, rows)
+        return len(rows)
+
+    # --- Queries ---
+    def get(self, snapshot_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def find_by_hash(self, content_hash):
+        """The newest snapshot with this content hash (see snapshot_store.snapshot_content_hash), or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT * FROM snapshots WHERE content_hash = ? ORDER BY timestamp DESC, id DESC LIMIT 1",
+                (content_hash,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def query(self, hostname=None, app_name=None, since=None, until=None,
+              sort="timestamp", order="desc", limit=100, cursor=None):
+        """
+        Filtered, keyset-paginated listing. `limit=None` returns every match.
+
+        Returns:
+            dict: {"items": [...], "next_cursor": str or None}
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by '{sort}'")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        if limit is not None:
+            limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        sort_key = SORT_EXPRESSIONS.get(sort, sort)
+
+        where, params = [], []
+        if hostname:
+            where.append("hostname = ?")
+            params.append(hostname)
+        if app_name:
+            where.append("app_name = ?")
+            params.append(app_name)
+        if since:
+            where.append("timestamp >= ?")
+            params.append(normalize_timestamp(since))
+        if until:
+            where.append("timestamp <= ?")
+            params.append(normalize_timestamp(until))
+        if cursor:
+            sort_value, last_id = decode_cursor(cursor)
+            op = "<" if order == "desc" else ">"
+            where.append(f"({sort_key}, id) {op} (?, ?)")
+            params.extend([sort_value, last_id])
+
+        sql = "SELECT * FROM snapshots"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort_key} {order.upper()}, id {order.upper()}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        items = [self._row_to_dict(r) for r in rows[:limit]]
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            last = items[-1]
+            sort_value = -1 if sort == "size_bytes" and last[sort] is None else last[sort]
+            next_cursor = encode_cursor(sort_value, last["id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def previous(self, snapshot_id):
+        """The snapshot of the same hostname and app taken just before `snapshot_id`, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                """
+                SELECT p.* FROM snapshots s
+                JOIN snapshots p ON p.hostname = s.hostname AND p.app_name = s.app_name
+                    AND (p.timestamp, p.id) < (s.timestamp, s.id)
+                WHERE s.id = ?
+                ORDER BY p.timestamp DESC, p.id DESC LIMIT 1
+                """,
+                (snapshot_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def next(self, snapshot_id):
+        """The snapshot of the same hostname and app taken just after `snapshot_id`, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                """
+                SELECT n.* FROM snapshots s
+                JOIN snapshots n ON n.hostname = s.hostname AND n.app_name = s.app_name
+                    AND (n.timestamp, n.id) > (s.timestamp, s.id)
+                WHERE s.id = ?
+                ORDER BY n.timestamp, n.id LIMIT 1
+                """,
+                (snapshot_id,)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def latest(self, hostname=None, app_name=None):
+        """Newest snapshot per (hostname, app_name), optionally filtered."""
+        where, params = [], []
+        if hostname:
+            where.append("hostname = ?")
+            params.append(hostname)
+        if app_name:
+            where.append("app_name = ?")
+            params.append(app_name)
+        filter_sql = (" WHERE " + " AND ".join(where)) if where else ""
+
+        sql = f"""
+            SELECT s.* FROM snapshots s
+            JOIN (
+                SELECT hostname, app_name, MAX(timestamp) AS ts FROM snapshots{filter_sql}
+                GROUP BY hostname, app_name
+            ) latest ON s.hostname = latest.hostname AND s.app_name = latest.app_name AND s.timestamp = latest.ts
+            ORDER BY s.hostname, s.app_name
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        # Two uploads in the same second share a timestamp; keep one per host/app
+        latest = {}
+        for row in rows:
+            latest.setdefault((row["hostname"], row["app_name"]), self._row_to_dict(row))
+        return list(latest.values())
@@ -0,0 +1,810 @@
+"""
+Compressed on-disk snapshot storage for the EnvEye backend.
+
+Uploads are streamed to disk in chunks and stored gzip-compressed (or as the
+zstd stream the collector sent). Validation is schema-light and incremental:
+the body is checked to be a JSON object carrying an `environment_context`
+without ever being parsed and re-serialized as a whole.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import zlib
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Stored suffix appended to the snapshot id ("host_app_ts.json") per encoding
+STORED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "identity": ""}
+
+REQUIRED_MARKER = b'"environment_context"'
+
+
+class SnapshotValidationError(ValueError):
+    """Raised when an uploaded body does not look like an EnvEye snapshot."""
+
+
+class SnapshotHashMismatch(SnapshotValidationError):
+    """Raised when a snapshot rebuilt from a delta upload does not hash to what the collector expects."""
+
+
+def detect_encoding(head):
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "identity"
+
+
+class SnapshotShapeValidator:
+    """
+    Incremental sanity check over decompressed snapshot bytes: the document
+    must be a JSON object and mention `environment_context`. Memory use is
+    constant no matter how large the snapshot is.
+    """
+
+    def __init__(self):
+        self.first_byte = None
+        self.last_byte = None
+        self.found_marker = False
+        self.tail = b""
+        self.size = 0
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.first_byte is None:
+            stripped = chunk.lstrip()
+            if stripped.startswith(b"\xef\xbb\xbf"):
+                stripped = stripped[3:].lstrip()
+            if stripped:
+                self.first_byte = stripped[:1]
+        stripped = chunk.rstrip()
+        if stripped:
+            self.last_byte = stripped[-1:]
+        if not self.found_marker:
+            window = self.tail + chunk
+            self.found_marker = REQUIRED_MARKER in window
+            self.tail = window[-len(REQUIRED_MARKER):]
+
+    def finish(self):
+        if self.first_byte != b"{" or self.last_byte != b"}":
+            raise SnapshotValidationError("Snapshot is not a JSON object")
+        if not self.found_marker:
+            raise SnapshotValidationError("Snapshot has no environment_context")
+        return self.size
+
+
+def unique_temp_path(path):
+    """A new, empty temp file next to `path`; concurrent writers of the same path never share one."""
+    fd, name = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".part")
+    os.close(fd)
+    return Path(name)
+
+
+def _decompressor(encoding):
+    if encoding == "gzip":
+        return zlib.decompressobj(wbits=31).decompress
+    if encoding == "zstd":
+        if zstandard is None:
+            raise SnapshotValidationError("zstd uploads need the 'zstandard' package on the backend")
+        return zstandard.ZstdDecompressor().decompressobj().decompress
+    return lambda chunk: chunk
+
+
+def decode_snapshot_bytes(content):
+    """Returns the parsed JSON of a plain, gzip or zstd encoded snapshot body."""
+    encoding = detect_encoding(content[:4])
+    if encoding == "gzip":
+        content = gzip.decompress(content)
+    elif encoding == "zstd":
+        content = _decompressor("zstd")(content)
+    return json.loads(content)
+
+
+JSON_STRING_PATTERN = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+JSON_STRING = re.compile(JSON_STRING_PATTERN)
+# Everything up to the next nested bracket or unfinished string: scalars, punctuation,
+# complete strings and flat objects/arrays (such as one DLL entry), in one regex call.
+# Written as "plain (special plain)*" so every input splits one way only and a failed
+# flat bracket backtracks in linear time, without possessive quantifiers (Python 3.11+).
+JSON_PLAIN = rb'[^"{}\[\]]*'
+JSON_FLAT_BRACKETS = rb'[{\[]' + JSON_PLAIN + rb'(?:' + JSON_STRING_PATTERN + JSON_PLAIN + rb')*[}\]]'
+JSON_FLAT_RUN = re.compile(
+    JSON_PLAIN + rb'(?:(?:' + JSON_STRING_PATTERN + rb'|' + JSON_FLAT_BRACKETS + rb')' + JSON_PLAIN + rb')*'
+)
+JSON_SCALAR_END = re.compile(rb'[\s,}\]]')
+JSON_WHITESPACE = re.compile(rb'\s*')
+
+
+class SectionScanner:
+    """
+    Reads selected environment_context sections out of a snapshot stream
+    without parsing the rest. Skipped sections are only scanned for brackets
+    and strings and dropped chunk by chunk, so memory use follows the size of
+    the wanted sections, not of the DLL inventory.
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = b""
+        # Scan position; bytes before it (or before `mark`) are dropped on the next read
+        self.pos = 0
+        # Start of a value being captured; kept in the buffer until it is complete
+        self.mark = None
+        self.started = False
+
+    def more(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            raise SnapshotValidationError("Snapshot ends in the middle of a JSON value")
+        if not self.started:
+            self.started = True
+            while len(chunk) < 3 and chunk == b"\xef\xbb\xbf"[:len(chunk)]:
+                extra = self.stream.read(self.chunk_size)
+                if not extra:
+                    break
+                chunk += extra
+            if chunk.startswith(b"\xef\xbb\xbf"):
+                chunk = chunk[3:]
+        drop = self.pos if self.mark is None else self.mark
+        self.buf = self.buf[drop:] + chunk
+        self.pos -= drop
+        if self.mark is not None:
+            self.mark -= drop
+
+    def peek(self):
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self.more()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise SnapshotValidationError(f"Expected {char.decode()} in snapshot")
+        self.pos += 1
+
+    def skip_value(self):
+        """Moves past the next JSON value."""
+        first = self.peek()
+        if first == b'"':
+            match = JSON_STRING.match(self.buf, self.pos)
+            while match is None:
+                self.more()
+                match = JSON_STRING.match(self.buf, self.pos)
+            self.pos = match.end()
+            return
+        if first not in (b"{", b"["):
+            match = JSON_SCALAR_END.search(self.buf, self.pos)
+            while match is None:
+                self.more()
+                match = JSON_SCALAR_END.search(self.buf, self.pos)
+            self.pos = match.start()
+            return
+
+        # Step inside first: a flat run must not swallow this container and its siblings
+        depth = 1
+        self.pos += 1
+        while True:
+            self.pos = JSON_FLAT_RUN.match(self.buf, self.pos).end()
+            char = self.buf[self.pos:self.pos + 1]
+            if char in (b"", b'"'):
+                # End of the buffer, or a string cut off by it: read on
+                self.more()
+            elif char in (b"{", b"["):
+                depth += 1
+                self.pos += 1
+            else:
+                depth -= 1
+                self.pos += 1
+                if depth == 0:
+                    return
+
+    def read_value(self):
+        self.peek()
+        self.mark = self.pos
+        try:
+            self.skip_value()
+            return json.loads(self.buf[self.mark:self.pos])
+        finally:
+            self.mark = None
+
+    def members(self):
+        """Yields the keys of the object at the current position, leaving each value to the caller."""
+        self.expect(b"{")
+        if self.peek() == b"}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(b":")
+            yield key
+            if self.peek() == b",":
+                self.pos += 1
+                continue
+            self.expect(b"}")
+            return
+
+    def expect_end(self):
+        """Reads the rest of the stream; raises unless only whitespace follows the document."""
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                raise SnapshotValidationError("Unexpected data after the snapshot")
+            self.buf, self.pos = self.stream.read(self.chunk_size), 0
+            if not self.buf:
+                return
+
+    def read_sections(self, wanted, transform=None):
+        """
+        Args:
+            wanted (callable): section name -> bool.
+            transform (callable): optional, applied to each wanted section as
+                soon as it is parsed, e.g. `section_hash` to keep only hashes.
+
+        Returns:
+            tuple: (top-level fields other than environment_context,
+                {section: value} of the wanted sections)
+        """
+        top_level, sections = {}, {}
+        for key in self.members():
+            if key == "environment_context" and self.peek() == b"{":
+                for name in self.members():
+                    if wanted(name):
+                        value = self.read_value()
+                        sections[name] = transform(value) if transform else value
+                    else:
+                        self.skip_value()
+            else:
+                top_level[key] = self.read_value()
+        return top_level, sections
+
+
+def partial_snapshot(top_level, sections):
+    snapshot = {k: v for k, v in top_level.items() if k != "environment_context"}
+    snapshot["environment_context"] = sections
+    return snapshot
+
+
+def read_partial_snapshot(src, wanted):
+    """`SnapshotStore.load_partial` for an uploaded (plain, gzip or zstd) snapshot file."""
+    head = src.read(4)
+    src.seek(0)
+    encoding = detect_encoding(head)
+    if encoding == "gzip":
+        src = gzip.GzipFile(fileobj=src, mode="rb")
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise SnapshotValidationError("zstd uploads need the 'zstandard' package on the backend")
+        src = zstandard.ZstdDecompressor().stream_reader(src)
+    return partial_snapshot(*SectionScanner(src).read_sections(wanted))
+
+
+class UploadWriter:
+    """
+    File-like view of an upload for a SectionScanner: every read stores the
+    next received chunk (compressing plain bodies), feeds the shape
+    validator and returns the chunk decompressed. The upload is thus parsed
+    while it is written, in one pass.
+    """
+
+    def __init__(self, src, head, out, decompress, compressor, validator):
+        self.src = src
+        self.pending = head
+        self.out = out
+        self.decompress = decompress
+        self.compressor = compressor
+        self.validator = validator
+        self.stored_bytes = 0
+
+    def write(self, data):
+        self.out.write(data)
+        self.stored_bytes += len(data)
+
+    def read(self, size=-1):
+        while True:
+            chunk, self.pending = self.pending or self.src.read(CHUNK_SIZE), b""
+            if not chunk:
+                return b""
+            self.write(self.compressor.compress(chunk) if self.compressor else chunk)
+            data = self.decompress(chunk)
+            self.validator.feed(data)
+            if data:
+                return data
+
+    def finish(self):
+        """Stores the rest of the upload, unread by the scanner."""
+        while self.read():
+            pass
+        if self.compressor:
+            self.write(self.compressor.flush())
+
+
+class CountingReader:
+    """Passes reads through to `stream`, counting the bytes read."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        return data
+
+
+def scan_section_hashes(stream):
+    """
+    Section hashes and content hash of a snapshot stream, parsing one
+    section at a time.
+
+    Returns:
+        tuple: ({section: hash}, or None when environment_context is not an
+            object; content hash, see `snapshot_content_hash`)
+    """
+    scanner = SectionScanner(stream)
+    top_level, hashes = scanner.read_sections(lambda name: True, section_hash)
+    scanner.expect_end()
+    if "environment_context" in top_level:
+        return None, snapshot_content_hash(top_level, {})
+    return hashes, snapshot_content_hash(top_level, hashes)
+
+
+class SnapshotStore:
+    """
+    Snapshots are addressed by id (`{hostname}_{app_name}_{timestamp}.json`)
+    and stored as `<id>.gz` / `<id>.zst`. Plain `<id>` files written by older
+    backends are still readable.
+    """
+
+    stored_suffixes = STORED_SUFFIXES
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True)
+
+    # --- Writing ---
+    def save_stream(self, snapshot_id, src, hash_sections=True):
+        """
+        Streams an uploaded snapshot from the binary file object `src` to disk.
+        With `hash_sections` the sections and the whole snapshot are hashed on
+        the way, one section at a time, so the catalog can skip identical
+        sections and key its caches without parsing the stored file again.
+
+        Returns:
+            dict: {"id", "path", "encoding", "stored_bytes", "raw_bytes",
+                "section_hashes", "content_hash"}
+
+        Raises:
+            SnapshotValidationError: if the body is not a snapshot.
+        """
+        head = src.read(4)
+        encoding = detect_encoding(head)
+        if encoding == "zstd" and zstandard is None:
+            raise SnapshotValidationError("zstd uploads need the 'zstandard' package on the backend")
+        stored_encoding = "gzip" if encoding == "identity" else encoding
+
+        validator = SnapshotShapeValidator()
+        decompress = _decompressor(encoding)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if encoding == "identity" else None
+
+        final_path = self.root / (snapshot_id + STORED_SUFFIXES[stored_encoding])
+        tmp_path = unique_temp_path(final_path)
+        scanned = {"section_hashes": None, "content_hash": None}
+        try:
+            with open(tmp_path, "wb") as out:
+                writer = UploadWriter(src, head, out, decompress, compressor, validator)
+                scan_error = None
+                if hash_sections:
+                    try:
+                        scanned = self.scan_upload(writer)
+                    except ValueError as e:
+                        scan_error = e
+                writer.finish()
+            raw_bytes = validator.finish()
+            if scan_error is not None:
+                raise SnapshotValidationError(f"Snapshot is not valid JSON: {scan_error}")
+            os.replace(tmp_path, final_path)
+        except zlib.error as e:
+            raise SnapshotValidationError(f"Corrupt compressed snapshot: {e}")
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise SnapshotValidationError(f"Corrupt compressed snapshot: {e}")
+            raise
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        return {
+            "id": snapshot_id,
+            "path": final_path,
+            "encoding": stored_encoding,
+            "stored_bytes": writer.stored_bytes,
+            "raw_bytes": raw_bytes,
+            **scanned,
+        }
+
+    def scan_upload(self, stream):
+        """Called by `save_stream` with the upload as it is written; returns fields to add to its result."""
+        hashes, content_hash = scan_section_hashes(stream)
+        return {"section_hashes": hashes, "content_hash": content_hash}
+
+    # --- Reading ---
+    def path_for(self, snapshot_id):
+        """Returns (path, encoding) of a stored snapshot, or (None, None)."""
+        if "/" in snapshot_id or "\\" in snapshot_id or snapshot_id.startswith(".."):
+            return None, None
+        for encoding, suffix in self.stored_suffixes.items():
+            path = self.root / (snapshot_id + suffix)
+            if path.is_file():
+                return path, encoding
+        return None, None
+
+    def exists(self, snapshot_id):
+        return self.path_for(snapshot_id)[0] is not None
+
+    def open(self, snapshot_id):
+        """Opens a stored snapshot as a decompressed binary stream."""
+        path, encoding = self.path_for(snapshot_id)
+        if path is None:
+            raise FileNotFoundError(snapshot_id)
+        return self.open_path(path, encoding)
+
+    @staticmethod
+    def open_path(path, encoding):
+        if encoding == "gzip":
+            return gzip.open(path, "rb")
+        if encoding == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Reading zstd snapshots needs the 'zstandard' package")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+        return open(path, "rb")
+
+    def iter_bytes(self, snapshot_id, chunk_size=64 * 1024):
+        with self.open(snapshot_id) as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def load(self, snapshot_id):
+        with self.open(snapshot_id) as f:
+            return json.load(f)
+
+    def list_ids(self):
+        ids = []
+        for path in self.root.iterdir():
+            name = path.name
+            for suffix in self.stored_suffixes.values():
+                if suffix and name.endswith(".json" + suffix):
+                    name = name[:-len(suffix)]
+                    break
+            if name.endswith(".json") and path.is_file():
+                ids.append(name)
+        return ids
+
+    def scan(self, snapshot_id):
+        """
+        Uncompressed size, section hashes and content hash of a stored
+        snapshot, read in one pass with one section in memory at a time.
+
+        Returns:
+            dict: {"raw_bytes", "section_hashes", "content_hash"}
+        """
+        with self.open(snapshot_id) as f:
+            reader = CountingReader(f)
+            hashes, content_hash = scan_section_hashes(reader)
+            while reader.read(CHUNK_SIZE):
+                pass
+        return {"raw_bytes": reader.size, "section_hashes": hashes, "content_hash": content_hash}
+
+    def section_hashes(self, snapshot_id):
+        """Returns {section: content hash} of a stored snapshot's environment_context."""
+        return self.scan(snapshot_id)["section_hashes"] or {}
+
+    def top_level(self, snapshot_id):
+        """The snapshot's fields other than environment_context, e.g. timestamp and collection_stats."""
+        snapshot = self.load(snapshot_id)
+        return {k: v for k, v in snapshot.items() if k != "environment_context"}
+
+    def load_partial(self, snapshot_id, wanted):
+        """
+        The snapshot with only the environment_context sections for which
+        `wanted(name)` is true; the other sections are never parsed.
+        """
+        with self.open(snapshot_id) as f:
+            return partial_snapshot(*SectionScanner(f).read_sections(wanted))
+
+    def content_hash(self, snapshot_id):
+        """Hash of the stored snapshot's content; see `snapshot_content_hash`."""
+        return self.scan(snapshot_id)["content_hash"]
+
+    def save_document(self, snapshot_id, snapshot, section_hashes=None, raw_bytes=None):
+        """
+        Stores an already parsed snapshot, e.g. one rebuilt from a delta upload.
+        Known `section_hashes` are recorded instead of hashing the sections again.
+        `raw_bytes` is only used by the dedup store.
+
+        Returns:
+            dict: like `save_stream`, with raw_bytes of the re-serialized document.
+        """
+        body = io.BytesIO(json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+        saved = self.save_stream(snapshot_id, body, hash_sections=section_hashes is None)
+        if section_hashes is not None:
+            saved["section_hashes"] = section_hashes
+            saved["content_hash"] = snapshot_content_hash(snapshot, section_hashes)
+        return saved
+
+
+# --- Content-addressed section store ---
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest"
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def section_hash(value):
+    """Content hash of one environment_context section, independent of key order."""
+    return hashlib.sha256(canonical_json(value)).hexdigest()
+
+
+def snapshot_content_hash(top_level, section_hashes):
+    """
+    Hash of a whole snapshot: its top-level fields plus the hash of every
+    environment_context section. The collector computes the same value
+    (collector/delta_upload.py) to name the base of a delta upload and to
+    check the snapshot the server rebuilds from it.
+    """
+    top_level = {k: v for k, v in top_level.items() if k != "environment_context"}
+    return hashlib.sha256(canonical_json({"top_level": top_level, "sections": section_hashes})).hexdigest()
+
+
+class DedupSnapshotStore(SnapshotStore):
+    """
+    Splits each snapshot into its environment_context sections and stores
+    every section once under `objects/<hash[:2]>/<hash>.json.gz`. A snapshot
+    itself is only a small manifest (`<id>.manifest`) listing its top-level
+    fields and section hashes, so identical DLL inventories, .NET lists or
+    OS info across hosts take disk space once.
+
+    Sections are stored in canonical (sorted-key) form, so a rebuilt
+    snapshot is semantically identical to the upload but keys inside a
+    section may come back in a different order.
+    """
+
+    stored_suffixes = dict({"manifest": MANIFEST_SUFFIX}, **STORED_SUFFIXES)
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(exist_ok=True)
+
+    def object_path(self, digest):
+        return self.objects / digest[:2] / f"{digest}.json.gz"
+
+    def write_section(self, value):
+        """Stores one section if it is not stored yet. Returns (hash, newly_written)."""
+        data = canonical_json(value)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if path.exists():
+            return digest, False
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = unique_temp_path(path)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(gzip.compress(data, compresslevel=6))
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another upload stored the same section first (on Windows the replace can fail while it is read)
+            if tmp_path.exists():
+                tmp_path.unlink()
+            if path.exists():
+                return digest, False
+            raise
+        return digest, True
+
+    def read_section_bytes(self, digest):
+        with gzip.open(self.object_path(digest), "rb") as f:
+            return f.read()
+
+    def read_section(self, digest):
+        return json.loads(self.read_section_bytes(digest))
+
+    def read_manifest(self, snapshot_id):
+        with open(self.root / (snapshot_id + MANIFEST_SUFFIX), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_manifest(self, snapshot_id, snapshot, section_hashes):
+        manifest_path = self.root / (snapshot_id + MANIFEST_SUFFIX)
+        manifest = {
+            "manifest_version": MANIFEST_VERSION,
+            "top_level": {k: (None if k == "environment_context" else v) for k, v in snapshot.items()},
+            "sections": section_hashes,
+        }
+        tmp_path = unique_temp_path(manifest_path)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, manifest_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return manifest_path
+
+    def scan_upload(self, stream):
+        """
+        Writes the section objects while the upload streams in, one section
+        in memory at a time; the top-level fields are kept for the manifest.
+        """
+        scanner = SectionScanner(stream)
+        top_level, sections = {}, None
+        new_sections = 0
+        for key in scanner.members():
+            if key == "environment_context" and scanner.peek() == b"{" and sections is None:
+                top_level[key] = None  # keeps its position for iter_bytes
+                sections = {}
+                for name in scanner.members():
+                    sections[name], written = self.write_section(scanner.read_value())
+                    new_sections += written
+            else:
+                top_level[key] = scanner.read_value()
+        scanner.expect_end()
+        if sections is None or top_level["environment_context"] is not None:
+            # Not splittable (environment_context missing or not an object)
+            return {"section_hashes": None, "content_hash": snapshot_content_hash(top_level, {}), "top_level": None}
+        return {
+            "section_hashes": sections,
+            "content_hash": snapshot_content_hash(top_level, sections),
+            "sections": len(sections),
+            "new_sections": new_sections,
+            "top_level": top_level,
+        }
+
+    def save_stream(self, snapshot_id, src, hash_sections=True):
+        # Stream + validate exactly like the plain store; the sections are split off on the way
+        saved = super().save_stream(snapshot_id, src)
+        top_level = saved.pop("top_level")
+        manifest_path = self.root / (snapshot_id + MANIFEST_SUFFIX)
+        if top_level is None:
+            # Keep the full compressed copy as the only version
+            if manifest_path.exists():
+                manifest_path.unlink()
+            return saved
+
+        self.write_manifest(snapshot_id, top_level, saved["section_hashes"])
+        # The manifest now fully describes the snapshot; drop the full copy
+        saved["path"].unlink()
+        saved.update(path=manifest_path, encoding="manifest", stored_bytes=manifest_path.stat().st_size)
+        return saved
+
+    def save_document(self, snapshot_id, snapshot, section_hashes=None, raw_bytes=None):
+        """
+        Writes only the sections that are not stored yet. Sections listed in
+        `section_hashes` whose object already exists are neither serialized
+        nor hashed again, which is what makes storing a small delta cheap.
+        The document's size is `raw_bytes` when the caller knows it, else the
+        length of the serialized document.
+        """
+        env = snapshot.get("environment_context")
+        if not isinstance(env, dict):
+            return super().save_document(snapshot_id, snapshot)
+        if raw_bytes is None:
+            raw_bytes = len(json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+        section_hashes = section_hashes or {}
+
+        sections = {}
+        new_sections = 0
+        for name, value in env.items():
+            digest = section_hashes.get(name)
+            if digest and self.object_path(digest).exists():
+                sections[name] = digest
+            else:
+                sections[name], written = self.write_section(value)
+                new_sections += written
+        manifest_path = self.write_manifest(snapshot_id, snapshot, sections)
+
+        return {
+            "id": snapshot_id,
+            "path": manifest_path,
+            "encoding": "manifest",
+            "stored_bytes": manifest_path.stat().st_size,
+            "raw_bytes": raw_bytes,
+            "sections": len(sections),
+            "new_sections": new_sections,
+            "section_hashes": sections,
+            "content_hash": snapshot_content_hash(snapshot, sections),
+        }
+
+    def iter_bytes(self, snapshot_id, chunk_size=64 * 1024):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            yield from super().iter_bytes(snapshot_id, chunk_size)
+            return
+
+        # Rebuild the JSON document piece by piece; one section in memory at a time
+        manifest = self.read_manifest(snapshot_id)
+        yield b"{"
+        for i, (key, value) in enumerate(manifest["top_level"].items()):
+            yield (b"," if i else b"") + json.dumps(key).encode("utf-8") + b":"
+            if key != "environment_context":
+                yield json.dumps(value, ensure_ascii=False).encode("utf-8")
+                continue
+            yield b"{"
+            for j, (name, digest) in enumerate(manifest["sections"].items()):
+                yield (b"," if j else b"") + json.dumps(name).encode("utf-8") + b":"
+                yield self.read_section_bytes(digest)
+            yield b"}"
+        yield b"}"
+
+    def open(self, snapshot_id):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            return super().open(snapshot_id)
+        return io.BytesIO(b"".join(self.iter_bytes(snapshot_id)))
+
+    def load(self, snapshot_id):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            return super().load(snapshot_id)
+        manifest = self.read_manifest(snapshot_id)
+        snapshot = dict(manifest["top_level"])
+        if "environment_context" in snapshot:
+            snapshot["environment_context"] = {
+                name: self.read_section(digest) for name, digest in manifest["sections"].items()
+            }
+        return snapshot
+
+    def section_hashes(self, snapshot_id):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            return super().section_hashes(snapshot_id)
+        # Answered from the manifest alone, no section is read
+        return dict(self.read_manifest(snapshot_id)["sections"])
+
+    def top_level(self, snapshot_id):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            return super().top_level(snapshot_id)
+        top_level = self.read_manifest(snapshot_id)["top_level"]
+        return {k: v for k, v in top_level.items() if k != "environment_context"}
+
+    def load_partial(self, snapshot_id, wanted):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            return super().load_partial(snapshot_id, wanted)
+        # Each section is its own object; the others are never opened
+        manifest = self.read_manifest(snapshot_id)
+        sections = {name: self.read_section(digest) for name, digest in manifest["sections"].items() if wanted(name)}
+        return partial_snapshot(manifest["top_level"], sections)
+
+    def content_hash(self, snapshot_id):
+        path, encoding = self.path_for(snapshot_id)
+        if encoding != "manifest":
+            return super().content_hash(snapshot_id)
+        manifest = self.read_manifest(snapshot_id)
+        return snapshot_content_hash(manifest["top_level"], manifest["sections"])
+
+    def storage_stats(self):
+        object_files = [p for p in self.objects.glob("*/*.json.gz")]
+        return {
+            "objects": len(object_files),
+            "object_bytes": sum(p.stat().st_size for p in object_files),
+            "manifests": len(list(self.root.glob("*" + MANIFEST_SUFFIX))),
+        }
@@ -0,0 +1,76 @@
+"""
+Local stand-in for the OpenAI chat completions API, for offline testing and
+benchmarks of /explain. Streams a canned answer with configurable latency.
+
+    uvicorn stub_llm_server:app --port 9000
+    OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=stub uvicorn enveye_backend:app
+
+Environment:
+    STUB_LLM_FIRST_TOKEN_MS  delay before the first token (default 300)
+    STUB_LLM_TOKEN_MS        delay between tokens (default 20)
+    STUB_LLM_TOKENS          number of tokens in the answer (default 50)
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Body
+from fastapi.responses import StreamingResponse
+
+app = FastAPI(title="EnvEye - Stub LLM")
+
+FIRST_TOKEN_MS = float(os.getenv("STUB_LLM_FIRST_TOKEN_MS", "300"))
+TOKEN_MS = float(os.getenv("STUB_LLM_TOKEN_MS", "20"))
+TOKENS = int(os.getenv("STUB_LLM_TOKENS", "50"))
+
+
+def answer_tokens(prompt):
+    words = ["Stub", "explanation", f"for a {len(prompt)}-character prompt."]
+    filler = ["The", "diff", "shows", "configuration", "drift", "between", "the", "two", "hosts."]
+    while len(words) < TOKENS:
+        words.append(filler[len(words) % len(filler)])
+    return [w + " " for w in words[:TOKENS]]
+
+
+def chunk(completion_id, model, content=None, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(payload: dict = Body(...)):
+    model = payload.get("model", "stub")
+    prompt = "".join(m.get("content") or "" for m in payload.get("messages", []))
+    tokens = answer_tokens(prompt)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if not payload.get("stream"):
+        await asyncio.sleep((FIRST_TOKEN_MS + TOKEN_MS * len(tokens)) / 1000)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": "stop"}],
+        }
+
+    async def events():
+        await asyncio.sleep(FIRST_TOKEN_MS / 1000)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(TOKEN_MS / 1000)
+            yield f"data: {json.dumps(chunk(completion_id, model, token))}\n\n"
+        yield f"data: {json.dumps(chunk(completion_id, model, finish_reason='stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
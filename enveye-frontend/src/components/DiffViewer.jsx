@@ -7,6 +7,8 @@ function DiffViewer({ diffData }) {
   const [loading, setLoading] = useState(false);
   const [errorMsg, setErrorMsg] = useState("");
   const [errorScreenshot, setScreenshot] = useState(null);
+  const [ocrText, setOcrText] = useState("");
+  const [ocrLoading, setOcrLoading] = useState(false);
   const [logPath, setLogPath] = useState("");
 
   // Scrolls to AI explanation after it gets updated
@@ -44,8 +46,34 @@ function DiffViewer({ diffData }) {
         log_path: logPath || ""
       };
 
-      const response = await axios.post(`${API_BASE_URL}/explain`, payload);
-      setExplanation(response.data.explanation);
+      // Stream tokens over SSE so the first words show up as soon as the model sends them
+      const response = await fetch(`${API_BASE_URL}/explain/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(payload)
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`Explain request failed with status ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const event of events) {
+          const lines = event.split("\n");
+          const type = lines.find((l) => l.startsWith("event: "))?.slice(7) || "message";
+          const data = JSON.parse(lines.find((l) => l.startsWith("data: "))?.slice(6) || "{}");
+          if (type === "error") throw new Error(data.error);
+          if (data.delta) setExplanation((prev) => prev + data.delta);
+        }
+      }
     } catch (error) {
       console.error("Error explaining differences:", error);
       alert("Failed to get AI explanation.");
@@ -54,6 +82,20 @@ function DiffViewer({ diffData }) {
     }
   };
 
+  // Start OCR as soon as a screenshot is attached; Explain reuses the cached text
+  const startOcr = async (image) => {
+    setOcrText("");
+    setOcrLoading(true);
+    try {
+      const res = await axios.post(`${API_BASE_URL}/ocr`, { image });
+      setOcrText(res.data.text || "");
+    } catch (err) {
+      console.error("OCR error:", err);
+    } finally {
+      setOcrLoading(false);
+    }
+  };
+
   // Handling the screenshot file upload
   const handleFileChange = (e) => {
     const file = e.target.files[0];
@@ -63,7 +105,10 @@ function DiffViewer({ diffData }) {
         return;
       }
       const reader = new FileReader();
-      reader.onloadend = () => setScreenshot(reader.result); // Base64 string
+      reader.onloadend = () => {
+        setScreenshot(reader.result); // Base64 string
+        startOcr(reader.result);
+      };
       reader.readAsDataURL(file);
     } else {
       alert("Please upload a valid image file.");
@@ -188,6 +233,12 @@ function DiffViewer({ diffData }) {
             {errorScreenshot && (
               <p className="text-xs text-gray-500 mt-1">✅ Screenshot uploaded</p>
             )}
+            {ocrLoading && (
+              <p className="text-xs text-gray-500 mt-1">🔎 Reading text from screenshot...</p>
+            )}
+            {!ocrLoading && ocrText && (
+              <p className="text-xs text-gray-600 mt-1 italic">Detected text: {ocrText}</p>
+            )}
           </div>
 
           {errorScreenshot && (
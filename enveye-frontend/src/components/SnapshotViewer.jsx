@@ -19,7 +19,7 @@ function SnapshotViewer() {
   }, []);
 
   const handleDownload = (snapshot) => {
-    const downloadUrl = `${API_BASE_URL}/snapshots/${snapshot}`;
+    const downloadUrl = `${API_BASE_URL}/download_snapshot/${snapshot}`;
     const link = document.createElement('a');
     link.href = downloadUrl;
     link.setAttribute('download', snapshot);